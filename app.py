@@ -2,7 +2,7 @@
 import os, os.path
 import re
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, g
 from werkzeug.utils import secure_filename
 from pypdf import PdfReader
 import docx
@@ -12,16 +12,37 @@ from pptx import Presentation
 import time
 import random
 import io
+import json
+import queue
+import socket
+import hashlib
+import gzip
+import sqlite3
 import logging
-from threading import Thread
+import bisect
+import contextvars
+import cProfile
+import pstats
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import multiprocessing
 from datetime import datetime
 from tempfile import SpooledTemporaryFile
+import chromadb
+import httpx
+import numpy as np
 from flask_mail import Mail, Message
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import CharacterTextSplitter
-from openai import OpenAI
+import pdf_worker
+from openai import OpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 from dotenv import load_dotenv
+import click
 
 
 # load environment variables from .env for the OpenAI code
@@ -54,9 +75,13 @@ app.config.update(
 mail = Mail(app)
 
 
-app.config["UPLOAD_FOLDER"] = os.path.join(BASEDIR, "uploads")
+app.config["UPLOAD_FOLDER"] = os.getenv("UPLOAD_FOLDER") or os.path.join(BASEDIR, "uploads")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+# SQLite stores that must survive a redeploy live here; mount it as a volume
+DATA_DIR = os.path.abspath(os.getenv("DATA_DIR") or os.path.join(BASEDIR, "data"))
+os.makedirs(DATA_DIR, exist_ok=True)
+
 # Allowed extensions (unchanged)
 ALLOWED_EXTENSIONS = {"pdf", "docx", "txt", "pptx"}
 
@@ -71,90 +96,1614 @@ logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(message)s"
 )
 
-PROGRESS = {} 
+# ---------- Progress store ----------
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", "3600"))  # seconds since the last update
+
+
+def merge_progress(old, fields):
+    """
+    State after an update: pct never moves backwards, except when the job ends in an error,
+    which reports its own pct (an error after completion must not still read 100%).
+    """
+    state = {**old, **fields}
+    if not (fields.get("phase") == "error" and "pct" in fields):
+        state["pct"] = max(int(old.get("pct", 0)), int(fields.get("pct", 0)))
+    return state
+
+
+class ProgressSubscribers:
+    """
+    Publish/subscribe hook for progress updates within this process.
+    Each subscriber gets a small queue; a slow reader only ever sees the latest states.
+    """
+
+    def __init__(self):
+        self._subs = {}  # job_id -> set of queues
+        self._subs_lock = Lock()
+
+    def subscribe(self, job_id):
+        q = queue.Queue(maxsize=16)
+        with self._subs_lock:
+            self._subs.setdefault(job_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, job_id, q):
+        with self._subs_lock:
+            subs = self._subs.get(job_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    self._subs.pop(job_id, None)
+
+    def publish(self, job_id, state):
+        with self._subs_lock:
+            subs = list(self._subs.get(job_id, ()))
+        for q in subs:
+            while True:
+                try:
+                    q.put_nowait(dict(state))
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+class MemoryProgressStore(ProgressSubscribers):
+    """Per-process progress map. Fine for a single web process that also runs the jobs."""
+
+    shared = False
+
+    def __init__(self, ttl=3600):
+        super().__init__()
+        self.ttl = ttl
+        self._items = {}  # job_id -> (state, updated_at)
+        self._lock = Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, job_id):
+        with self._lock:
+            item = self._items.get(job_id)
+        return dict(item[0]) if item else None
+
+    def set(self, job_id, state):
+        """Replace the state for job_id (used when a job starts over)."""
+        with self._lock:
+            self._items[job_id] = (dict(state), time.monotonic())
+            self._maybe_expire()
+        self.publish(job_id, state)
+
+    def update(self, job_id, **fields):
+        """Merge fields into the state (see merge_progress)."""
+        with self._lock:
+            old = self._items.get(job_id, ({}, 0))[0]
+            state = merge_progress(old, fields)
+            self._items[job_id] = (state, time.monotonic())
+            self._maybe_expire()
+        self.publish(job_id, state)
+        return dict(state)
+
+    def pop(self, job_id):
+        with self._lock:
+            item = self._items.pop(job_id, None)
+        return item[0] if item else None
+
+    def _maybe_expire(self):
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for job_id in [j for j, (_, ts) in self._items.items() if now - ts > self.ttl]:
+            self._items.pop(job_id, None)
+
+
+class SQLiteProgressStore(ProgressSubscribers):
+    """
+    Progress shared by every process on the host, so /progress works behind N workers.
+    Subscribers are only notified of updates made in this process; streams re-read
+    the table periodically to pick up the rest.
+    """
+
+    shared = True
+
+    def __init__(self, path, ttl=3600):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._last_sweep = 0.0
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                "job_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS progress_age ON progress(updated_at)")
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    def get(self, job_id):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT state FROM progress WHERE job_id = ? AND updated_at > ?",
+                (job_id, time.time() - self.ttl),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, job_id, state):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO progress (job_id, state, updated_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(state), time.time()),
+            )
+            self._maybe_expire(db)
+        self.publish(job_id, state)
+
+    def update(self, job_id, **fields):
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT state FROM progress WHERE job_id = ?", (job_id,)).fetchone()
+            old = json.loads(row[0]) if row else {}
+            state = merge_progress(old, fields)
+            db.execute(
+                "INSERT OR REPLACE INTO progress (job_id, state, updated_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(state), time.time()),
+            )
+            db.execute("COMMIT")
+            self._maybe_expire(db)
+        self.publish(job_id, state)
+        return state
+
+    def pop(self, job_id):
+        state = self.get(job_id)
+        with self._db() as db:
+            db.execute("DELETE FROM progress WHERE job_id = ?", (job_id,))
+        return state
+
+    def _maybe_expire(self, db):
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        db.execute("DELETE FROM progress WHERE updated_at < ?", (now - self.ttl,))
+
+
+def make_progress_store():
+    """
+    PROGRESS_BACKEND=sqlite (default), shared with the jobs-worker process and every web worker,
+    or memory when jobs run inside the single web process (JOBS_IN_WEB=1, python app.py).
+    """
+    backend = (os.getenv("PROGRESS_BACKEND") or "sqlite").lower()
+    if backend == "memory":
+        return MemoryProgressStore(ttl=PROGRESS_TTL)
+    path = os.getenv("PROGRESS_DB_PATH") or os.path.join(DATA_DIR, "progress.sqlite3")
+    return SQLiteProgressStore(path, ttl=PROGRESS_TTL)
+
+
+PROGRESS = make_progress_store()
+
 
-def set_progress(job_id, phase, pct):
-    PROGRESS[job_id] = {**PROGRESS.get(job_id, {}), "phase": phase, "pct": int(pct)}
+def set_progress(job_id, phase, pct, **extra):
+    PROGRESS.update(job_id, phase=phase, pct=int(pct), **extra)
     logging.info("SET_PROGRESS job=%s phase=%s pct=%s", job_id, phase, pct)
 
 
+# ---------- Metrics ----------
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # when set, /metrics requires "Authorization: Bearer <token>"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # fraction of requests run under cProfile
+PROFILE_TOP = 25  # functions logged per profiled request
+
+
+class Metrics:
+    """
+    In-process latency histograms per stage (fed by every finished Timer) and counters,
+    rendered in the Prometheus text format on /metrics. Each process keeps its own.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._stages = {}  # stage -> {"counts": [per bucket..., +Inf], "sum": seconds}
+        self._counters = {}  # (name, ((label, value), ...)) -> total
+
+    def observe(self, stage, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._stages.get(stage)
+            if h is None:
+                h = self._stages[stage] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            h["counts"][i] += 1
+            h["sum"] += seconds
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def summary(self):
+        """{stage: {"count", "mean", "p50", "p95"}}, quantiles as bucket upper bounds."""
+        with self._lock:
+            stages = {k: (list(v["counts"]), v["sum"]) for k, v in self._stages.items()}
+        out = {}
+        for stage, (counts, total) in sorted(stages.items()):
+            n = sum(counts)
+            out[stage] = {"count": n, "mean": round(total / n, 4) if n else 0.0}
+            for q in (0.5, 0.95):
+                seen = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    seen += c
+                    if seen >= q * n:
+                        out[stage][f"p{int(q * 100)}"] = bound
+                        break
+        return out
+
+    def render(self, gauges=None):
+        """Prometheus text exposition; gauges maps a prefix to a stats() dict of numbers."""
+        with self._lock:
+            stages = {k: (list(v["counts"]), v["sum"]) for k, v in self._stages.items()}
+            counters = dict(self._counters)
+        lines = ["# TYPE app_stage_seconds histogram"]
+        for stage, (counts, total) in sorted(stages.items()):
+            label = _prom_label(stage)
+            seen = 0
+            for bound, c in zip(self.buckets, counts):
+                seen += c
+                lines.append(f'app_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {seen}')
+            lines.append(f'app_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {sum(counts)}')
+            lines.append(f'app_stage_seconds_sum{{stage="{label}"}} {total:.6f}')
+            lines.append(f'app_stage_seconds_count{{stage="{label}"}} {sum(counts)}')
+        for name in sorted({n for n, _ in counters}):
+            lines.append(f"# TYPE app_{name}_total counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    tags = ",".join(f'{k}="{_prom_label(v)}"' for k, v in labels)
+                    lines.append(f"app_{name}_total{{{tags}}} {value}" if tags else f"app_{name}_total {value}")
+        for prefix, stats in (gauges or {}).items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE app_{prefix}_{key} gauge")
+                    lines.append(f"app_{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+METRICS = Metrics()
+_SPAN = contextvars.ContextVar("timer_span", default=None)
+
+
 class Timer:
-    def __init__(self, name):
+    """
+    Times one stage. A Timer started while another is running (same thread or task) nests
+    under it and logs indented; every finished Timer feeds the stage histogram on /metrics.
+    quiet skips the log line for hot stages such as single embedding batches.
+    """
+
+    def __init__(self, name, quiet=False):
         self.name = name
+        self.quiet = quiet
+        self.parent = _SPAN.get()
+        self.depth = self.parent.depth + 1 if self.parent is not None else 0
+        _SPAN.set(self)
         self.start = time.perf_counter()
 
     def done(self, extra=""):
         elapsed = time.perf_counter() - self.start
-        log.info("[TIMER] %-20s %7.3fs %s", self.name, elapsed, extra)
+        # Children that never finished are closed along with this span
+        span = _SPAN.get()
+        while span is not None and span is not self:
+            span = span.parent
+        if span is self:
+            _SPAN.set(self.parent)
+        METRICS.observe(self.name, elapsed)
+        if not self.quiet:
+            log.info("[TIMER] %-20s %7.3fs %s", "  " * self.depth + self.name, elapsed, extra)
         return elapsed
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.done()
+
+
+def timed_iter(items, spent, key):
+    """Yield from items, adding the time spent producing each one to spent[key]."""
+    it = iter(items)
+    while True:
+        t = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            spent[key] = spent.get(key, 0.0) + time.perf_counter() - t
+        yield item
+
+
+def record_llm_usage(resp, purpose):
+    """Count prompt/completion tokens reported on a (non-streamed) chat completion."""
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        METRICS.inc("llm_tokens", usage.prompt_tokens or 0, purpose=purpose, kind="prompt")
+        METRICS.inc("llm_tokens", usage.completion_tokens or 0, purpose=purpose, kind="completion")
+
 
 def allowed_file(filename: str) -> bool:
     """Check extension against the allowed set."""
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text from PDF pages (no OCR)."""
-    try:
-        with open(file_path, "rb") as f:
-            reader = PdfReader(f)
-            return "".join([(page.extract_text() or "") for page in reader.pages])
-    except Exception as e:
-        return f"Error extracting text from PDF: {e}"
+# ---------- Streaming extraction ----------
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = 8
+TXT_BLOCK_CHARS = 64 * 1024
 
+_EXTRACT_POOL = None
+_EXTRACT_POOL_LOCK = Lock()
+
+
+def get_extract_pool():
+    """Process pool for PDF pages; spawn (not fork) because the web process is multithreaded."""
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if _EXTRACT_POOL is None:
+            _EXTRACT_POOL = ProcessPoolExecutor(
+                max_workers=EXTRACT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _EXTRACT_POOL
 
-def extract_text_from_docx(file_path: str) -> str:
-    """Extract text from DOCX paragraphs."""
-    try:
-        d = docx.Document(file_path)
-        return "\n".join([p.text for p in d.paragraphs if p.text.strip()])
-    except Exception as e:
-        return f"Error extracting text from DOCX: {e}"
 
-def extract_text_from_pptx(path: str) -> str:
+def iter_pdf_pages(path: str, offload: bool = False):
+    """
+    Yield page records in order; large PDFs are extracted in page ranges across processes.
+    offload sends a small PDF to the pool as one task too, for callers extracting several files at once.
+    """
+    with open(path, "rb") as f:
+        total = len(PdfReader(f).pages)
+
+    if EXTRACT_PROCESSES <= 1 or total <= PDF_PAGES_PER_TASK * 2:
+        if offload and EXTRACT_PROCESSES > 1:
+            pages = get_extract_pool().submit(pdf_worker.extract_pages, path, 0, total).result()
+        else:
+            pages = pdf_worker.extract_pages(path, 0, total)
+        for number, text in pages:
+            yield {"kind": "page", "number": number, "total": total, "text": text}
+        return
+
+    pool = get_extract_pool()
+    ranges = iter(range(0, total, PDF_PAGES_PER_TASK))
+    window = []  # futures in page order; bounded so memory stays flat for huge files
+    for _ in range(EXTRACT_PROCESSES * 2):
+        start = next(ranges, None)
+        if start is not None:
+            window.append(pool.submit(pdf_worker.extract_pages, path, start, start + PDF_PAGES_PER_TASK))
+    while window:
+        pages = window.pop(0).result()
+        start = next(ranges, None)
+        if start is not None:
+            window.append(pool.submit(pdf_worker.extract_pages, path, start, start + PDF_PAGES_PER_TASK))
+        for number, text in pages:
+            yield {"kind": "page", "number": number, "total": total, "text": text}
+
+
+def iter_docx_sections(path: str, paragraphs_per_section: int = 50):
+    """DOCX has no pages; yield groups of non-empty paragraphs instead."""
+    d = docx.Document(path)
+    paras = [p.text for p in d.paragraphs if p.text.strip()]
+    total = max(1, -(-len(paras) // paragraphs_per_section))
+    for n, i in enumerate(range(0, len(paras), paragraphs_per_section), start=1):
+        yield {"kind": "section", "number": n, "total": total,
+               "text": "\n".join(paras[i:i + paragraphs_per_section])}
+
+
+def iter_pptx_slides(path: str):
     prs = Presentation(path)
-    parts = []
+    total = len(prs.slides)
     for i, slide in enumerate(prs.slides, start=1):
-        parts.append(f"\n--- Slide {i} ---\n")
+        parts = [f"--- Slide {i} ---"]
         for shape in slide.shapes:
             if hasattr(shape, "text") and shape.text:
                 parts.append(shape.text.strip())
-    return "\n".join(parts).strip()
+        yield {"kind": "slide", "number": i, "total": total, "text": "\n".join(parts)}
+
+
+def iter_txt_blocks(path: str):
+    total = max(1, -(-os.path.getsize(path) // TXT_BLOCK_CHARS))
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        n = 0
+        for block in iter(lambda: f.read(TXT_BLOCK_CHARS), ""):
+            n += 1
+            yield {"kind": "block", "number": n, "total": max(total, n), "text": block}
+
+
+def iter_file_records(path: str, offload: bool = False):
+    """Stream page/slide/section records from an uploaded file without building one big string."""
+    lower = path.lower()
+    if lower.endswith(".pdf"):
+        return iter_pdf_pages(path, offload)
+    if lower.endswith(".docx"):
+        return iter_docx_sections(path)
+    if lower.endswith(".pptx"):
+        return iter_pptx_slides(path)
+    if lower.endswith(".txt"):
+        return iter_txt_blocks(path)
+    raise ValueError("Unsupported file type.")
 
 
-def process_uploaded_file(file_storage):
+def upload_path(filename):
     """
-    Save the uploaded file securely and extract its text content.
-    Returns (text, base_name_without_ext, sanitized_filename).
+    A fresh path under UPLOAD_FOLDER for an upload named filename. Jobs read the file after
+    the request has returned, so two uploads with the same name must never share a path.
     """
-    filename = secure_filename(file_storage.filename)
-    save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file_storage.save(save_path)
+    return os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid.uuid4().hex[:12]}_{filename}")
 
-    lower = filename.lower()
-    if lower.endswith(".pdf"):
-        text = extract_text_from_pdf(save_path)
-    elif lower.endswith(".docx"):
-        text = extract_text_from_docx(save_path)
-    elif lower.endswith(".pptx"):
-        text = extract_text_from_pptx(save_path)
-    elif lower.endswith(".txt"):
-        with open(save_path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-    else:
-        text = "Unsupported file type."
 
-    base_name_without_ext = os.path.splitext(filename)[0]
-    return text, base_name_without_ext, filename
+def save_uploaded_file(file_storage):
+    """Save the uploaded file securely under its own path. Returns (save_path, sanitized_filename)."""
+    filename = secure_filename(file_storage.filename)
+    save_path = upload_path(filename)
+    file_storage.save(save_path)
+    METRICS.inc("bytes", os.path.getsize(save_path), kind="upload")
+    return save_path, filename
+
+
+# ---------- Chunking ----------
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+STRUCTURAL_KINDS = {"page", "slide"}  # records whose boundaries chunks should not straddle needlessly
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TOKENIZER = None
+_TOKENIZER_LOCK = Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the embedding model's tokenizer, or an estimate when it is unavailable."""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        with _TOKENIZER_LOCK:
+            if _TOKENIZER is None:
+                try:
+                    import tiktoken
+                    _TOKENIZER = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logging.warning("tiktoken unavailable (%s), estimating token counts", e)
+                    _TOKENIZER = False
+    if _TOKENIZER is False:
+        return estimate_tokens(text)
+    return len(_TOKENIZER.encode(text, disallowed_special=()))
+
+
+def _split_units(text, max_tokens):
+    """Break text into (unit, tokens) pieces: lines, then sentences, then word runs, none over max_tokens."""
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        n = count_tokens(line)
+        if n <= max_tokens:
+            yield line, n
+            continue
+        for sentence in _SENTENCE_END.split(line):
+            n = count_tokens(sentence)
+            if n <= max_tokens:
+                yield sentence, n
+                continue
+            words, run = sentence.split(), []
+            budget = max_tokens * 3  # characters; conservative for the ~4 chars/token average
+            for w in words:
+                if run and sum(len(x) + 1 for x in run) + len(w) > budget:
+                    piece = " ".join(run)
+                    yield piece, count_tokens(piece)
+                    run = []
+                run.append(w)
+            if run:
+                piece = " ".join(run)
+                yield piece, count_tokens(piece)
+
+
+def iter_structured_chunks(records, max_tokens=None, overlap_tokens=None):
+    """
+    Pack a stream of records into (text, metadata) chunks of at most max_tokens.
+    A page or slide that fits in the current chunk is never split; one that does not
+    starts a new chunk, and an oversized one is split on line and sentence boundaries
+    with overlap_tokens of overlap. Other records (txt blocks, docx sections) are joined
+    as a continuous stream. metadata is {"kind", "start", "end"} with record numbers.
+    Memory stays bounded by one record plus one chunk.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    cur, cur_tokens = [], 0  # cur holds (unit, tokens, record number)
+    kind, carry = None, None
+
+    def emit(keep_overlap):
+        nonlocal cur, cur_tokens
+        text = "\n".join(u for u, _, _ in cur)
+        meta = {"kind": kind, "start": cur[0][2], "end": cur[-1][2]}
+        tail, tail_tokens = [], 0
+        if keep_overlap:
+            for unit in reversed(cur[1:]):
+                if tail_tokens + unit[1] > overlap_tokens:
+                    break
+                tail.insert(0, unit)
+                tail_tokens += unit[1]
+        cur, cur_tokens = tail, tail_tokens
+        return text, meta
+
+    def pack(text, number, structural):
+        nonlocal cur_tokens
+        units = list(_split_units(text, max_tokens))
+        if structural and cur and cur_tokens + sum(n for _, n in units) > max_tokens:
+            yield emit(keep_overlap=False)
+        for unit, n in units:
+            if cur and cur_tokens + n > max_tokens:
+                yield emit(keep_overlap=True)
+            cur.append((unit, n, number))
+            cur_tokens += n
+
+    for rec in records:
+        kind = rec["kind"]
+        text = rec["text"] or ""
+        if kind in STRUCTURAL_KINDS:
+            yield from pack(text, rec["number"], structural=True)
+            continue
+        # Continuous stream: hold back the text after the last line break (or space) so a
+        # record boundary never cuts a word; it is packed with the next record
+        if carry:
+            text = carry[0] + text
+        cut = max(text.rfind("\n"), text.rfind(" ") if "\n" not in text else -1)
+        carry = (text[cut + 1:], rec["number"]) if cut >= 0 and cut < len(text) - 1 else None
+        yield from pack(text[:cut + 1] if carry else text, rec["number"], structural=False)
+    if carry:
+        yield from pack(carry[0], carry[1], structural=False)
+    if cur:
+        yield emit(keep_overlap=False)
+
+
+BATCH_EXTRACT_WORKERS = int(os.getenv("BATCH_EXTRACT_WORKERS", "4"))  # files extracted at once in a batch
+
+
+def _file_chunks(path, name, file_hash=None):
+    file_hash, source = file_chunks(path, file_hash, track=_counted, offload=True)
+    chunks = []
+    for text, meta in source:
+        if name:
+            meta["source"] = name
+        chunks.append((text, meta))
+    return file_hash, chunks
+
+
+def _counted(records):
+    for rec in records:
+        METRICS.inc("extracted_chars", len(rec["text"] or ""))
+        yield rec
+
+
+def iter_batch_chunks(files, on_file=None, workers=None):
+    """
+    (text, metadata) chunks of several [path, name] (or [path, name, file_hash]) files, file
+    after file, with metadata["source"] set to the name. Up to workers files are extracted
+    and chunked ahead of the consumer, so downstream embedding batches fill up from many
+    files at once. on_file(index, n_chunks, error, file_hash) runs as each file's chunks are
+    handed on; a file that fails to parse is reported there and skipped.
+    """
+    workers = workers or BATCH_EXTRACT_WORKERS
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-extract") as pool:
+        pending = iter(enumerate(files))
+        window = []  # futures in file order
+
+        def submit_next():
+            item = next(pending, None)
+            if item is not None:
+                i, (path, name, *file_hash) = item
+                window.append((i, pool.submit(_file_chunks, path, name, *file_hash)))
+
+        for _ in range(workers):
+            submit_next()
+        while window:
+            i, fut = window.pop(0)
+            submit_next()
+            try:
+                (file_hash, chunks), error = fut.result(), None
+            except Exception as e:
+                logging.warning("Batch: could not extract %s: %s", files[i][1] or files[i][0], e)
+                file_hash, chunks, error = None, [], str(e)
+            if on_file:
+                on_file(i, len(chunks), error, file_hash)
+            yield from chunks
+
+
+# ---------- OpenAI clients ----------
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+_HTTP_CLIENT = None
+_OPENAI_CLIENT = None
+_EMBEDDINGS = None
+_CLIENT_LOCK = Lock()
+
+
+def get_http_client():
+    """One pooled HTTP client (keep-alive, TLS reuse) shared by chat and embedding calls."""
+    global _HTTP_CLIENT
+    with _CLIENT_LOCK:
+        if _HTTP_CLIENT is None:
+            _HTTP_CLIENT = httpx.Client(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+            )
+        return _HTTP_CLIENT
 
 
 def get_openai_client():
-    """Create an OpenAI client using the API key in the environment."""
+    """Return the process-wide OpenAI client using the API key in the environment."""
+    global _OPENAI_CLIENT
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY not set in environment.")
-    return OpenAI(api_key=api_key)
+    http_client = get_http_client()
+    with _CLIENT_LOCK:
+        if _OPENAI_CLIENT is None or _OPENAI_CLIENT.api_key != api_key:
+            _OPENAI_CLIENT = OpenAI(api_key=api_key, http_client=http_client)
+        return _OPENAI_CLIENT
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embedding vectors keyed by (model, sha256(text)).
+    Vectors live in a fixed-size float32 memmap per model; a SQLite index maps keys
+    to slots and tracks last use, so the least recently used slot is reused when full.
+    Reads and writes of the memmap happen inside a SQLite write transaction, so another
+    process cannot evict and overwrite a slot between its lookup and the copy.
+    """
+
+    def __init__(self, root, max_entries=20000):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._arrays = {}  # model -> np.memmap
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS models (
+                    model    TEXT PRIMARY KEY,
+                    dim      INTEGER NOT NULL,
+                    capacity INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    model     TEXT NOT NULL,
+                    key       TEXT NOT NULL,
+                    slot      INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, key)
+                );
+                CREATE INDEX IF NOT EXISTS entries_lru ON entries(model, last_used);
+                """
+            )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def _array(self, db, model, dim=None):
+        """
+        Open the memmap for model, or None if there is none of the right size. With dim (vectors
+        about to be written) a missing cache, or one holding vectors of another size, is started
+        over. Caller holds the lock and a write transaction.
+        """
+        row = db.execute("SELECT dim, capacity FROM models WHERE model = ?", (model,)).fetchone()
+        path = os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", model) + ".f32")
+        if row and (dim is None or row[0] == dim):
+            arr = self._arrays.get(model)
+            if arr is not None and arr.shape == (row[1], row[0]):
+                return arr
+            if os.path.exists(path) and os.path.getsize(path) == row[0] * row[1] * 4:
+                arr = self._arrays[model] = np.memmap(path, dtype=np.float32, mode="r+", shape=(row[1], row[0]))
+                return arr
+        if dim is None:
+            return None
+        db.execute("DELETE FROM entries WHERE model = ?", (model,))
+        db.execute(
+            "INSERT OR REPLACE INTO models (model, dim, capacity) VALUES (?, ?, ?)",
+            (model, dim, self.max_entries),
+        )
+        # A new file, so processes still mapping the old one never see it change size
+        tmp = f"{path}.{os.getpid()}.tmp"
+        arr = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(self.max_entries, dim))
+        os.replace(tmp, path)
+        self._arrays[model] = arr
+        return arr
+
+    def get_many(self, model, texts):
+        """Return one vector (list of floats) or None per text."""
+        keys = [chunk_sha256(t) for t in texts]
+        out = [None] * len(texts)
+        with self._lock, self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            arr = self._array(db, model)
+            if arr is not None:
+                slots = {}
+                uniq = list(set(keys))
+                for i in range(0, len(uniq), 500):
+                    part = uniq[i:i + 500]
+                    marks = ",".join("?" * len(part))
+                    slots.update(db.execute(
+                        f"SELECT key, slot FROM entries WHERE model = ? AND key IN ({marks})",
+                        (model, *part),
+                    ).fetchall())
+                for i, k in enumerate(keys):
+                    if k in slots:
+                        out[i] = arr[slots[k]].tolist()
+                if slots:
+                    now = time.time()
+                    db.executemany(
+                        "UPDATE entries SET last_used = ? WHERE model = ? AND key = ?",
+                        [(now, model, k) for k in slots],
+                    )
+            db.execute("COMMIT")
+            found = sum(v is not None for v in out)
+            self.hits += found
+            self.misses += len(out) - found
+        return out
+
+    def put_many(self, model, texts, vectors):
+        fresh = {}
+        for t, v in zip(texts, vectors):
+            fresh[chunk_sha256(t)] = v
+        if not fresh:
+            return
+        dim = len(next(iter(fresh.values())))
+        with self._lock, self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                arr = self._array(db, model, dim=dim)
+                capacity = arr.shape[0]
+                used = db.execute("SELECT COUNT(*) FROM entries WHERE model = ?", (model,)).fetchone()[0]
+                now = time.time()
+                for k, v in fresh.items():
+                    row = db.execute(
+                        "SELECT slot FROM entries WHERE model = ? AND key = ?", (model, k)
+                    ).fetchone()
+                    if row:
+                        slot = row[0]
+                    elif used < capacity:
+                        slot = used
+                        used += 1
+                    else:
+                        old_key, slot = db.execute(
+                            "SELECT key, slot FROM entries WHERE model = ? ORDER BY last_used LIMIT 1",
+                            (model,),
+                        ).fetchone()
+                        db.execute("DELETE FROM entries WHERE model = ? AND key = ?", (model, old_key))
+                        self.evictions += 1
+                    arr[slot] = np.asarray(v, dtype=np.float32)
+                    db.execute(
+                        "INSERT OR REPLACE INTO entries (model, key, slot, last_used) VALUES (?, ?, ?, ?)",
+                        (model, k, slot, now),
+                    )
+                arr.flush()
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+EMBEDDING_CACHE = EmbeddingCache(
+    os.getenv("EMBED_CACHE_DIR") or os.path.join(DATA_DIR, "embedding_cache"),
+    max_entries=int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "20000")),
+)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding function that consults EMBEDDING_CACHE before calling the remote model."""
+
+    def __init__(self, inner, cache, model):
+        self.inner = inner
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(self.model, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            METRICS.inc("embed_tokens", sum(estimate_tokens(texts[i]) for i in missing))
+            with Timer("embed batch", quiet=True):
+                fresh = self.inner.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model, [texts[i] for i in missing], fresh)
+            for i, v in zip(missing, fresh):
+                vectors[i] = v
+        return vectors
+
+    def embed_query(self, text):
+        vector = self.cache.get_many(self.model, [text])[0]
+        if vector is None:
+            METRICS.inc("embed_tokens", estimate_tokens(text))
+            with Timer("embed query", quiet=True):
+                vector = self.inner.embed_query(text)
+            self.cache.put_many(self.model, [text], [vector])
+        return vector
+
+
+def get_embeddings():
+    """Return the process-wide cached embedding function (shares the pooled HTTP client)."""
+    global _EMBEDDINGS
+    client = get_openai_client()
+    http_client = get_http_client()
+    with _CLIENT_LOCK:
+        if _EMBEDDINGS is None:
+            remote = OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                openai_api_key=client.api_key,
+                http_client=http_client,
+            )
+            _EMBEDDINGS = CachedEmbeddings(remote, EMBEDDING_CACHE, EMBEDDING_MODEL)
+        return _EMBEDDINGS
+
+
+VECTORSTORE_MODE = os.getenv("VECTORSTORE_MODE", "shared")  # "shared" or "per_upload"
+CHROMA_DATA_DIR = os.path.abspath(os.getenv("CHROMA_DATA_DIR") or os.path.join(BASEDIR, "chroma_data"))
+SHARED_STORE_DIR = os.path.join(CHROMA_DATA_DIR, "store")  # the one Chroma database
+SHARED_DOCS_DIR = os.path.join(CHROMA_DATA_DIR, "docs")  # per-document side files (keyword index)
+SHARED_TRASH_DIR = os.path.join(CHROMA_DATA_DIR, "trash")  # deleted documents awaiting compaction
+
+_SHARED_CLIENT = None
+_SHARED_CLIENT_LOCK = Lock()
+
+
+def get_shared_chroma_client():
+    """The process-wide client for the shared store; opened once, never closed by the registry."""
+    global _SHARED_CLIENT
+    with _SHARED_CLIENT_LOCK:
+        if _SHARED_CLIENT is None:
+            os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+            _SHARED_CLIENT = chromadb.PersistentClient(path=SHARED_STORE_DIR)
+        return _SHARED_CLIENT
+
+
+def new_persist_dir(base):
+    """Storage location for a new upload: a document folder in the shared store, or its own Chroma directory."""
+    name = f"{base}_{uuid.uuid4().hex[:8]}"
+    if VECTORSTORE_MODE == "shared":
+        return os.path.join(SHARED_DOCS_DIR, name)
+    return os.path.abspath(f"./chroma_db_{name}")
+
+
+def is_shared_dir(persist_dir):
+    return os.path.dirname(os.path.abspath(persist_dir)) == SHARED_DOCS_DIR
+
+
+def shared_collection_name(persist_dir):
+    # Chroma names: 3-512 of [a-zA-Z0-9._-], alphanumeric at both ends (the uuid suffix is)
+    return "doc_" + re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(os.path.abspath(persist_dir)))[:500]
+
+
+class VectorStoreRegistry:
+    """
+    Bounded LRU of open Chroma stores keyed by persist_dir. Documents under SHARED_DOCS_DIR
+    are collections in the shared store; any other persist_dir is its own Chroma directory.
+    Stores idle for longer than idle_ttl seconds, or beyond max_open, are closed.
+    A store that is still in use when evicted is closed by its last user.
+    """
+
+    def __init__(self, max_open=32, idle_ttl=900):
+        self.max_open = max_open
+        self.idle_ttl = idle_ttl
+        self._stores = OrderedDict()  # persist_dir -> entry dict
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def open(self, persist_dir):
+        """Borrow the store for persist_dir, opening it on a miss."""
+        entry = self._acquire(os.path.abspath(persist_dir))
+        try:
+            yield entry["store"]
+        finally:
+            self._release(entry)
+
+    def _acquire(self, key):
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                self._stores.move_to_end(key)
+                entry["users"] += 1
+                self.hits += 1
+                stale = self._collect_evictions()
+            else:
+                self.misses += 1
+        if entry is not None:
+            for old in stale:
+                self._close_store(old)
+            return entry
+
+        if is_shared_dir(key):
+            store = Chroma(
+                client=get_shared_chroma_client(),
+                collection_name=shared_collection_name(key),
+                embedding_function=get_embeddings(),
+            )
+        else:
+            store = Chroma(embedding_function=get_embeddings(), persist_directory=key)
+
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                # Another thread opened it first; keep theirs
+                self._stores.move_to_end(key)
+                entry["users"] += 1
+                duplicate = store
+            else:
+                entry = {"store": store, "users": 1, "last_used": time.monotonic(), "evicted": False}
+                self._stores[key] = entry
+                duplicate = None
+            stale = self._collect_evictions()
+        if duplicate is not None:
+            self._close_store(duplicate)
+        for old in stale:
+            self._close_store(old)
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry["users"] -= 1
+            entry["last_used"] = time.monotonic()
+            close_now = entry["evicted"] and entry["users"] <= 0
+        if close_now:
+            self._close_store(entry["store"])
+
+    def _collect_evictions(self):
+        """Pop entries over the size/age limits. Caller holds the lock; returns stores to close."""
+        now = time.monotonic()
+        to_close = []
+        for key in list(self._stores):
+            entry = self._stores[key]
+            too_many = len(self._stores) > self.max_open
+            too_old = now - entry["last_used"] > self.idle_ttl
+            if not (too_many or too_old):
+                continue
+            if entry["users"] > 0 and not too_many:
+                continue
+            self._stores.pop(key)
+            self.evictions += 1
+            entry["evicted"] = True
+            if entry["users"] <= 0:
+                to_close.append(entry["store"])
+        return to_close
+
+    def close(self, persist_dir):
+        """Drop and close the store for persist_dir (e.g. before deleting its folder)."""
+        with self._lock:
+            entry = self._stores.pop(os.path.abspath(persist_dir), None)
+            if entry is None:
+                return
+            entry["evicted"] = True
+            close_now = entry["users"] <= 0
+        if close_now:
+            self._close_store(entry["store"])
+
+    def sweep(self):
+        """Close stores that have been idle for longer than idle_ttl."""
+        with self._lock:
+            stale = self._collect_evictions()
+        for old in stale:
+            self._close_store(old)
+
+    @staticmethod
+    def _close_store(store):
+        client = getattr(store, "_client", None)
+        close = getattr(client, "close", None)
+        if close is None or client is _SHARED_CLIENT:
+            return
+        try:
+            close()
+        except Exception as e:
+            logging.warning("Could not close vector store: %s", e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "open": len(self._stores),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+VECTORSTORES = VectorStoreRegistry(
+    max_open=int(os.getenv("VECTORSTORE_MAX_OPEN", "32")),
+    idle_ttl=int(os.getenv("VECTORSTORE_IDLE_TTL", "900")),
+)
+
+
+# ---------- Collection sampling ----------
+class ChunkIdIndex:
+    """
+    Cached list of chunk IDs per collection, so sampling only fetches the chosen documents.
+    An entry is rebuilt when the collection's count changes.
+    """
+
+    def __init__(self):
+        self._ids = {}  # persist_dir -> (count, ids)
+        self._lock = Lock()
+
+    def ids(self, persist_dir, vectordb):
+        count = vectordb._collection.count()
+        with self._lock:
+            cached = self._ids.get(persist_dir)
+        if cached and cached[0] == count:
+            return cached[1]
+        ids = vectordb._collection.get(include=[])["ids"]
+        with self._lock:
+            self._ids[persist_dir] = (len(ids), ids)
+        return ids
+
+    def forget(self, persist_dir):
+        with self._lock:
+            self._ids.pop(persist_dir, None)
+
+
+CHUNK_IDS = ChunkIdIndex()
+
+
+def sample_chunks(persist_dir, vectordb, k, mode="random"):
+    """
+    Return up to k chunk texts without reading the whole collection.
+    mode: "random" (uniform) or "stratified" (one chunk from each of k equal slices).
+    """
+    ids = CHUNK_IDS.ids(persist_dir, vectordb)
+    if not ids or k <= 0:
+        return []
+    if k >= len(ids):
+        chosen = list(ids)
+    elif mode == "stratified":
+        step = len(ids) / k
+        chosen = [ids[min(len(ids) - 1, int(i * step + random.random() * step))] for i in range(k)]
+    else:
+        chosen = random.sample(ids, k)
+    raw = vectordb.get(ids=chosen, include=["documents"])
+    return raw.get("documents") or []
+
+
+# ---------- Content-addressed dedup ----------
+def file_sha256(path: str) -> str:
+    """Hash a file in 1 MB blocks so large uploads are never fully loaded into memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContentIndex:
+    """
+    SQLite index of finished uploads (by file hash) and embedded chunks (by chunk text hash).
+    Identical uploads reuse the existing collection and summary; overlapping uploads copy
+    the vectors of chunks that were already embedded instead of calling the API again.
+    References are counted per persist_dir: the first finished upload of some bytes becomes
+    the dedup target, and an identical upload that finished at the same time keeps its own
+    folder and its own count.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._db() as db:
+            migrate = not db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dir_refs'"
+            ).fetchone()
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    file_hash   TEXT PRIMARY KEY,
+                    persist_dir TEXT NOT NULL,
+                    summary     TEXT,
+                    created_at  REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_dir ON files(persist_dir);
+                CREATE TABLE IF NOT EXISTS dir_refs (
+                    persist_dir TEXT PRIMARY KEY,
+                    refs        INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_hash  TEXT NOT NULL,
+                    model       TEXT NOT NULL,
+                    persist_dir TEXT NOT NULL,
+                    PRIMARY KEY (chunk_hash, model, persist_dir)
+                );
+                CREATE INDEX IF NOT EXISTS chunks_dir ON chunks(persist_dir);
+                """
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(files)")}
+            if migrate and "refs" in columns:  # counts used to live on the file rows
+                db.execute(
+                    "INSERT OR IGNORE INTO dir_refs (persist_dir, refs) "
+                    "SELECT persist_dir, MAX(refs) FROM files GROUP BY persist_dir"
+                )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def add_file(self, file_hash, persist_dir, summary):
+        """
+        Record a finished upload of these bytes in persist_dir, holding its first reference.
+        An existing upload of the same bytes stays the dedup target; it is never replaced.
+        Safe to call again for the same folder (a retried job).
+        """
+        with self._db() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO files (file_hash, persist_dir, summary, created_at) VALUES (?, ?, ?, ?)",
+                (file_hash, persist_dir, summary, time.time()),
+            )
+            db.execute("INSERT OR IGNORE INTO dir_refs (persist_dir, refs) VALUES (?, 1)", (persist_dir,))
+
+    def acquire_file(self, file_hash):
+        """
+        Take one more reference to a finished, summarized upload of these bytes and return
+        its {"persist_dir", "summary"}, or None if there is none to reuse.
+        """
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT persist_dir, summary FROM files WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+            if row and not os.path.isdir(row[0]):
+                self._forget_dir(db, row[0])
+                return None
+            if not row or not row[1]:
+                return None
+            db.execute("UPDATE dir_refs SET refs = refs + 1 WHERE persist_dir = ?", (row[0],))
+        return {"persist_dir": row[0], "summary": row[1]}
+
+    def release_dir(self, persist_dir):
+        """
+        Drop one reference to persist_dir. Returns how many references remain;
+        at zero the rows are forgotten and the caller may delete the folder.
+        """
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE dir_refs SET refs = refs - 1 WHERE persist_dir = ?", (persist_dir,))
+            row = db.execute("SELECT refs FROM dir_refs WHERE persist_dir = ?", (persist_dir,)).fetchone()
+            remaining = row[0] if row else 0
+            if remaining <= 0:
+                self._forget_dir(db, persist_dir)
+        return max(0, remaining)
+
+    def refs(self, persist_dir):
+        """How many uploads currently share persist_dir (0 if it is not a dedup target)."""
+        with self._db() as db:
+            row = db.execute("SELECT refs FROM dir_refs WHERE persist_dir = ?", (persist_dir,)).fetchone()
+        return row[0] if row else 0
+
+    def detach_dir(self, persist_dir):
+        """persist_dir no longer holds exactly one file's content: stop serving it for file dedup."""
+        with self._db() as db:
+            db.execute("DELETE FROM files WHERE persist_dir = ?", (persist_dir,))
+
+    def forget_dir(self, persist_dir):
+        with self._db() as db:
+            self._forget_dir(db, persist_dir)
+
+    @staticmethod
+    def _forget_dir(db, persist_dir):
+        db.execute("DELETE FROM files WHERE persist_dir = ?", (persist_dir,))
+        db.execute("DELETE FROM dir_refs WHERE persist_dir = ?", (persist_dir,))
+        db.execute("DELETE FROM chunks WHERE persist_dir = ?", (persist_dir,))
+
+    def forget_chunks(self, persist_dir):
+        """persist_dir is being rebuilt: its old chunks are no longer there to copy."""
+        with self._db() as db:
+            db.execute("DELETE FROM chunks WHERE persist_dir = ?", (persist_dir,))
+
+    def find_chunks(self, chunk_hashes, model):
+        """Map each already-embedded chunk hash to one collection that holds its vector."""
+        found = {}
+        hashes = list(chunk_hashes)
+        with self._db() as db:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = db.execute(
+                    f"SELECT chunk_hash, persist_dir FROM chunks "
+                    f"WHERE model = ? AND chunk_hash IN ({marks})",
+                    (model, *part),
+                ).fetchall()
+                for h, d in rows:
+                    if h not in found and os.path.isdir(d):
+                        found[h] = d
+        return found
+
+    def add_chunks(self, chunk_hashes, persist_dir, model):
+        with self._db() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_hash, model, persist_dir) VALUES (?, ?, ?)",
+                [(h, model, persist_dir) for h in chunk_hashes],
+            )
+
+
+CONTENT_INDEX = ContentIndex(
+    os.getenv("CONTENT_INDEX_PATH") or os.path.join(DATA_DIR, "content_index.sqlite3")
+)
+
+
+def _copy_known_chunks(vectordb, known):
+    """Copy vectors for {chunk_hash: source_persist_dir} into vectordb. Returns hashes copied."""
+    by_source = {}
+    for h, src in known.items():
+        by_source.setdefault(src, []).append(h)
+
+    copied = []
+    for src, ids in by_source.items():
+        try:
+            with VECTORSTORES.open(src) as src_db:
+                got = src_db.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        except Exception as e:
+            logging.warning("Could not reuse chunks from %s: %s", src, e)
+            continue
+        if not got.get("ids"):
+            continue
+        vectordb._collection.upsert(
+            ids=got["ids"],
+            embeddings=got["embeddings"],
+            documents=got["documents"],
+            metadatas=got["metadatas"],
+        )
+        copied.extend(got["ids"])
+    return copied
+
+
+# ---------- Extraction artifacts ----------
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR") or os.path.join(DATA_DIR, "artifacts")
+
+
+class ArtifactStore:
+    """
+    Extracted records and chunks of uploaded files as gzip-compressed JSONL, keyed by file
+    hash, so a notebook can be re-chunked or re-embedded without parsing its files again.
+    The first line of each file is a header with the format version (and for chunks the
+    chunk settings); a file whose header does not match is treated as missing.
+    A manifest in SQLite lists which files, in which order, make up each notebook.
+    """
+
+    VERSION = 1  # bump when extraction or the file layout changes
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS notebook_files (
+                    persist_dir TEXT NOT NULL,
+                    position    INTEGER NOT NULL,
+                    file_hash   TEXT NOT NULL,
+                    path        TEXT,
+                    source      TEXT,
+                    PRIMARY KEY (persist_dir, file_hash)
+                )
+                """
+            )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(os.path.join(self.root, "manifest.sqlite3"), timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def _path(self, file_hash, name):
+        return os.path.join(self.root, file_hash[:2], f"{file_hash}.{name}.jsonl.gz")
+
+    @staticmethod
+    def _open(path, header):
+        """The artifact at path opened after its header line, or None if it is missing or has another header."""
+        try:
+            f = gzip.open(path, "rt", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        try:
+            if json.loads(f.readline() or "null") == header:
+                return f
+        except (OSError, EOFError, ValueError):
+            pass
+        f.close()
+        return None
+
+    def _read(self, path, header):
+        """Iterator over the items after a matching header, or None."""
+        f = self._open(path, header)
+        if f is None:
+            return None
+
+        def lines():
+            with f:
+                for line in f:
+                    yield json.loads(line)
+
+        return lines()
+
+    def _write(self, path, header, items, encode):
+        """Pass items through, writing them after the header; the file appears only when all were written."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        f = gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6)
+        try:
+            f.write(json.dumps(header) + "\n")
+            for item in items:
+                f.write(json.dumps(encode(item), ensure_ascii=False) + "\n")
+                yield item
+            f.close()
+            os.replace(tmp, path)
+            METRICS.inc("bytes", os.path.getsize(path), kind="artifact")
+        except BaseException:  # failed or abandoned: leave no partial artifact
+            f.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _records_key(self, file_hash):
+        return self._path(file_hash, "records"), {"version": self.VERSION, "type": "records"}
+
+    def _chunks_key(self, file_hash, max_tokens, overlap_tokens):
+        max_tokens = max_tokens or CHUNK_TOKENS
+        overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        header = {"version": self.VERSION, "type": "chunks", "max_tokens": max_tokens, "overlap_tokens": overlap_tokens}
+        return self._path(file_hash, f"chunks-{max_tokens}-{overlap_tokens}"), header
+
+    def records(self, file_hash):
+        """Saved page/slide/section records of a file, or None."""
+        return self._read(*self._records_key(file_hash))
+
+    def save_records(self, file_hash, records):
+        return self._write(*self._records_key(file_hash), records, dict)
+
+    def chunks(self, file_hash, max_tokens=None, overlap_tokens=None):
+        """Saved (text, metadata) chunks of a file for these chunk settings, or None."""
+        lines = self._read(*self._chunks_key(file_hash, max_tokens, overlap_tokens))
+        return None if lines is None else ((text, meta) for text, meta in lines)
+
+    def save_chunks(self, file_hash, chunks, max_tokens=None, overlap_tokens=None):
+        return self._write(*self._chunks_key(file_hash, max_tokens, overlap_tokens), chunks, list)
+
+    def has_records(self, file_hash):
+        f = self._open(*self._records_key(file_hash))
+        if f is None:
+            return False
+        f.close()
+        return True
+
+    def add_files(self, persist_dir, entries):
+        """Record (file_hash, path, source) entries as the next files of the notebook in persist_dir."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT COALESCE(MAX(position), -1) FROM notebook_files WHERE persist_dir = ?", (persist_dir,)
+            ).fetchone()
+            db.executemany(
+                "INSERT OR IGNORE INTO notebook_files (persist_dir, position, file_hash, path, source) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(persist_dir, row[0] + 1 + i, h, path, source) for i, (h, path, source) in enumerate(entries)],
+            )
+
+    def files(self, persist_dir):
+        """[{"file_hash", "path", "source"}] of the notebook in persist_dir, in upload order."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT file_hash, path, source FROM notebook_files WHERE persist_dir = ? ORDER BY position",
+                (persist_dir,),
+            ).fetchall()
+        return [{"file_hash": h, "path": path, "source": source} for h, path, source in rows]
+
+    def notebooks(self):
+        with self._db() as db:
+            rows = db.execute("SELECT DISTINCT persist_dir FROM notebook_files ORDER BY persist_dir").fetchall()
+        return [r[0] for r in rows]
+
+    def copy_notebook(self, src, dst):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO notebook_files (persist_dir, position, file_hash, path, source) "
+                "SELECT ?, position, file_hash, path, source FROM notebook_files WHERE persist_dir = ?",
+                (dst, src),
+            )
+
+    def forget_notebook(self, persist_dir):
+        """Drop the notebook's manifest, and the artifacts of files no other notebook uses."""
+        with self._db() as db:
+            hashes = {r[0] for r in db.execute(
+                "SELECT file_hash FROM notebook_files WHERE persist_dir = ?", (persist_dir,))}
+            db.execute("DELETE FROM notebook_files WHERE persist_dir = ?", (persist_dir,))
+            still_used = {r[0] for r in db.execute(
+                f"SELECT DISTINCT file_hash FROM notebook_files WHERE file_hash IN ({','.join('?' * len(hashes))})",
+                tuple(hashes),
+            )} if hashes else set()
+        for h in hashes - still_used:
+            folder = os.path.join(self.root, h[:2])
+            for name in os.listdir(folder) if os.path.isdir(folder) else []:
+                if name.startswith(h + "."):
+                    os.remove(os.path.join(folder, name))
+
+
+ARTIFACTS = ArtifactStore(ARTIFACT_DIR)
+
+
+def file_chunks(path, file_hash=None, track=None, offload=False):
+    """
+    (file_hash, chunks): the (text, metadata) chunks of a file, from its artifacts where possible:
+    saved chunks for the current chunk settings, else saved records chunked again, else the file
+    at path parsed. Whatever had to be computed is saved for next time. track wraps the record
+    stream. Artifacts are keyed by the hash of the file at path as it is now, the bytes that
+    get parsed; the file_hash given is only used once the file itself is gone.
+    """
+    if path and os.path.exists(path):
+        file_hash = file_sha256(path)
+    elif not file_hash:
+        raise FileNotFoundError(f"No upload at {path}")
+    chunks = ARTIFACTS.chunks(file_hash)
+    if chunks is not None:
+        METRICS.inc("artifacts", kind="chunks", result="hit")
+        return file_hash, chunks
+    records = ARTIFACTS.records(file_hash)
+    METRICS.inc("artifacts", kind="records", result="hit" if records is not None else "miss")
+    if records is None:
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(f"No saved records and no upload for {file_hash[:12]}")
+        records = ARTIFACTS.save_records(file_hash, iter_file_records(path, offload))
+    if track:
+        records = track(records)
+    return file_hash, ARTIFACTS.save_chunks(file_hash, iter_structured_chunks(records))
+
+
+# ---------- Embedding pipeline ----------
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "60000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+EMBED_MAX_ATTEMPTS = 6
+
+_embed_backoff_until = 0.0  # shared by all workers: one 429 pauses the whole pool
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+def token_batches(items, max_tokens=EMBED_BATCH_TOKENS, max_items=EMBED_BATCH_MAX_ITEMS):
+    """Group (id, text, ...) items into batches that stay under a token and item budget."""
+    batch, tokens = [], 0
+    for item in items:
+        n = estimate_tokens(item[1])
+        if batch and (tokens + n > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += n
+    if batch:
+        yield batch
+
+
+def _retry_delay(e, attempt):
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after:
+            return float(retry_after)
+    except ValueError:
+        pass
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+
+def embed_with_retry(texts):
+    """Embed one batch, backing off on 429s and transient network/server errors."""
+    global _embed_backoff_until
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        pause = _embed_backoff_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        try:
+            return get_embeddings().embed_documents(texts)
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt == EMBED_MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_delay(e, attempt)
+            if isinstance(e, RateLimitError):
+                _embed_backoff_until = max(_embed_backoff_until, time.monotonic() + delay)
+            logging.warning("Embedding batch failed (%s), retry %s in %.1fs", type(e).__name__, attempt + 1, delay)
+            time.sleep(delay)
+
+
+def embed_and_store(vectordb, items, on_batch=None, workers=None):
+    """
+    Embed (id, text, metadata) items in token-sized batches on a bounded worker pool and upsert
+    them into vectordb with precomputed vectors. on_batch(n) runs on the calling
+    thread after each batch is written, so progress callbacks never race.
+    """
+    workers = workers or EMBED_WORKERS
+    batches = token_batches(items)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+        inflight = {}
+
+        def submit_next():
+            b = next(batches, None)
+            if b is not None:
+                inflight[pool.submit(embed_with_retry, [t for _, t, _ in b])] = b
+
+        for _ in range(workers * 2):
+            submit_next()
+        while inflight:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                b = inflight.pop(fut)
+                vectors = fut.result()
+                with Timer("chroma write", quiet=True):
+                    vectordb._collection.upsert(
+                        ids=[i for i, _, _ in b],
+                        embeddings=vectors,
+                        documents=[t for _, t, _ in b],
+                        metadatas=[m for _, _, m in b],
+                    )
+                if on_batch:
+                    on_batch(len(b))
+                submit_next()
+
+
+def chunk_location(meta):
+    """" (page 3)" / " (slides 4-5)" / " (week2.pdf, page 3)" for chunk metadata, or "" when there is none."""
+    if not meta:
+        return ""
+    source = f"{meta['source']}, " if meta.get("source") else ""
+    if meta.get("kind") not in STRUCTURAL_KINDS:
+        return f" ({meta['source']})" if source else ""
+    start, end = meta.get("start"), meta.get("end")
+    if start == end:
+        return f" ({source}{meta['kind']} {start})"
+    return f" ({source}{meta['kind']}s {start}-{end})"
 
 
 def get_document_prompt(docs):
@@ -162,11 +1711,247 @@ def get_document_prompt(docs):
     out = []
     for i, d in enumerate(docs, 1):
         text = d if isinstance(d, str) else getattr(d, "page_content", "")
-        out.append(f"\nContent {i}:\n{text}\n")
+        out.append(f"\nContent {i}{chunk_location(getattr(d, 'metadata', None))}:\n{text}\n")
     return "\n".join(out)
 
 
 
+# ---------- Map-reduce summarization ----------
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "map_reduce")  # "map_reduce" or "first" (first 15 chunks only)
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+SUMMARY_GROUP_CHUNKS = int(os.getenv("SUMMARY_GROUP_CHUNKS", "12"))  # chunks per map call
+SUMMARY_FANIN = int(os.getenv("SUMMARY_FANIN", "8"))  # partial summaries per reduce call
+SUMMARY_MODEL = "gpt-4o-mini"
+
+
+class SummaryStore:
+    """
+    Partial summaries produced by the map-reduce summarizer. A partial is stored under a
+    hash of the inputs it covers, so re-uploads and overlapping documents reuse it.
+    doc_partials records which partials make up each document, level by level.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS partials (
+                    key         TEXT PRIMARY KEY,
+                    text        TEXT NOT NULL,
+                    created_at  REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS doc_partials (
+                    persist_dir TEXT NOT NULL,
+                    level       INTEGER NOT NULL,
+                    idx         INTEGER NOT NULL,
+                    key         TEXT NOT NULL,
+                    PRIMARY KEY (persist_dir, level, idx)
+                );
+                CREATE INDEX IF NOT EXISTS doc_partials_key ON doc_partials(key);
+                """
+            )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def get_many(self, keys):
+        """Return {key: text} for the keys that are already summarized."""
+        out = {}
+        with self._db() as db:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                out.update(db.execute(f"SELECT key, text FROM partials WHERE key IN ({marks})", part).fetchall())
+        return out
+
+    def put(self, key, text):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO partials (key, text, created_at) VALUES (?, ?, ?)",
+                (key, text, time.time()),
+            )
+
+    def set_doc(self, persist_dir, levels):
+        """Record the partial keys of a document; levels[0] covers chunks, the last level is the top."""
+        rows = [(persist_dir, lvl, i, k) for lvl, keys in enumerate(levels) for i, k in enumerate(keys)]
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM doc_partials WHERE persist_dir = ?", (persist_dir,))
+            db.executemany("INSERT INTO doc_partials (persist_dir, level, idx, key) VALUES (?, ?, ?, ?)", rows)
+            db.execute("COMMIT")
+
+    def level_keys(self, persist_dir, level=0):
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT key FROM doc_partials WHERE persist_dir = ? AND level = ? ORDER BY idx",
+                (persist_dir, level),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def copy_doc(self, src, dst):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO doc_partials (persist_dir, level, idx, key) "
+                "SELECT ?, level, idx, key FROM doc_partials WHERE persist_dir = ?",
+                (dst, src),
+            )
+
+    def for_doc(self, persist_dir, max_items=SUMMARY_FANIN):
+        """The most detailed level of partial summaries with at most max_items entries, in document order."""
+        with self._db() as db:
+            levels = db.execute(
+                "SELECT level, COUNT(*) FROM doc_partials WHERE persist_dir = ? GROUP BY level ORDER BY level",
+                (persist_dir,),
+            ).fetchall()
+            level = next((lvl for lvl, n in levels if n <= max_items), None)
+            if level is None:
+                return []
+            rows = db.execute(
+                "SELECT p.text FROM doc_partials d JOIN partials p ON p.key = d.key "
+                "WHERE d.persist_dir = ? AND d.level = ? ORDER BY d.idx",
+                (persist_dir, level),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def forget(self, persist_dir):
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM doc_partials WHERE persist_dir = ?", (persist_dir,))
+            db.execute("DELETE FROM partials WHERE key NOT IN (SELECT key FROM doc_partials)")
+            db.execute("COMMIT")
+
+
+SUMMARIES = SummaryStore(os.getenv("SUMMARY_CACHE_PATH") or os.path.join(DATA_DIR, "summaries.sqlite3"))
+
+
+def chat_with_retry(messages, temperature=0.2):
+    """One non-streaming chat completion, retried on 429s and transient errors."""
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        try:
+            with Timer("LLM summary part", quiet=True):
+                resp = get_openai_client().chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                )
+            record_llm_usage(resp, "summary")
+            return resp.choices[0].message.content
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt == EMBED_MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_delay(e, attempt)
+            logging.warning("Summary call failed (%s), retry %s in %.1fs", type(e).__name__, attempt + 1, delay)
+            time.sleep(delay)
+
+
+def _summary_key(level, inputs):
+    h = hashlib.sha256(f"{SUMMARY_MODEL}:{level}:".encode("utf-8"))
+    for key in inputs:
+        h.update(key.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _summarize_part(text, level):
+    if level == 0:
+        instruction = (
+            "Summarize this excerpt of a notebook in 3 to 5 sentences. "
+            "Keep the title, chapter or section names, key terms, names and numbers that appear. "
+            "Only state what is in the excerpt."
+        )
+    else:
+        instruction = (
+            "These are summaries of consecutive parts of one notebook, in order. "
+            "Combine them into a single summary of 4 to 6 sentences that keeps the title, "
+            "the section names and the main points in order. Only state what is in the summaries."
+        )
+    return chat_with_retry(
+        [{"role": "system", "content": instruction}, {"role": "user", "content": text}],
+        temperature=0.2,
+    )
+
+
+def _summary_call_count(n_chunks):
+    n = -(-n_chunks // SUMMARY_GROUP_CHUNKS)
+    total = n
+    while n > SUMMARY_FANIN:
+        n = -(-n // SUMMARY_FANIN)
+        total += n
+    return total
+
+
+def map_reduce_summary(vectordb, chunk_ids, on_step=None, workers=None, prior=None):
+    """
+    Summarize the chunks (ids in document order) SUMMARY_GROUP_CHUNKS at a time on a bounded
+    pool, then combine the partial summaries SUMMARY_FANIN at a time, level by level, until at
+    most SUMMARY_FANIN remain. Partials already in SUMMARIES are not recomputed.
+    prior lists level-0 keys of material summarized earlier (an appended-to notebook); they
+    go in front of the new groups, so only the new chunks and the changed reduce groups cost calls.
+    Returns (levels, top) where levels lists the partial keys per level and top the last level's texts.
+    on_step(done, total) is called on this thread after each partial is ready.
+    """
+    workers = workers or SUMMARY_WORKERS
+    total = _summary_call_count(len(chunk_ids))
+    done = 0
+
+    def step(n):
+        nonlocal done
+        done += n
+        if on_step and n:
+            on_step(done, total)
+
+    def load_chunks(ids):
+        got = vectordb.get(ids=list(ids), include=["documents"])
+        by_id = dict(zip(got["ids"], got["documents"]))
+        return "\n\n".join(by_id.get(i) or "" for i in ids)
+
+    levels = []
+    inputs = list(chunk_ids)
+    texts = SUMMARIES.get_many(list(prior)) if prior else {}
+    prior = [k for k in (prior or []) if k in texts]
+    level = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary") as pool:
+        while True:
+            size = SUMMARY_GROUP_CHUNKS if level == 0 else SUMMARY_FANIN
+            groups = [inputs[i:i + size] for i in range(0, len(inputs), size)]
+            keys = [_summary_key(level, g) for g in groups]
+            if level == 0 and prior:
+                # A retried append may already have recorded its own groups as prior
+                prior = [k for k in prior if k not in set(keys)]
+                keys, groups = prior + keys, [None] * len(prior) + groups
+            cached = SUMMARIES.get_many(keys)
+            texts.update(cached)
+            step(sum(1 for k in keys if k in cached))
+
+            futures = {}
+            for key, group in zip(keys, groups):
+                if key in texts:
+                    continue
+                if level == 0:
+                    load = lambda g=group: load_chunks(g)
+                else:
+                    load = lambda g=group: "\n\n".join(f"Part {i}:\n{texts[k]}" for i, k in enumerate(g, 1))
+                futures[pool.submit(lambda lv=level, ld=load: _summarize_part(ld(), lv))] = key
+            for fut in as_completed(futures):
+                key = futures[fut]
+                texts[key] = fut.result()
+                SUMMARIES.put(key, texts[key])
+                step(1)
+
+            levels.append(keys)
+            if len(keys) <= SUMMARY_FANIN:
+                return levels, [texts[k] for k in keys]
+            inputs = keys
+            level += 1
+
+
 def _on_rm_error(func, path, exc_info):
     """Windows-safe remover: make file writable then retry."""
     try:
@@ -176,49 +1961,150 @@ def _on_rm_error(func, path, exc_info):
         logging.warning("Could not remove: %s", path)
 
 
-def _process_job(job_id: str, text: str, persist_dir: str, filename: str, start_pct: int = 40, end_pct: int = 100):
+def _process_job(job_id: str, persist_dir: str, filename: str, start_pct: int = 40, end_pct: int = 100,
+                 file_hash: str = None, path: str = None, append: bool = False, previous_summary: str = None,
+                 files: list = None):
     """
     Run the embedding + summary build and report progress scaled into [start_pct, end_pct].
+    The file at path is extracted here, page by page, and chunks are embedded while later
+    pages are still being parsed.
+    Chunks are stored under their text hash; chunks already embedded elsewhere are copied.
+    With append the file is added to the notebook already in persist_dir: only its chunks are
+    embedded and summarized, and the new summary builds on previous_summary.
+    files ([path, name] pairs) builds one notebook from several uploads, extracted in parallel,
+    with per-file progress in the "files" field.
+    Extracted records and chunks are kept as artifacts (see ArtifactStore) and reused when the
+    same bytes are processed again; the notebook's files are recorded for reindex_notebook.
     """
     def scale(local):  # local is 0..100 → map into [start..end]
         local = max(0, min(100, int(local)))
         span = max(1, end_pct - start_pct)
         return start_pct + int(round(local * span / 100.0))
 
+    def report(phase, local):  # never lets the bar move backwards
+        PROGRESS.update(job_id, phase=phase, pct=scale(local))
+
     try:
-        PROGRESS[job_id] = {"phase": "Processing", "pct": scale(2)}
+        report("Processing", 2)
         os.makedirs(persist_dir, exist_ok=True)
 
-        # Split text
-        PROGRESS[job_id] = {"phase": "Processing", "pct": scale(5)}
-        text_splitter = CharacterTextSplitter(separator=" ", chunk_size=5000, chunk_overlap=100)
-        docs = text_splitter.split_text(text) if text else []
-
-        # Build embeddings + DB
-        PROGRESS[job_id] = {"phase": "Processing", "pct": scale(10)}
-        client = get_openai_client()
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=client.api_key)
-        vectordb = Chroma(embedding_function=embeddings, persist_directory=persist_dir)
-
-        total = max(len(docs), 1)
-        batch = 25
-        added = 0
-        for i in range(0, len(docs), batch):
-            chunk = docs[i:i + batch]
-            vectordb.add_texts(chunk)
-            added += len(chunk)
-            local_pct = 10 + (65 * added / total)  # 10→75 locally
-            PROGRESS[job_id] = {"phase": f"Processing", "pct": scale(local_pct)}
-
-        PROGRESS[job_id] = {"phase": "Processing", "pct": scale(20)}
-
-        PROGRESS[job_id] = {"phase": "Processing", "pct": scale(30)}
-
-
-        # Summarize
-        PROGRESS[job_id] = {"phase": "Summarizing", "pct": scale(90)}
-        raw = vectordb.get(include=["documents"])
-        sample = (raw.get("documents") or [])[:15]
+        # Stream records → split → dedup → embed
+        report("Processing", 5)
+        extracted = {"done": 1, "total": 1}  # chunks read back from artifacts skip extraction
+        spent = {"extract": 0.0, "extract+split": 0.0}
+
+        def tracked(records):
+            for rec in timed_iter(records, spent, "extract"):
+                extracted["done"], extracted["total"] = rec["number"], max(1, rec["total"])
+                METRICS.inc("extracted_chars", len(rec["text"] or ""))
+                yield rec
+
+        report("Processing", 10)
+        lexical = LexicalIndex(persist_dir)
+        with VECTORSTORES.open(persist_dir) as vectordb:
+            unique = OrderedDict()
+            counts = {"produced": 0, "stored": 0, "reused": 0}
+
+            entries = []  # (file_hash, path, source) rows for the artifact manifest
+            if files:
+                status = [{"name": name, "phase": "queued", "chunks": 0} for _, name in files]
+                ends = {}  # file index -> chunks produced once its last chunk was taken
+                extracted["total"] = len(files)
+
+                def on_file(i, n, error=None, file_hash=None):
+                    if i > 0:
+                        ends[i - 1] = counts["produced"]
+                    extracted["done"] = i + 1
+                    status[i].update(phase="error" if error else "processing", chunks=n)
+                    if error:
+                        status[i]["error"] = error
+                    else:
+                        entries.append((file_hash, files[i][0], files[i][1]))
+                    PROGRESS.update(job_id, files=status)
+
+                def mark_indexed():
+                    for i, end in ends.items():
+                        if status[i]["phase"] == "processing" and counts["stored"] >= end:
+                            status[i]["phase"] = "indexed"
+                    PROGRESS.update(job_id, files=status)
+
+                PROGRESS.update(job_id, files=status)
+                chunk_source = iter_batch_chunks(files, on_file=on_file)
+            else:
+                source_hash, chunk_source = file_chunks(path, track=tracked)
+                entries.append((source_hash, path, None))
+
+            def new_chunks(window=100):
+                # Look up hashes a window at a time so embedding starts before extraction ends
+                buf = []
+                for d, meta in timed_iter(chunk_source, spent, "extract+split"):
+                    h = chunk_sha256(d)
+                    if h in unique:
+                        continue
+                    unique[h] = True
+                    counts["produced"] += 1
+                    buf.append((h, d, meta))
+                    if len(buf) >= window:
+                        yield from _drop_known(buf)
+                        buf = []
+                yield from _drop_known(buf)
+
+            def _drop_known(items):
+                if not items:
+                    return []
+                lexical.add(items)
+                # Chunks stored by an earlier, interrupted run of this job are already done
+                stored = set(vectordb.get(ids=[h for h, _, _ in items], include=[])["ids"])
+                known = CONTENT_INDEX.find_chunks([h for h, _, _ in items if h not in stored], EMBEDDING_MODEL)
+                copied = set(_copy_known_chunks(vectordb, known)) if known else set()
+                counts["reused"] += len(copied) + len(stored)
+                counts["stored"] += len(copied) + len(stored)
+                return [item for item in items if item[0] not in copied and item[0] not in stored]
+
+            def on_batch(n):
+                counts["stored"] += n
+                frac = extracted["done"] / extracted["total"]
+                frac *= counts["stored"] / max(1, counts["produced"])
+                report("Processing", 10 + 65 * frac)  # 10→75 locally
+                if files:
+                    mark_indexed()
+
+            embed_and_store(vectordb, new_chunks(), on_batch=on_batch)
+            if files:
+                ends[len(files) - 1] = counts["produced"]
+                mark_indexed()
+            if files:
+                METRICS.observe("batch extract wait", spent["extract+split"])
+            else:
+                METRICS.observe("extract", spent["extract"])
+                METRICS.observe("split", max(0.0, spent["extract+split"] - spent["extract"]))
+            logging.info("DEDUP job=%s chunks=%s reused=%s new=%s", job_id, counts["produced"],
+                         counts["reused"], counts["produced"] - counts["reused"])
+            report("Processing", 75)
+
+            # Summarize: short documents go straight to the final prompt, long ones are
+            # summarized in parallel chunk groups first and the partials combined
+            report("Summarizing", 76)
+            chunk_ids = list(unique)
+            prior = SUMMARIES.level_keys(persist_dir) if append else []
+            if SUMMARY_MODE == "first":
+                sample = vectordb.get(limit=15, include=["documents"]).get("documents") or []
+            elif not prior and len(chunk_ids) <= SUMMARY_GROUP_CHUNKS:
+                got = vectordb.get(ids=chunk_ids, include=["documents"]) if chunk_ids else {"ids": []}
+                by_id = dict(zip(got["ids"], got.get("documents") or []))
+                sample = [by_id[h] for h in chunk_ids if by_id.get(h)]
+            else:
+                t_summary = Timer("map-reduce summary")
+                levels, sample = map_reduce_summary(
+                    vectordb, chunk_ids,
+                    on_step=lambda done, total: report("Summarizing", 76 + 22 * done / max(1, total)),
+                    prior=prior,
+                )
+                SUMMARIES.set_doc(persist_dir, levels)
+                t_summary.done(f"(chunks={len(chunk_ids)}, prior={len(prior)}, levels={[len(l) for l in levels]})")
+            if previous_summary:
+                sample = [previous_summary] + list(sample)
+        report("Summarizing", 98)
         prompt = get_document_prompt(sample) if sample else "No content available."
 
         system_message = (
@@ -233,22 +2119,1125 @@ def _process_job(job_id: str, text: str, persist_dir: str, filename: str, start_
             "Be precise, avoid opinions, and summarize the main points in a clear and structured way. "
             "If the document has multiple sections, break it into meaningful segments."
         )
+        t_llm = Timer("LLM summary")
         resp = get_openai_client().chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "system", "content": system_message}],
             temperature=0.2,
         )
+        t_llm.done()
+        record_llm_usage(resp, "summary")
         summary_text = resp.choices[0].message.content
 
-        PROGRESS[job_id] = {"phase": "completed", "pct": scale(100), "summary": summary_text, "filename": filename, }
+        CONTENT_INDEX.add_chunks(unique, persist_dir, EMBEDDING_MODEL)
+        # A notebook from before artifacts were kept cannot be rebuilt from them, so it gets no manifest
+        if entries and (not append or ARTIFACTS.files(persist_dir)):
+            ARTIFACTS.add_files(persist_dir, entries)
+        logging.info("EMBED CACHE job=%s %s", job_id, EMBEDDING_CACHE.stats())
+        if file_hash:
+            CONTENT_INDEX.add_file(file_hash, persist_dir, summary_text)
+
+        PROGRESS.update(job_id, phase="completed", pct=scale(100), summary=summary_text, filename=filename)
+
+    except Exception as e:
+        PROGRESS.update(job_id, phase="error", pct=end_pct, error=str(e))
+
+
+# ---------- Job queue ----------
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "120"))  # seconds without a heartbeat
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # runs before a job that keeps dying is given up
+
+
+class JobQueue:
+    """
+    Durable background job queue in SQLite, replacing one daemon thread per upload.
+    A fixed number of workers claim the highest-priority queued job. Running jobs send
+    heartbeats; a job whose owner stopped beating (crash, restart) is queued again and
+    resumes from the chunks it already stored, up to max_attempts runs in all.
+    Importing the app starts no workers: "flask jobs-worker" runs them in a process of its
+    own, so ingestion never competes with requests in the web workers.
+    """
+
+    def __init__(self, path, workers=2, stale_after=120, max_attempts=3):
+        self.path = path
+        self.workers = workers
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self._wake = threading.Condition()
+        self._running = set()
+        self._started = False
+        self._start_lock = Lock()
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id     TEXT PRIMARY KEY,
+                    kind       TEXT NOT NULL,
+                    payload    TEXT NOT NULL,
+                    priority   INTEGER NOT NULL DEFAULT 0,
+                    status     TEXT NOT NULL,
+                    owner      TEXT,
+                    heartbeat  REAL,
+                    attempts   INTEGER NOT NULL DEFAULT 0,
+                    result     TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_next ON jobs(status, priority DESC, created_at);
+                """
+            )
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def register(self, kind, handler):
+        """handler(job_id, **payload) runs the job and returns its final state dict."""
+        self.handlers[kind] = handler
+
+    def enqueue(self, job_id, kind, payload, priority=0):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, kind, payload, priority, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(payload), priority, time.time()),
+            )
+        with self._wake:
+            self._wake.notify()
+
+    def cancel(self, job_id):
+        """Drop job_id if it is still queued; a running job has to notice on its own."""
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', result = ? WHERE job_id = ? AND status = 'queued'",
+                (json.dumps({"phase": "cancelled", "pct": 100}), job_id),
+            )
+
+    def is_active(self, job_id):
+        """True while job_id is queued or running."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT 1 FROM jobs WHERE job_id = ? AND status IN ('queued', 'running')", (job_id,)
+            ).fetchone()
+        return row is not None
+
+    def status(self, job_id):
+        """Coarse job state for processes that never saw the job in PROGRESS."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT status, payload, result FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        status, payload, result = row
+        if result:
+            return json.loads(result)
+        payload = json.loads(payload)
+        phase = "queued" if status == "queued" else "Processing"
+        return {"phase": phase, "pct": payload.get("start_pct", 0), "filename": payload.get("filename")}
+
+    def _claim(self):
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT job_id, kind, payload FROM jobs WHERE status = 'queued' "
+                "ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ?",
+                    (self.owner, time.time(), row[0]),
+                )
+            db.execute("COMMIT")
+        return row
+
+    def _finish(self, job_id, state):
+        status = "error" if (state or {}).get("phase") == "error" else "done"
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, heartbeat = ? WHERE job_id = ?",
+                (status, json.dumps(state or {}), time.time(), job_id),
+            )
+
+    def requeue_stale(self):
+        """
+        Queue again any running job whose owner has stopped sending heartbeats, or fail it
+        once it has been started max_attempts times (it probably takes its process down).
+        """
+        cutoff = time.time() - self.stale_after
+        stale = "status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)"
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            dead = [r[0] for r in db.execute(
+                f"SELECT job_id FROM jobs WHERE {stale} AND attempts >= ?", (cutoff, self.max_attempts)
+            )]
+            state = {"phase": "error", "pct": 100,
+                     "error": f"Processing stopped {self.max_attempts} times; giving up on this file."}
+            db.executemany(
+                "UPDATE jobs SET status = 'error', owner = NULL, result = ? WHERE job_id = ?",
+                [(json.dumps(state), j) for j in dead],
+            )
+            n = db.execute(f"UPDATE jobs SET status = 'queued', owner = NULL WHERE {stale}", (cutoff,)).rowcount
+            db.execute("COMMIT")
+        for job_id in dead:
+            logging.error("Job %s gave up after %s attempts", job_id, self.max_attempts)
+            PROGRESS.update(job_id, **state)
+        if n:
+            logging.warning("Requeued %s stale job(s)", n)
+            with self._wake:
+                self._wake.notify_all()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(max(1, self.stale_after // 4))
+            running = list(self._running)
+            if running:
+                with self._db() as db:
+                    db.executemany(
+                        "UPDATE jobs SET heartbeat = ? WHERE job_id = ?",
+                        [(time.time(), j) for j in running],
+                    )
+            self.requeue_stale()
+
+    def _worker(self):
+        while True:
+            row = self._claim()
+            if row is None:
+                with self._wake:
+                    self._wake.wait(timeout=2.0)
+                continue
+            job_id, kind, payload = row
+            self._running.add(job_id)
+            state = None
+            span = Timer(f"job {kind}")
+            try:
+                state = self.handlers[kind](job_id, **json.loads(payload))
+            except Exception as e:
+                logging.exception("Job %s failed", job_id)
+                state = {"phase": "error", "pct": 100, "error": str(e)}
+            finally:
+                span.done(f"(job={job_id}, phase={(state or {}).get('phase')})")
+                METRICS.inc("jobs", kind=kind, phase=(state or {}).get("phase") or "unknown")
+                self._running.discard(job_id)
+                self._finish(job_id, state)
+
+    def start(self):
+        """Start the worker threads once per process."""
+        with self._start_lock:
+            if self._started or self.workers <= 0:
+                return
+            self._started = True
+        self.requeue_stale()
+        for i in range(self.workers):
+            Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+        Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+
+JOBS = JobQueue(
+    os.getenv("JOB_QUEUE_PATH") or os.path.join(DATA_DIR, "jobs.sqlite3"),
+    workers=JOB_WORKERS,
+    stale_after=JOB_STALE_AFTER,
+    max_attempts=JOB_MAX_ATTEMPTS,
+)
+
+
+def _run_ingest_job(job_id, persist_dir, filename, start_pct=40, end_pct=100, file_hash=None, path=None):
+    _process_job(job_id, persist_dir, filename, start_pct, end_pct, file_hash, path)
+    state = PROGRESS.get(job_id)
+    if state and state.get("phase") == "completed":
+        QUIZ_POOL.request_refill(persist_dir)
+    return state
+
+
+JOBS.register("ingest", _run_ingest_job)
+
+
+def _run_batch_job(job_id, persist_dir, filename, files, start_pct=40, end_pct=100):
+    _process_job(job_id, persist_dir, filename, start_pct, end_pct, files=files)
+    state = PROGRESS.get(job_id)
+    if state and state.get("phase") == "completed":
+        QUIZ_POOL.request_refill(persist_dir)
+    return state
+
+
+JOBS.register("batch", _run_batch_job)
+
+
+def _fork_notebook(src, dst):
+    """Copy the vectors, keyword index and summary partials of src into dst so the two can diverge."""
+    os.makedirs(dst, exist_ok=True)
+    lexical = LexicalIndex(dst)
+    offset = 0
+    with VECTORSTORES.open(src) as src_db, VECTORSTORES.open(dst) as dst_db:
+        while True:
+            got = src_db.get(limit=500, offset=offset, include=["embeddings", "documents", "metadatas"])
+            ids = got.get("ids") or []
+            if not ids:
+                break
+            dst_db._collection.upsert(
+                ids=ids,
+                embeddings=got["embeddings"],
+                documents=got["documents"],
+                metadatas=got["metadatas"],
+            )
+            lexical.add(list(zip(ids, got["documents"], got["metadatas"])))
+            CONTENT_INDEX.add_chunks(ids, dst, EMBEDDING_MODEL)
+            offset += len(ids)
+    SUMMARIES.copy_doc(src, dst)
+    ARTIFACTS.copy_notebook(src, dst)
+    return offset
+
+
+def _run_append_job(job_id, user_id, filename, path, previous_summary=None, start_pct=40, end_pct=100):
+    """Add the file at path to the notebook filename: embed only its chunks, then refresh the summary."""
+    info = DOCUMENTS.get(user_id, filename)
+    if not info or not os.path.isdir(info["persist_dir"] or ""):
+        return {"phase": "error", "pct": end_pct, "error": "Notebook not found."}
+    persist_dir = info["persist_dir"]
+
+    if CONTENT_INDEX.refs(persist_dir) > 1:
+        # Other uploads of the same bytes share this folder: the notebook gets its own copy first
+        t = Timer("append fork")
+        forked = new_persist_dir(os.path.splitext(filename)[0])
+        copied = _fork_notebook(persist_dir, forked)
+        CONTENT_INDEX.release_dir(persist_dir)
+        DOCUMENTS.put(user_id, filename, forked, info["summary"])
+        persist_dir = forked
+        t.done(f"(chunks={copied})")
+    else:
+        # No longer the content of one file, so identical uploads must not reuse it
+        CONTENT_INDEX.detach_dir(persist_dir)
+
+    _process_job(job_id, persist_dir, filename, start_pct, end_pct, path=path,
+                 append=True, previous_summary=previous_summary or info["summary"])
+    state = PROGRESS.get(job_id)
+    if state and state.get("phase") == "completed":
+        # Every process retires its cached answers and pooled questions for the old content
+        DOCUMENTS.bump_version(persist_dir)
+        QUIZ_POOL.forget(persist_dir)
+        QUIZ_POOL.request_refill(persist_dir)
+    return state
+
+
+JOBS.register("append", _run_append_job)
+
+
+# ---------- Quiz question pool ----------
+QUIZ_POOL_TARGET = int(os.getenv("QUIZ_POOL_TARGET", "40"))  # questions to keep ready per document
+QUIZ_POOL_LOW = int(os.getenv("QUIZ_POOL_LOW", "15"))  # refill below this many
+QUIZ_POOL_CHUNKS_PER_CALL = 20
+QUIZ_POOL_QUESTIONS_PER_CALL = 8
+
+
+class QuizPool:
+    """
+    Pre-generated multiple-choice questions per document, so /generate_quiz can answer
+    without waiting on the LLM. Generation walks the collection with a cursor, a window
+    of chunks per call, so over successive refills every chunk gets covered. Questions are
+    tagged with the notebook version (DOCUMENTS.version) they were written from, and only
+    those of the current version are served.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS quiz_questions (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    persist_dir TEXT NOT NULL,
+                    question    TEXT NOT NULL,
+                    created_at  REAL NOT NULL,
+                    version     INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS quiz_questions_doc ON quiz_questions(persist_dir);
+                CREATE TABLE IF NOT EXISTS quiz_cursor (
+                    persist_dir TEXT PRIMARY KEY,
+                    next_offset INTEGER NOT NULL DEFAULT 0
+                );
+                """
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(quiz_questions)")}
+            if "version" not in columns:  # pools written before questions were versioned
+                db.execute("ALTER TABLE quiz_questions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def available(self, persist_dir, version):
+        with self._db() as db:
+            return db.execute(
+                "SELECT COUNT(*) FROM quiz_questions WHERE persist_dir = ? AND version = ?",
+                (persist_dir, version),
+            ).fetchone()[0]
+
+    def take(self, persist_dir, num, version):
+        """
+        Serve (and remove) num random questions of the given notebook version, renumbered 1..num,
+        or None if the pool is short. Triggers a background refill when the pool runs low.
+        """
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "DELETE FROM quiz_questions WHERE persist_dir = ? AND version < ?", (persist_dir, version)
+            )
+            rows = db.execute(
+                "SELECT id, question FROM quiz_questions WHERE persist_dir = ? AND version = ? "
+                "ORDER BY RANDOM() LIMIT ?",
+                (persist_dir, version, num),
+            ).fetchall()
+            if len(rows) < num:
+                rows = None
+            else:
+                db.executemany("DELETE FROM quiz_questions WHERE id = ?", [(r[0],) for r in rows])
+            db.execute("COMMIT")
+            left = db.execute(
+                "SELECT COUNT(*) FROM quiz_questions WHERE persist_dir = ? AND version = ?",
+                (persist_dir, version),
+            ).fetchone()[0]
+        if left < QUIZ_POOL_LOW:
+            self.request_refill(persist_dir)
+        if rows is None:
+            return None
+        quiz = []
+        for i, (_, raw) in enumerate(rows, start=1):
+            q = json.loads(raw)
+            q["question"] = f"Question {i}: {q['question']}"
+            quiz.append(q)
+        return quiz
+
+    def add(self, persist_dir, version, questions):
+        now = time.time()
+        with self._db() as db:
+            db.executemany(
+                "INSERT INTO quiz_questions (persist_dir, question, created_at, version) VALUES (?, ?, ?, ?)",
+                [(persist_dir, json.dumps(q), now, version) for q in questions],
+            )
+
+    def next_window(self, persist_dir, count, size):
+        """Return the chunk offset to generate from next and advance the cursor (wrapping)."""
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT next_offset FROM quiz_cursor WHERE persist_dir = ?", (persist_dir,)
+            ).fetchone()
+            offset = row[0] if row and row[0] < count else 0
+            db.execute(
+                "INSERT OR REPLACE INTO quiz_cursor (persist_dir, next_offset) VALUES (?, ?)",
+                (persist_dir, offset + size),
+            )
+            db.execute("COMMIT")
+        return offset
+
+    def forget(self, persist_dir, version=None):
+        """Drop the document's questions (only those of version, if given) and its cursor."""
+        with self._db() as db:
+            if version is not None:
+                db.execute("DELETE FROM quiz_questions WHERE persist_dir = ? AND version = ?", (persist_dir, version))
+                return
+            db.execute("DELETE FROM quiz_questions WHERE persist_dir = ?", (persist_dir,))
+            db.execute("DELETE FROM quiz_cursor WHERE persist_dir = ?", (persist_dir,))
+
+    @staticmethod
+    def job_id(persist_dir):
+        return "quizpool-" + hashlib.sha1(persist_dir.encode("utf-8")).hexdigest()[:16]
+
+    def request_refill(self, persist_dir):
+        """Queue one low-priority refill job per document (no-op if one is pending)."""
+        job_id = self.job_id(persist_dir)
+        if not JOBS.is_active(job_id):
+            JOBS.enqueue(job_id, "quiz_pool", {"persist_dir": persist_dir}, priority=-1)
+
+
+QUIZ_POOL = QuizPool(os.getenv("QUIZ_POOL_PATH") or os.path.join(DATA_DIR, "quiz_pool.sqlite3"))
+
+
+def _strip_question_number(text):
+    return re.sub(r"^question\s*\d*\s*[:.)-]?\s*", "", text.strip(), flags=re.I)
+
+
+def _quiz_pool_current(persist_dir, version):
+    """The notebook still exists and nothing was appended to it (or it was deleted) since version."""
+    return os.path.isdir(persist_dir) and DOCUMENTS.version(persist_dir) == version
+
+
+def _run_quiz_pool_job(job_id, persist_dir):
+    """
+    Generate questions window by window until the pool is back at its target size. Stops as
+    soon as the notebook is deleted or appended to; delete_doc and the append job bump the
+    notebook version, so questions added just before that are removed here or by them.
+    """
+    if not os.path.isdir(persist_dir):
+        return {"phase": "completed", "pct": 100, "generated": 0}
+    client = get_openai_client()
+    generated = 0
+    version = DOCUMENTS.version(persist_dir)
+    try:
+        with VECTORSTORES.open(persist_dir) as vectordb:
+            count = vectordb._collection.count()
+            if count == 0:
+                return {"phase": "completed", "pct": 100, "generated": 0}
+            # Never loop forever on a document the model cannot write questions for
+            for _ in range(max(1, QUIZ_POOL_TARGET // QUIZ_POOL_QUESTIONS_PER_CALL) * 2):
+                if not _quiz_pool_current(persist_dir, version):
+                    break
+                if QUIZ_POOL.available(persist_dir, version) >= QUIZ_POOL_TARGET:
+                    break
+                offset = QUIZ_POOL.next_window(persist_dir, count, QUIZ_POOL_CHUNKS_PER_CALL)
+                raw = vectordb.get(limit=QUIZ_POOL_CHUNKS_PER_CALL, offset=offset, include=["documents"])
+                chunks = raw.get("documents") or []
+                if not chunks:
+                    continue
+                with Timer("LLM quiz pool", quiet=True):
+                    resp = client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[{"role": "system", "content": quiz_prompt(QUIZ_POOL_QUESTIONS_PER_CALL, get_document_prompt(chunks))}],
+                        temperature=0.2,
+                    )
+                record_llm_usage(resp, "quiz")
+                quiz = parse_quiz(resp.choices[0].message.content or "")
+                for q in quiz:
+                    q["question"] = _strip_question_number(q["question"])
+                QUIZ_POOL.add(persist_dir, version, quiz)
+                if not _quiz_pool_current(persist_dir, version):
+                    # Changed during the call, maybe after its own cleanup ran: take these back
+                    QUIZ_POOL.forget(persist_dir, version)
+                    break
+                generated += len(quiz)
+    except Exception:
+        if _quiz_pool_current(persist_dir, version):
+            raise
+        # The collection went away with the notebook (e.g. chromadb NotFoundError)
+        logging.info("QUIZ POOL %s deleted or changed while generating", persist_dir)
+    if not _quiz_pool_current(persist_dir, version):
+        logging.info("QUIZ POOL %s deleted or changed, stopped after %s", persist_dir, generated)
+        return {"phase": "completed", "pct": 100, "generated": generated, "stopped": True}
+    logging.info("QUIZ POOL %s generated=%s available=%s", persist_dir, generated,
+                 QUIZ_POOL.available(persist_dir, version))
+    return {"phase": "completed", "pct": 100, "generated": generated}
+
+
+JOBS.register("quiz_pool", _run_quiz_pool_job)
+
+
+# ---------- Shared store compaction ----------
+def retire_shared_dir(persist_dir):
+    """
+    Logically delete a document in the shared store: its folder moves to the trash (so every
+    isdir check treats it as gone) and a background job drops the collection and the files.
+    """
+    VECTORSTORES.close(persist_dir)
+    os.makedirs(SHARED_TRASH_DIR, exist_ok=True)
+    trash_dir = os.path.join(SHARED_TRASH_DIR, f"{os.path.basename(persist_dir)}_{uuid.uuid4().hex[:6]}")
+    os.replace(persist_dir, trash_dir)
+    JOBS.enqueue(f"compact_{uuid.uuid4().hex}", "compact", {
+        "trash_dir": trash_dir,
+        "collection": shared_collection_name(persist_dir),
+    }, priority=-2)
+
+
+def _run_compact_job(job_id, trash_dir, collection):
+    try:
+        get_shared_chroma_client().delete_collection(collection)
+    except Exception as e:  # already dropped by an earlier attempt
+        logging.info("Compaction: collection %s not dropped: %s", collection, e)
+    shutil.rmtree(trash_dir, onerror=_on_rm_error)
+    logging.info("Compaction: removed %s", collection)
+    return {"phase": "completed", "pct": 100}
+
+
+JOBS.register("compact", _run_compact_job)
+
+
+def job_state(job_id):
+    """Progress for job_id from this process, or from the durable queue if another process ran it."""
+    return PROGRESS.get(job_id) or JOBS.status(job_id)
+
+
+@app.cli.command("jobs-worker")
+def jobs_worker():
+    """Run queue workers in the foreground (for a dedicated worker process)."""
+    JOBS.workers = max(1, JOBS.workers)
+    JOBS.start()
+    while True:
+        time.sleep(3600)
+
+
+# ---------- Re-indexing from artifacts ----------
+def reindex_notebook(persist_dir):
+    """
+    Drop and rebuild the collection and keyword index of persist_dir from its files' artifacts,
+    with the current chunk settings and embedding model. Records are only parsed again when a
+    file has no usable artifact and its upload is still on disk. Summaries are kept.
+    Every file is chunked and every chunk embedded (into the embedding cache) before anything
+    is dropped, so a file that fails to parse or an embedding error leaves the old index as it
+    was. Returns {"files", "chunks"}.
+    """
+    entries = ARTIFACTS.files(persist_dir)
+    if not entries:
+        raise ValueError("no artifacts recorded for this notebook")
+    missing = [e["source"] or e["path"] for e in entries
+               if not ARTIFACTS.has_records(e["file_hash"]) and not os.path.exists(e["path"] or "")]
+    if missing:
+        raise FileNotFoundError(f"no artifact or upload for: {', '.join(map(str, missing))}")
+
+    t = Timer("reindex")
+    failed = []
+
+    def on_file(i, n, error=None, file_hash=None):
+        if error:
+            failed.append(entries[i]["source"] or entries[i]["path"])
+
+    unique = OrderedDict()
+    for text, meta in iter_batch_chunks([[e["path"], e["source"], e["file_hash"]] for e in entries], on_file):
+        unique.setdefault(chunk_sha256(text), (text, meta))
+    if failed:
+        raise ValueError(f"could not parse: {', '.join(map(str, failed))}")
+    items = [(h, text, meta) for h, (text, meta) in unique.items()]
+
+    # Embed up front; the rebuild below then reads every vector from the cache
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed") as pool:
+        for _ in pool.map(lambda b: embed_with_retry([text for _, text, _ in b]) and None, token_batches(items)):
+            pass
+
+    os.makedirs(persist_dir, exist_ok=True)
+    lexical = LexicalIndex(persist_dir)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(lexical.path + suffix):
+            os.remove(lexical.path + suffix)
+    CHUNK_IDS.forget(persist_dir)
+    CONTENT_INDEX.forget_chunks(persist_dir)
+    for i in range(0, len(items), 500):
+        lexical.add(items[i:i + 500])
+    with VECTORSTORES.open(persist_dir) as vectordb:
+        vectordb.reset_collection()  # in place, so other borrowers of the store keep a live collection
+        embed_and_store(vectordb, items)
+    CONTENT_INDEX.add_chunks(unique, persist_dir, EMBEDDING_MODEL)
+    DOCUMENTS.bump_version(persist_dir)  # the web processes drop answers cached for the old chunks
+    t.done(f"({persist_dir}, files={len(entries)}, chunks={len(items)})")
+    return {"files": len(entries), "chunks": len(items)}
+
+
+@app.cli.command("reindex")
+@click.argument("notebooks", nargs=-1)
+@click.option("--all", "all_", is_flag=True, help="Rebuild every notebook that has artifacts.")
+@click.option("--workers", default=2, show_default=True, help="Notebooks rebuilt at once.")
+def reindex(notebooks, all_, workers):
+    """
+    Rebuild Chroma collections from saved artifacts, without parsing the files again.
+    NOTEBOOKS are persist directories (or their folder names); use after changing the chunk
+    settings or the embedding model, or to recover a lost index. Run it while the web server is
+    stopped: a notebook is empty until its rebuild finishes.
+    """
+    known = ARTIFACTS.notebooks()
+    if all_:
+        targets = known
+    else:
+        by_name = {os.path.basename(d): d for d in known}
+        targets = [by_name.get(n, os.path.abspath(n)) for n in notebooks]
+    if not targets:
+        raise click.UsageError("Name at least one notebook, or pass --all.")
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="reindex") as pool:
+        futures = {pool.submit(reindex_notebook, d): d for d in targets}
+        for fut in as_completed(futures):
+            name = os.path.basename(futures[fut])
+            try:
+                result = fut.result()
+            except Exception as e:
+                failures += 1
+                click.echo(f"{name}: failed: {e}", err=True)
+                continue
+            click.echo(f"{name}: {result['chunks']} chunks from {result['files']} file(s)")
+    if failures:
+        raise SystemExit(1)
+
+
+
+
+# ---------- Document registry ----------
+class DocumentRegistry:
+    """
+    Per-user documents, summaries and quiz results, kept server-side so the session cookie
+    only carries a user id. Every lookup is by (user_id, filename) or user_id, both indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id          TEXT PRIMARY KEY,
+                    current_filename TEXT,
+                    created_at       REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS documents (
+                    user_id     TEXT NOT NULL,
+                    filename    TEXT NOT NULL,
+                    persist_dir TEXT NOT NULL,
+                    summary     TEXT,
+                    created_at  REAL NOT NULL,
+                    PRIMARY KEY (user_id, filename)
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id       TEXT NOT NULL,
+                    filename      TEXT NOT NULL,
+                    correct       INTEGER NOT NULL,
+                    total         INTEGER NOT NULL,
+                    percent       INTEGER NOT NULL,
+                    test_datetime TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS results_user ON results(user_id, id);
+                CREATE TABLE IF NOT EXISTS notebook_versions (
+                    persist_dir TEXT PRIMARY KEY,
+                    version     INTEGER NOT NULL
+                );
+                """
+            )
 
-    except Exception as e:
-        PROGRESS[job_id] = {"phase": "error", "pct": end_pct, "error": str(e)}
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def ensure_user(self, user_id):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO users (user_id, created_at) VALUES (?, ?)", (user_id, time.time())
+            )
+
+    def docs(self, user_id):
+        """{filename: {"persist_dir", "summary"}} in upload order."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT filename, persist_dir, summary FROM documents WHERE user_id = ? ORDER BY created_at",
+                (user_id,),
+            ).fetchall()
+        return OrderedDict((fn, {"persist_dir": pd, "summary": sm}) for fn, pd, sm in rows)
+
+    def get(self, user_id, filename):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT persist_dir, summary FROM documents WHERE user_id = ? AND filename = ?",
+                (user_id, filename or ""),
+            ).fetchone()
+        return {"persist_dir": row[0], "summary": row[1]} if row else None
+
+    def version(self, persist_dir):
+        """Content version of the notebook in persist_dir, shared by every process (0 until changed)."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT version FROM notebook_versions WHERE persist_dir = ?", (persist_dir,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, persist_dir):
+        """Record that the notebook's content changed, retiring cached answers and pooled questions everywhere."""
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO notebook_versions (persist_dir, version) VALUES (?, 1) "
+                "ON CONFLICT (persist_dir) DO UPDATE SET version = version + 1",
+                (persist_dir,),
+            )
+
+    def put(self, user_id, filename, persist_dir, summary=None):
+        """Add a document, or point an existing filename at a new upload (keeps its list position)."""
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO documents (user_id, filename, persist_dir, summary, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, filename) DO UPDATE SET persist_dir = excluded.persist_dir, "
+                "summary = excluded.summary",
+                (user_id, filename, persist_dir, summary, time.time()),
+            )
+
+    def set_summary(self, user_id, filename, summary):
+        with self._db() as db:
+            db.execute(
+                "UPDATE documents SET summary = ? WHERE user_id = ? AND filename = ?",
+                (summary, user_id, filename),
+            )
+
+    def remove(self, user_id, filename):
+        with self._db() as db:
+            db.execute("DELETE FROM documents WHERE user_id = ? AND filename = ?", (user_id, filename))
+            db.execute(
+                "UPDATE users SET current_filename = NULL WHERE user_id = ? AND current_filename = ?",
+                (user_id, filename),
+            )
+
+    def current(self, user_id):
+        """(filename, summary) of the document shown on the upload page, or (None, None)."""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT d.filename, d.summary FROM users u JOIN documents d "
+                "ON d.user_id = u.user_id AND d.filename = u.current_filename WHERE u.user_id = ?",
+                (user_id,),
+            ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def set_current(self, user_id, filename):
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO users (user_id, current_filename, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET current_filename = excluded.current_filename",
+                (user_id, filename, time.time()),
+            )
+
+    def add_result(self, user_id, result):
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO results (user_id, filename, correct, total, percent, test_datetime) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, result["filename"], result["correct"], result["total"],
+                 result["percent"], result["test_datetime"]),
+            )
 
+    def results(self, user_id, limit=500):
+        """Newest first, like the list the session used to keep."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT filename, correct, total, percent, test_datetime FROM results "
+                "WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        keys = ("filename", "correct", "total", "percent", "test_datetime")
+        return [dict(zip(keys, r)) for r in rows]
+
+
+DOCUMENTS = DocumentRegistry(os.getenv("DOC_REGISTRY_PATH") or os.path.join(DATA_DIR, "documents.sqlite3"))
+
+# Keys older sessions kept in the cookie; moved into the registry on first sight
+_LEGACY_SESSION_KEYS = ("docs", "results", "uploaded_files", "uploaded_filename",
+                        "summary_text", "summary_generated", "persist_directory")
+
+
+def current_user_id():
+    """The registry id for this browser, created on first use."""
+    user_id = session.get("uid")
+    if not user_id:
+        user_id = uuid.uuid4().hex
+        session["uid"] = user_id
+        DOCUMENTS.ensure_user(user_id)
+    if any(k in session for k in _LEGACY_SESSION_KEYS):
+        _import_legacy_session(user_id)
+    return user_id
+
+
+def _import_legacy_session(user_id):
+    for fn, info in (session.get("docs") or {}).items():
+        if info and info.get("persist_dir"):
+            DOCUMENTS.put(user_id, fn, info["persist_dir"], info.get("summary"))
+    for r in reversed(session.get("results") or []):
+        DOCUMENTS.add_result(user_id, r)
+    if session.get("uploaded_filename"):
+        DOCUMENTS.set_current(user_id, session["uploaded_filename"])
+    for k in _LEGACY_SESSION_KEYS:
+        session.pop(k, None)
+
+
+# ---------- Resumable uploads ----------
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # seconds since the last part
+UPLOAD_COPY_BUFFER = 256 * 1024
+
+
+class UploadSessions:
+    """
+    Uploads sent as fixed-size parts. Each part is written at the offset the server has
+    confirmed so far and checked against its SHA-256, so a dropped connection resumes from
+    the last good part instead of from zero. Parts stream from the request body into a
+    .part file through one reusable buffer: memory per upload does not grow with file size.
+
+    A part body is first spooled to its own file; it is copied into place and `received`
+    advanced in one write transaction, so two copies of the same part (a retry racing the
+    original, or another worker) can never both land, and bytes already confirmed are never
+    cut off. The running digest of confirmed parts is checked against the file at finish.
+    """
+
+    def __init__(self, path, partial_dir, part_size=UPLOAD_PART_SIZE, ttl=UPLOAD_SESSION_TTL):
+        self.path = path
+        self.partial_dir = partial_dir
+        self.part_size = part_size
+        self.ttl = ttl
+        os.makedirs(partial_dir, exist_ok=True)
+        with self._db() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    upload_id  TEXT PRIMARY KEY,
+                    user_id    TEXT NOT NULL,
+                    job_id     TEXT NOT NULL,
+                    filename   TEXT NOT NULL,
+                    append_to  TEXT,
+                    size       INTEGER NOT NULL,
+                    part_size  INTEGER NOT NULL,
+                    received   INTEGER NOT NULL DEFAULT 0,
+                    digest     TEXT NOT NULL DEFAULT '',
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS uploads_updated ON uploads(updated_at);
+                """
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(uploads)")}
+            if "digest" not in columns:  # sessions opened before parts were chained
+                db.execute("ALTER TABLE uploads ADD COLUMN digest TEXT NOT NULL DEFAULT ''")
 
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_dir, f"{upload_id}.part")
+
+    @staticmethod
+    def _chain(digest, part_digest):
+        """Running digest of the parts confirmed so far: sha256(previous + this part)."""
+        return hashlib.sha256(f"{digest}{part_digest}".encode()).hexdigest()
+
+    @staticmethod
+    def _copy(src, dst, length, view):
+        """Stream up to length bytes from src to dst through view; returns (bytes copied, sha256)."""
+        digest = hashlib.sha256()
+        copied = 0
+        while copied < length:
+            n = src.readinto(view[:min(len(view), length - copied)])
+            if not n:
+                break
+            dst.write(view[:n])
+            digest.update(view[:n])
+            copied += n
+        return copied, digest.hexdigest()
+
+    def start(self, user_id, job_id, filename, size, append_to=None):
+        self.sweep()
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), "wb").close()
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO uploads (upload_id, user_id, job_id, filename, append_to, size, part_size, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, user_id, job_id, filename, append_to, size, self.part_size, time.time()),
+            )
+        return self.get(upload_id, user_id)
+
+    def get(self, upload_id, user_id):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT job_id, filename, append_to, size, part_size, received FROM uploads "
+                "WHERE upload_id = ? AND user_id = ?",
+                (upload_id, user_id),
+            ).fetchone()
+        if not row:
+            return None
+        keys = ("job_id", "filename", "append_to", "size", "part_size", "received")
+        return {"upload_id": upload_id, **dict(zip(keys, row))}
+
+    def write_part(self, info, offset, stream, length, checksum=None):
+        """
+        Write length bytes from stream at offset. Returns None and advances received, or an
+        error message; on a conflict info["received"] is refreshed to where the upload stands.
+        """
+        if offset != info["received"]:
+            return f"expected offset {info['received']}"
+        expected = min(info["part_size"], info["size"] - offset)
+        if expected <= 0:
+            return "upload already complete"
+        if length != expected:
+            return f"part must be {expected} bytes"
+
+        buf = bytearray(min(UPLOAD_COPY_BUFFER, length))
+        view = memoryview(buf)
+        upload_id = info["upload_id"]
+        spool = os.path.join(self.partial_dir, f"{upload_id}.{uuid.uuid4().hex}.spool")
+        try:
+            with open(spool, "w+b") as tmp:
+                written, part_digest = self._copy(stream, tmp, length, view)
+                if written != length:
+                    return "part incomplete"
+                if checksum and part_digest != checksum.lower():
+                    return "part checksum mismatch"
+                tmp.seek(0)
+                with self._db() as db:
+                    db.execute("BEGIN IMMEDIATE")
+                    row = db.execute(
+                        "SELECT received, digest FROM uploads WHERE upload_id = ?", (upload_id,)
+                    ).fetchone()
+                    if row is None:
+                        return "upload not found"
+                    if row[0] != offset:
+                        info["received"] = row[0]
+                        return "part already received" if row[0] > offset else f"expected offset {row[0]}"
+                    # Only bytes past the confirmed offset are touched, under the write lock
+                    with open(self._part_path(upload_id), "r+b") as f:
+                        f.seek(offset)
+                        self._copy(tmp, f, length, view)
+                    db.execute(
+                        "UPDATE uploads SET received = ?, digest = ?, updated_at = ? WHERE upload_id = ?",
+                        (offset + length, self._chain(row[1], part_digest), time.time(), upload_id),
+                    )
+        finally:
+            try:
+                os.remove(spool)
+            except FileNotFoundError:
+                pass
+        info["received"] = offset + length
+        METRICS.inc("bytes", length, kind="upload")
+        return None
+
+    def finish(self, info, dest_path):
+        """
+        Claim the completed upload, check the file against the confirmed size and part
+        digests, and move it to dest_path. Returns None, or an error message; only one
+        caller can claim a session, and a file that fails the check is thrown away.
+        """
+        upload_id = info["upload_id"]
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT size, part_size, received, digest FROM uploads WHERE upload_id = ?", (upload_id,)
+            ).fetchone()
+            if row is None:
+                return "upload already finished"
+            size, part_size, received, expected = row
+            if received != size:
+                info["received"] = received
+                return "upload incomplete"
+            db.execute("DELETE FROM uploads WHERE upload_id = ?", (upload_id,))
+
+        part_path = self._part_path(upload_id)
+        error = None
+        if os.path.getsize(part_path) != size:
+            error = "upload size mismatch"
+        else:
+            digest = ""
+            view = memoryview(bytearray(min(UPLOAD_COPY_BUFFER, part_size)))
+            with open(part_path, "rb") as f:
+                for _ in range(0, size, part_size):
+                    part = hashlib.sha256()
+                    left = min(part_size, size - f.tell())
+                    while left:
+                        n = f.readinto(view[:min(len(view), left)])
+                        if not n:
+                            break
+                        part.update(view[:n])
+                        left -= n
+                    digest = self._chain(digest, part.hexdigest())
+            if digest != expected:
+                error = "upload checksum mismatch"
+        if error:
+            os.remove(part_path)
+            return error
+        os.replace(part_path, dest_path)
+        return None
+
+    def discard(self, upload_id):
+        with self._db() as db:
+            db.execute("DELETE FROM uploads WHERE upload_id = ?", (upload_id,))
+        try:
+            os.remove(self._part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """Drop sessions nobody has resumed within ttl, with their partial and spooled files."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT upload_id FROM uploads WHERE updated_at < ?", (time.time() - self.ttl,)
+            ).fetchall()
+        for (upload_id,) in rows:
+            self.discard(upload_id)
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            if name.endswith(".spool") and os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+UPLOADS = UploadSessions(
+    os.getenv("UPLOAD_SESSIONS_PATH") or os.path.join(DATA_DIR, "upload_sessions.sqlite3"),
+    os.path.join(app.config["UPLOAD_FOLDER"], ".partial"),
+)
 
 
 # ---------- Routes ----------
+@app.before_request
+def _start_request_span():
+    _SPAN.set(None)  # worker threads are reused; never nest under a previous request
+    g.request_span = Timer(f"http {request.endpoint or 'unknown'}", quiet=True)
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another request in this process is being profiled
+            return
+        g.profiler = profiler
+
+
+@app.after_request
+def _count_request(response):
+    METRICS.inc("http_requests", endpoint=request.endpoint or "unknown", status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def _finish_request_span(exc=None):
+    span = g.pop("request_span", None)
+    if span is not None:
+        span.done()
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        log.info("[PROFILE] %s %s\n%s", request.method, request.path, out.getvalue())
+
+
+@app.get("/metrics")
+def metrics():
+    """Stage latency histograms, token/byte counters and cache stats (Prometheus text, or ?format=json)."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    gauges = {
+        "vectorstores": VECTORSTORES.stats(),
+        "embedding_cache": EMBEDDING_CACHE.stats(),
+        "answer_cache": ANSWER_CACHE.stats(),
+    }
+    if request.args.get("format") == "json":
+        return jsonify(stages=METRICS.summary(), **gauges)
+    return Response(METRICS.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
 @app.get("/")
 @app.get("/home")
 def home():
@@ -265,12 +3254,13 @@ def delete_doc():
     if not filename:
         return jsonify(ok=False, error="Please select a document to delete."), 400
 
-    docs = session.get("docs", {})
+    user_id = current_user_id()
+    info = DOCUMENTS.get(user_id, filename)
 
-    if filename not in docs:
+    if info is None:
         return jsonify(ok=False, error="Selected document not found."), 404
 
-    persist_dir = docs[filename].get("persist_dir")
+    persist_dir = info.get("persist_dir")
     if not persist_dir:
         return jsonify(ok=False, error="No database path stored for this document."), 500
     
@@ -282,6 +3272,29 @@ def delete_doc():
         # Don’t pretend it worked
         return jsonify(ok=False, error=f"Database folder not found: {persist_dir}"), 404
 
+    # Other uploads of the same bytes share this folder; only drop our reference
+    if CONTENT_INDEX.release_dir(persist_dir) > 0:
+        app.logger.info("persist_dir %s still referenced, keeping it", persist_dir)
+        _forget_doc(user_id, filename)
+        return jsonify(ok=True, message=f"Deleted '{filename}' successfully.")
+
+    # Release open handles first so the files are not locked
+    VECTORSTORES.close(persist_dir)
+    CHUNK_IDS.forget(persist_dir)
+    ANSWER_CACHE.invalidate(persist_dir)
+    SUMMARIES.forget(persist_dir)
+    # A running refill sees the new version and stops; a queued one never starts
+    DOCUMENTS.bump_version(persist_dir)
+    JOBS.cancel(QUIZ_POOL.job_id(persist_dir))
+    QUIZ_POOL.forget(persist_dir)
+    ARTIFACTS.forget_notebook(persist_dir)
+
+    # Shared store: hide it now, drop the collection in the background
+    if is_shared_dir(persist_dir):
+        retire_shared_dir(persist_dir)
+        _forget_doc(user_id, filename)
+        return jsonify(ok=True, message=f"Deleted '{filename}' successfully.")
+
     # Try deleting with retries (Windows file locks)
     last_err = None
     for attempt in range(3):
@@ -297,52 +3310,45 @@ def delete_doc():
     if last_err:
         return jsonify(ok=False, error=f"Failed to delete database: {last_err}"), 500
 
-    # Remove from session
-    docs.pop(filename, None)
-    session["docs"] = docs
+    _forget_doc(user_id, filename)
+    return jsonify(ok=True, message=f"Deleted '{filename}' successfully.")
+
 
-    # Clear active doc if it was the deleted one
-    if session.get("uploaded_filename") == filename:
-        session.pop("uploaded_filename", None)
-        session.pop("summary_text", None)
-        session.pop("persist_directory", None)
+def _forget_doc(user_id, filename):
+    # Also clears the active doc if it was the deleted one
+    DOCUMENTS.remove(user_id, filename)
 
     flash(f"Deleted '{filename}' successfully.", "success")
-    return jsonify(ok=True, message=f"Deleted '{filename}' successfully.")
 
 
 #generate questions
 @app.get("/upload_notebook")
 def upload_notebook():
+    user_id = current_user_id()
     job_id = session.get("job_id")
     if job_id:
-        st = PROGRESS.get(job_id, {})
+        st = job_state(job_id) or {}
         phase = (st.get("phase") or "").lower()
         if phase == "completed" and st.get("summary"):
-            docs = session.get("docs", {})
-            filename = st.get("filename") or session.get("uploaded_filename")
-            # Save summary per document
+            filename = st.get("filename")
+            # Save summary per document; it also becomes the "current" one for the page
             if filename:
-                info = docs.get(filename, {})
-                info["persist_dir"] = info.get("persist_dir") or session.get("persist_directory")
-                info["summary"] = st["summary"]
-                docs[filename] = info
-                session["docs"] = docs
-                # Also keep "current" summary for the page
-                session["uploaded_filename"] = filename
-                session["summary_text"] = st["summary"]
-            PROGRESS.pop(job_id, None)
+                DOCUMENTS.set_summary(user_id, filename, st["summary"])
+                DOCUMENTS.set_current(user_id, filename)
+            PROGRESS.pop(job_id)
             session.pop("job_id", None)
             job_id = None  # <- ensures the template won’t emit data-job-id
         elif phase == "error":
             flash(f"⚠️ Could not build index or generate summary: {st.get('error')}", "error")
-            PROGRESS.pop(job_id, None)
+            PROGRESS.pop(job_id)
             session.pop("job_id", None)
             job_id = None
 
+    filename, summary = DOCUMENTS.current(user_id)
     return render_template("upload_notebook.html",
-        filename=session.get("uploaded_filename"),
-        summary=session.get("summary_text"),
+        filename=filename,
+        summary=summary,
+        docs=DOCUMENTS.docs(user_id),
         job_id=job_id,  # will be None if finished
     )
 
@@ -351,8 +3357,7 @@ def upload_notebook():
 @app.get("/summary")
 def get_summary():
     filename = request.args.get("filename", "")
-    docs = session.get("docs", {})
-    info = docs.get(filename) or {}
+    info = DOCUMENTS.get(current_user_id(), filename) or {}
     summary = info.get("summary")
     return jsonify({"ok": True, "summary": summary or ""})
 
@@ -377,11 +3382,69 @@ def nl2br(s):
 @app.post("/init_upload")
 def init_upload():
     job_id = uuid.uuid4().hex
-    PROGRESS[job_id] = {"phase": "Uploading", "pct": 0}
+    PROGRESS.set(job_id, {"phase": "Uploading", "pct": 0})
     session["job_id"] = job_id  # so /generate can render it
     return jsonify({"ok": True, "job_id": job_id})
 
 
+def _notebook_exists(user_id, filename):
+    info = DOCUMENTS.get(user_id, filename)
+    return bool(info and info["persist_dir"] and os.path.isdir(info["persist_dir"]))
+
+
+def start_ingest(job_id, user_id, save_path, filename, append_to=None):
+    """
+    Queue background processing for a saved upload and register it for the sidebar.
+    With append_to the file is added to that notebook instead. Returns the notebook filename.
+    """
+    if append_to:
+        target = DOCUMENTS.get(user_id, append_to)
+        DOCUMENTS.set_current(user_id, append_to)
+        PROGRESS.set(job_id, {"phase": "queued", "pct": 40, "filename": append_to})
+        JOBS.enqueue(job_id, "append", {
+            "user_id": user_id,
+            "filename": append_to,
+            "path": save_path,
+            "previous_summary": target["summary"] if target else None,
+        }, priority=1)
+        logging.info("UPLOAD APPEND job=%s notebook=%s", job_id, append_to)
+        return append_to
+
+    # Check whether these exact bytes were already indexed
+    base = os.path.splitext(filename)[0]
+    file_hash = file_sha256(save_path)
+    existing = CONTENT_INDEX.acquire_file(file_hash)
+    if existing:
+        logging.info("UPLOAD DEDUP job=%s file=%s persist_dir=%s", job_id, filename, existing["persist_dir"])
+        DOCUMENTS.put(user_id, filename, existing["persist_dir"])
+        DOCUMENTS.set_current(user_id, filename)
+        PROGRESS.update(job_id, phase="completed", pct=100, summary=existing["summary"], filename=filename)
+        return filename
+
+    # Here upload is complete → move to 40%; extraction happens in the background job
+    PROGRESS.set(job_id, {
+        "phase": "queued",
+        "pct": 40,
+        "filename": filename
+    })
+    # Register the document for the sidebar; its summary arrives when the job completes
+    persist_dir = new_persist_dir(base)
+    DOCUMENTS.put(user_id, filename, persist_dir)
+    DOCUMENTS.set_current(user_id, filename)
+
+    # Smaller files first so a quick upload is not stuck behind a textbook
+    priority = 1 if os.path.getsize(save_path) < 5 * 1024 * 1024 else 0
+    JOBS.enqueue(job_id, "ingest", {
+        "persist_dir": persist_dir,
+        "filename": filename,
+        "start_pct": 40,
+        "end_pct": 100,
+        "file_hash": file_hash,
+        "path": save_path,
+    }, priority=priority)
+    return filename
+
+
 @app.post("/upload")
 def upload():
     job_id = request.headers.get("X-Job-Id") or session.get("job_id")
@@ -395,7 +3458,8 @@ def upload():
     )
 
     session["job_id"] = job_id
-    PROGRESS.setdefault(job_id, {"phase": "Uploading", "pct": 0})
+    if PROGRESS.get(job_id) is None:
+        PROGRESS.set(job_id, {"phase": "Uploading", "pct": 0})
 
     # Detect XHR upload (AJAX)
     is_xhr = request.headers.get("X-Requested-With") == "XMLHttpRequest"
@@ -424,48 +3488,18 @@ def upload():
         flash(msg, "error")
         return redirect(url_for("upload_notebook"))
 
-    # Save + extract text
-    text, base, filename = process_uploaded_file(f)
-
-    # Here upload is complete → move to 40%
-    PROGRESS[job_id] = {
-        "phase": "queued",
-        "pct": 40,
-        "filename": filename
-    }
-    # Track uploaded list for sidebar
-    uploaded = session.get("uploaded_files", [])
-    uploaded.append(filename)
-    session["uploaded_files"] = uploaded
-
-    # Init session state for this upload
-    persist_dir = os.path.abspath(
-        f"./chroma_db_{base}_{uuid.uuid4().hex[:8]}"
-    )
-
-    docs = session.get("docs", {})
-    docs[filename] = {
-        "persist_dir": persist_dir,
-    }
-    session["docs"] = docs
-    session["persist_directory"] = persist_dir
-    session["uploaded_filename"] = filename
-    session["summary_text"] = None
-    session["summary_generated"] = False
-
-    # Start background processing
-    PROGRESS[job_id] = {
-        "phase": "queued",
-        "pct": 40,
-        "filename": filename
-    }
+    # Adding to an existing notebook: embed just this file into its collection
+    append_to = request.form.get("append_to")
+    user_id = current_user_id()
+    if append_to and not _notebook_exists(user_id, append_to):
+        msg = "Selected notebook not found."
+        if is_xhr:
+            return jsonify(ok=False, error=msg), 404
+        flash(msg, "error")
+        return redirect(url_for("upload_notebook"))
 
-    t = Thread(
-        target=_process_job,
-        args=(job_id, text, persist_dir, filename, 40, 100),
-        daemon=True
-    )
-    t.start()
+    save_path, filename = save_uploaded_file(f)
+    filename = start_ingest(job_id, user_id, save_path, filename, append_to)
 
     app.logger.info(
         "XHR=%s X-Job-Id=%s",
@@ -483,9 +3517,145 @@ def upload():
     return redirect(url_for("upload_notebook"))
 
 
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "60"))
+
+
+@app.post("/upload/batch")
+def upload_batch():
+    """Several files (form field "files") into one notebook, built by a single background job."""
+    job_id = request.headers.get("X-Job-Id") or session.get("job_id") or uuid.uuid4().hex
+    session["job_id"] = job_id
+    uploads = [f for f in request.files.getlist("files") if f and f.filename]
+    if not uploads:
+        return jsonify(ok=False, error="No files selected."), 400
+    if len(uploads) > BATCH_MAX_FILES:
+        return jsonify(ok=False, error=f"At most {BATCH_MAX_FILES} files per batch."), 400
+    unsupported = [f.filename for f in uploads if not allowed_file(f.filename)]
+    if unsupported:
+        return jsonify(ok=False, error="Unsupported file type: " + ", ".join(unsupported)), 400
+
+    files = [list(save_uploaded_file(f)) for f in uploads]
+    first = os.path.splitext(files[0][1])[0]
+    filename = secure_filename(request.form.get("notebook") or "") or (
+        f"{first}_and_{len(files) - 1}_more" if len(files) > 1 else files[0][1])
+
+    user_id = current_user_id()
+    persist_dir = new_persist_dir(os.path.splitext(filename)[0])
+    DOCUMENTS.put(user_id, filename, persist_dir)
+    DOCUMENTS.set_current(user_id, filename)
+    PROGRESS.set(job_id, {
+        "phase": "queued",
+        "pct": 40,
+        "filename": filename,
+        "files": [{"name": name, "phase": "queued", "chunks": 0} for _, name in files],
+    })
+    JOBS.enqueue(job_id, "batch", {
+        "persist_dir": persist_dir,
+        "filename": filename,
+        "files": files,
+    })
+    logging.info("UPLOAD BATCH job=%s notebook=%s files=%s", job_id, filename, len(files))
+    return jsonify(ok=True, job_id=job_id, filename=filename, files=[name for _, name in files])
+
+
+@app.post("/upload/parts")
+def start_part_upload():
+    """Open a resumable upload: {filename, size, append_to?, job_id?} → upload_id and part size."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get("filename") or "")
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        size = -1
+    if not filename or not allowed_file(filename):
+        return jsonify(ok=False, error="Unsupported file type. Please upload PDF, DOCX, PPTX or TXT."), 400
+    if size <= 0 or size > UPLOAD_MAX_BYTES:
+        return jsonify(ok=False, error="Invalid file size."), 400
+
+    user_id = current_user_id()
+    append_to = data.get("append_to")
+    if append_to and not _notebook_exists(user_id, append_to):
+        return jsonify(ok=False, error="Selected notebook not found."), 404
+
+    job_id = data.get("job_id") or session.get("job_id") or uuid.uuid4().hex
+    session["job_id"] = job_id
+    if PROGRESS.get(job_id) is None:
+        PROGRESS.set(job_id, {"phase": "Uploading", "pct": 0})
+    info = UPLOADS.start(user_id, job_id, filename, size, append_to)
+    logging.info("UPLOAD PARTS START job=%s upload=%s size=%s", job_id, info["upload_id"], size)
+    return jsonify(ok=True, **info)
+
+
+@app.get("/upload/parts/<upload_id>")
+def part_upload_status(upload_id):
+    """Where to resume: the number of bytes received so far."""
+    info = UPLOADS.get(upload_id, current_user_id())
+    if info is None:
+        return jsonify(ok=False, error="Upload not found."), 404
+    return jsonify(ok=True, **info)
+
+
+@app.put("/upload/parts/<upload_id>")
+def upload_part(upload_id):
+    """Raw part body at ?offset=N, with its SHA-256 in X-Part-Sha256."""
+    info = UPLOADS.get(upload_id, current_user_id())
+    if info is None:
+        return jsonify(ok=False, error="Upload not found."), 404
+    offset = request.args.get("offset", type=int)
+    if offset is None or request.content_length is None:
+        return jsonify(ok=False, error="offset and Content-Length are required."), 400
+
+    error = UPLOADS.write_part(info, offset, request.stream, request.content_length,
+                               request.headers.get("X-Part-Sha256"))
+    if error == "upload not found":
+        return jsonify(ok=False, error="Upload not found."), 404
+    if error:
+        status = 409 if offset != info["received"] or error == "upload already complete" else 400
+        return jsonify(ok=False, error=error, received=info["received"]), status
+
+    # Upload progress runs 0→40%; processing takes over from there
+    PROGRESS.update(info["job_id"], phase="Uploading", pct=int(40 * info["received"] / info["size"]))
+    return jsonify(ok=True, received=info["received"], size=info["size"])
+
+
+@app.post("/upload/parts/<upload_id>/finish")
+def finish_part_upload(upload_id):
+    user_id = current_user_id()
+    info = UPLOADS.get(upload_id, user_id)
+    if info is None:
+        return jsonify(ok=False, error="Upload not found."), 404
+    if info["received"] != info["size"]:
+        return jsonify(ok=False, error="Upload incomplete.", received=info["received"]), 409
+    if info["append_to"] and not _notebook_exists(user_id, info["append_to"]):
+        UPLOADS.discard(upload_id)
+        return jsonify(ok=False, error="Selected notebook not found."), 404
+
+    save_path = upload_path(info["filename"])
+    error = UPLOADS.finish(info, save_path)
+    if error == "upload incomplete":
+        return jsonify(ok=False, error="Upload incomplete.", received=info["received"]), 409
+    if error == "upload already finished":
+        return jsonify(ok=False, error="Upload already finished."), 409
+    if error:
+        # The assembled file does not match the confirmed parts; it has been dropped
+        PROGRESS.update(info["job_id"], phase="error", pct=100, error=f"Upload failed: {error}")
+        return jsonify(ok=False, error=f"Upload failed: {error}. Please upload the file again."), 400
+    filename = start_ingest(info["job_id"], user_id, save_path, info["filename"], info["append_to"])
+    logging.info("UPLOAD PARTS DONE job=%s upload=%s", info["job_id"], upload_id)
+    return jsonify(ok=True, job_id=info["job_id"], filename=filename)
+
+
+@app.delete("/upload/parts/<upload_id>")
+def cancel_part_upload(upload_id):
+    if UPLOADS.get(upload_id, current_user_id()) is None:
+        return jsonify(ok=False, error="Upload not found."), 404
+    UPLOADS.discard(upload_id)
+    return jsonify(ok=True)
+
+
 @app.get("/progress/<job_id>")
 def get_progress(job_id):
-    st = PROGRESS.get(job_id)
+    st = job_state(job_id)
     if not st:
         # IMPORTANT: don't send {"queued":0} fallback, it causes UI jumps
         return jsonify({"ok": False, "missing": True, "phase": "missing", "pct": 0}), 404
@@ -495,31 +3665,436 @@ def get_progress(job_id):
     return resp
 
 
+PROGRESS_STREAM_MAX = 55  # seconds per SSE connection; EventSource reconnects on its own
+# Each stream holds a WSGI thread for up to PROGRESS_STREAM_MAX; past this many per process
+# clients are sent back to polling (asgi.py streams without holding threads)
+PROGRESS_STREAM_MAX_OPEN = int(os.getenv("PROGRESS_STREAM_MAX_OPEN", "2"))
+_progress_streams = threading.Semaphore(PROGRESS_STREAM_MAX_OPEN)
 
-@app.route("/ask", methods=["POST"])
-def ask():
-    data = request.get_json(silent=True) or {}
-    question = data.get("question", "").strip()
-    filename = data.get("filename")
-    if not question:
-        return jsonify({"ok": False, "error": "Question is required."}), 400
-    
-    # Look up persist_dir by filename
-    docs = session.get("docs", {})
-    info = docs.get(filename or "", {})
 
+def progress_event(st):
+    """One SSE message for a progress state (None: the job is unknown)."""
+    if st is None:
+        return 'event: missing\ndata: {"ok": false, "missing": true, "phase": "missing", "pct": 0}\n\n'
+    return f"data: {json.dumps({'ok': True, **st})}\n\n"
+
+
+def progress_done(st):
+    return st is None or (st.get("phase") or "").lower() in ("completed", "error")
+
+
+@app.get("/progress/<job_id>/stream")
+def stream_progress(job_id):
+    """
+    Server-Sent Events: push every progress change as it happens instead of being polled.
+    Sync workers (one request per worker) and processes already at PROGRESS_STREAM_MAX_OPEN
+    streams answer 503; the page then polls /progress/<job_id> instead.
+    """
+    if not request.environ.get("wsgi.multithread") or not _progress_streams.acquire(blocking=False):
+        METRICS.inc("progress_streams_refused")
+        return jsonify(ok=False, error="Progress streaming unavailable, poll /progress instead."), 503
+
+    def events():
+        sub = PROGRESS.subscribe(job_id)
+        try:
+            yield "retry: 1000\n\n"
+            last = object()
+            deadline = time.monotonic() + PROGRESS_STREAM_MAX
+            # Shared stores may be written by other processes, so re-read them often
+            recheck = 1.0 if PROGRESS.shared else 15.0
+            st = job_state(job_id)
+            while True:
+                if st != last:
+                    yield progress_event(st)
+                    last = st
+                if progress_done(st):
+                    return
+                if time.monotonic() >= deadline:
+                    return
+                try:
+                    st = sub.get(timeout=recheck)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    st = job_state(job_id)
+        finally:
+            PROGRESS.unsubscribe(job_id, sub)
+
+    resp = Response(events(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.call_on_close(_progress_streams.release)
+    return resp
+
+
+
+# ---------- Semantic answer cache ----------
+class AnswerCache:
+    """
+    Per-document cache of /ask answers. A new question reuses a stored answer when its
+    embedding is at least `threshold` cosine-similar to a previous question on the same
+    document. Entries expire after ttl seconds; each document keeps at most max_per_doc
+    entries (least recently used dropped first).
+    The cache lives in each process, so entries carry the notebook version from the shared
+    registry (DOCUMENTS.version): a change made by any process retires them everywhere.
+    """
+
+    def __init__(self, threshold=0.95, ttl=86400, max_per_doc=200):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_per_doc = max_per_doc
+        self._docs = {}  # persist_dir -> {"version", "entries": OrderedDict(question -> entry)}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def lookup(self, persist_dir, version, question_vector):
+        """Return the cached answer for a similar question on this version of the notebook, or None."""
+        q = self._unit(question_vector)
+        now = time.monotonic()
+        with self._lock:
+            doc = self._docs.get(persist_dir)
+            if doc and doc["version"] < version:
+                self._docs.pop(persist_dir)
+            entries = doc["entries"] if doc and doc["version"] == version else None
+            best, best_score = None, -1.0
+            if entries:
+                for key in [k for k, e in entries.items() if now - e["created"] > self.ttl]:
+                    entries.pop(key)
+                if entries:
+                    keys = list(entries)
+                    scores = np.stack([entries[k]["vector"] for k in keys]) @ q
+                    i = int(np.argmax(scores))
+                    best, best_score = keys[i], float(scores[i])
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            entry = entries[best]
+            entries.move_to_end(best)
+            self.hits += 1
+            self.seconds_saved += entry["seconds"]
+        log.info("[CACHE] answer hit score=%.3f saved=%.2fs", best_score, entry["seconds"])
+        return entry["answer"]
+
+    def store(self, persist_dir, version, question, question_vector, answer, seconds):
+        """
+        version: the notebook version read before answering, so an answer from content that
+        changed meanwhile is not kept. seconds: how long producing the answer took, credited
+        as saved on each hit.
+        """
+        if not answer:
+            return
+        with self._lock:
+            doc = self._docs.get(persist_dir)
+            if doc and doc["version"] > version:
+                return
+            if not doc or doc["version"] < version:
+                doc = self._docs[persist_dir] = {"version": version, "entries": OrderedDict()}
+            entries = doc["entries"]
+            entries[question] = {
+                "vector": self._unit(question_vector),
+                "answer": answer,
+                "seconds": seconds,
+                "created": time.monotonic(),
+            }
+            entries.move_to_end(question)
+            while len(entries) > self.max_per_doc:
+                entries.popitem(last=False)
+
+    def invalidate(self, persist_dir):
+        with self._lock:
+            self._docs.pop(persist_dir, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "documents": len(self._docs),
+                "entries": sum(len(d["entries"]) for d in self._docs.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "seconds_saved": round(self.seconds_saved, 2),
+            }
+
+
+ANSWER_CACHE = AnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    max_per_doc=int(os.getenv("ANSWER_CACHE_MAX_PER_DOC", "200")),
+)
+
+
+def _doc_persist_dir(filename):
+    """persist_dir of one of this user's documents, or None if it is gone."""
+    info = DOCUMENTS.get(current_user_id(), filename)
     persist_dir = info.get("persist_dir") if info else None
     if not persist_dir or not os.path.isdir(persist_dir):
-        return jsonify({"ok": False, "error": "Please select a Notebook before asking a Question."}), 400
+        return None
+    return persist_dir
 
-    client = get_openai_client()
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=client.api_key)
-    vectordb = Chroma(embedding_function=embeddings, persist_directory=persist_dir)
 
-    # Retrieve relevant docs
-    retrieved = vectordb.similarity_search(question, k=10)
+# ---------- Retrieval ----------
+ASK_FETCH_K = int(os.getenv("ASK_FETCH_K", "24"))  # candidates fetched before reranking
+ASK_MAX_CHUNKS = int(os.getenv("ASK_MAX_CHUNKS", "10"))
+ASK_CONTEXT_TOKENS = int(os.getenv("ASK_CONTEXT_TOKENS", "2500"))  # budget for retrieved context
+ASK_MMR_LAMBDA = float(os.getenv("ASK_MMR_LAMBDA", "0.7"))  # 1.0 = relevance only, lower = more diversity
+ASK_LEXICAL_WEIGHT = float(os.getenv("ASK_LEXICAL_WEIGHT", "0.3"))
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "which", "who", "how", "why", "when", "where",
+    "does", "did", "this", "that", "with", "from", "into", "about", "there", "their", "can",
+    "you", "your", "its", "has", "have", "had", "not", "but", "all", "any", "one", "per",
+    "define", "definition", "explain", "describe", "meaning", "mean", "means", "tell", "give", "list",
+}
+
+
+ASK_RETRIEVAL = os.getenv("ASK_RETRIEVAL", "hybrid")  # "hybrid" (keyword + vector) or "vector"
+LEXICAL_FAST_MIN_TERMS = 2
+LEXICAL_FAST_MAX_HITS = int(os.getenv("LEXICAL_FAST_MAX_HITS", "8"))
+
+
+class LexicalIndex:
+    """
+    BM25 keyword index (SQLite FTS5, Porter stemming) kept next to a Chroma collection
+    in its persist_dir, so it is deleted with it. Chunk ids match the collection's.
+    """
+
+    FILENAME = "lexical.sqlite3"
+
+    def __init__(self, persist_dir):
+        self.path = os.path.join(persist_dir, self.FILENAME)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def add(self, items):
+        """Index (id, text, metadata) items; ids already indexed are skipped."""
+        if not items:
+            return
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS indexed (id TEXT PRIMARY KEY);
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                    id UNINDEXED, text, meta UNINDEXED, tokenize = 'porter unicode61'
+                );
+                """
+            )
+            db.execute("BEGIN IMMEDIATE")
+            for h, text, meta in items:
+                if db.execute("INSERT OR IGNORE INTO indexed (id) VALUES (?)", (h,)).rowcount:
+                    db.execute(
+                        "INSERT INTO chunks (id, text, meta) VALUES (?, ?, ?)",
+                        (h, text, json.dumps(meta) if meta else None),
+                    )
+            db.execute("COMMIT")
+
+    def search(self, terms, k, require_all=False):
+        """
+        Best k chunks for the terms by BM25: [(id, text, metadata, score)], score > 0, higher
+        is better. require_all only matches chunks containing every term.
+        """
+        if not terms or not self.exists():
+            return []
+        query = (" AND " if require_all else " OR ").join(f'"{t}"' for t in sorted(terms))
+        with self._db() as db:
+            try:
+                rows = db.execute(
+                    "SELECT id, text, meta, -bm25(chunks) AS score FROM chunks WHERE chunks MATCH ? "
+                    "ORDER BY bm25(chunks) LIMIT ?",
+                    (query, k),
+                ).fetchall()
+            except sqlite3.OperationalError:  # index not built yet
+                return []
+        return [(h, text, json.loads(meta) if meta else {}, score) for h, text, meta, score in rows]
+
+
+def query_terms(text):
+    return {w for w in _WORD.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def lexical_overlap(terms, text):
+    """Fraction of the question's terms that appear in text (0..1)."""
+    if not terms:
+        return 0.0
+    return len(terms & set(_WORD.findall(text.lower()))) / len(terms)
+
+
+def rerank_mmr(query_vector, vectors, relevance, k, lam=ASK_MMR_LAMBDA):
+    """
+    Maximal marginal relevance: greedily pick up to k indices that score high on relevance
+    and low on similarity to what is already picked. Returns indices in pick order.
+    """
+    if len(vectors) == 0:
+        return []
+    m = np.asarray(vectors, dtype=np.float32)
+    m = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    sims = m @ m.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+    picked = []
+    redundancy = np.zeros(len(m), dtype=np.float32)
+    available = np.ones(len(m), dtype=bool)
+    for _ in range(min(k, len(m))):
+        score = np.where(available, lam * relevance - (1 - lam) * redundancy, -np.inf)
+        i = int(np.argmax(score))
+        picked.append(i)
+        available[i] = False
+        redundancy = np.maximum(redundancy, sims[i])
+    return picked
+
+
+def pack_context(chunks, budget, max_chunks=ASK_MAX_CHUNKS):
+    """
+    Take chunks (dicts with "tokens") in rank order while they fit the token budget.
+    A chunk that does not fit is skipped so a smaller, lower-ranked one can still go in.
+    """
+    packed, used = [], 0
+    for c in chunks:
+        if len(packed) >= max_chunks:
+            break
+        if used + c["tokens"] > budget:
+            continue
+        packed.append(c)
+        used += c["tokens"]
+    return packed, used
+
+
+def retrieve_context(vectordb, question, question_vector, budget=ASK_CONTEXT_TOKENS, lexical_index=None):
+    """
+    Over-fetch ASK_FETCH_K nearest chunks, rerank them locally (cosine fused with a lexical
+    score, then MMR over the stored vectors) and pack them into the token budget.
+    With a lexical_index, its BM25 hits join the candidates and supply the lexical score;
+    otherwise the score is plain term overlap.
+    Returns (documents, stats); stats compares against the plain top-ASK_MAX_CHUNKS prompt.
+    """
+    got = vectordb._collection.query(
+        query_embeddings=[question_vector],
+        n_results=ASK_FETCH_K,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    ids = list((got.get("ids") or [[]])[0])
+    docs = list((got.get("documents") or [[]])[0])
+    metas = list((got.get("metadatas") or [[]])[0] or [None] * len(docs))
+    vectors = got.get("embeddings")
+    vectors = list(vectors[0]) if vectors is not None and len(vectors) else []
+    baseline = sum(count_tokens(d) for d in docs[:ASK_MAX_CHUNKS])  # what k=10 nearest used to send
+
+    terms = query_terms(question)
+    bm25 = {}
+    if lexical_index is not None:
+        hits = lexical_index.search(terms, ASK_FETCH_K)
+        bm25 = {h: score for h, _, _, score in hits}
+        seen = set(ids)
+        extra = [h for h, _, _, _ in hits if h not in seen]
+        if extra:
+            more = vectordb.get(ids=extra, include=["documents", "metadatas", "embeddings"])
+            ids += list(more["ids"])
+            docs += list(more["documents"])
+            metas += list(more["metadatas"] or [None] * len(more["ids"]))
+            vectors += list(more["embeddings"])
+    if not docs:
+        return [], {"candidates": 0, "selected": 0, "tokens": 0, "baseline_tokens": 0, "tokens_saved": 0}
+
+    chunks = [{"text": d, "metadata": m or {}, "tokens": count_tokens(d)} for d, m in zip(docs, metas)]
+    q = np.asarray(question_vector, dtype=np.float32)
+    m = np.asarray(vectors, dtype=np.float32)
+    cosine = (m @ q) / np.maximum(np.linalg.norm(m, axis=1) * np.linalg.norm(q), 1e-12)
+    if bm25:
+        top = max(bm25.values()) or 1.0
+        lexical = np.array([bm25.get(h, 0.0) / top for h in ids], dtype=np.float32)
+    else:
+        lexical = np.array([lexical_overlap(terms, c["text"]) for c in chunks], dtype=np.float32)
+    relevance = (1 - ASK_LEXICAL_WEIGHT) * cosine + ASK_LEXICAL_WEIGHT * lexical
+
+    order = rerank_mmr(q, m, relevance, len(chunks))
+    packed, used = pack_context([chunks[i] for i in order], budget)
+
+    stats = {
+        "candidates": len(chunks),
+        "lexical_hits": len(bm25),
+        "selected": len(packed),
+        "tokens": used,
+        "baseline_tokens": baseline,
+        "tokens_saved": max(0, baseline - used),
+    }
+    return [Document(page_content=c["text"], metadata=c["metadata"]) for c in packed], stats
+
+
+BROAD_QUESTION_RE = re.compile(
+    r"\b(summar\w*|overview|outline|main (points?|ideas?|themes?|topics?)|key (points?|ideas?|takeaways?)"
+    r"|what is (this|the) (book|notebook|document|text) about)\b",
+    re.IGNORECASE,
+)
+
+
+def build_ask_messages(persist_dir, question, question_vector=None):
+    """Retrieve context for the question and build the chat messages for /ask."""
+    if question_vector is None:
+        question_vector = get_embeddings().embed_query(question)
+
+    # Broad questions ("summarize", "main points", ...) also get the cached section summaries,
+    # since ten nearest chunks rarely cover a whole book; they come out of the same budget
+    overview = ""
+    if BROAD_QUESTION_RE.search(question):
+        partials = SUMMARIES.for_doc(persist_dir)
+        overview = "\n".join(f"\nSection summary {i}:\n{t}\n" for i, t in enumerate(partials, 1))
+
+    t_retrieve = Timer("retrieve context")
+    lexical_index = LexicalIndex(persist_dir) if ASK_RETRIEVAL == "hybrid" else None
+    if lexical_index is not None and not lexical_index.exists():
+        lexical_index = None  # collections built before the keyword index existed
+    with VECTORSTORES.open(persist_dir) as vectordb:
+        budget = max(0, ASK_CONTEXT_TOKENS - count_tokens(overview)) if overview else ASK_CONTEXT_TOKENS
+        retrieved, stats = retrieve_context(vectordb, question, question_vector, budget, lexical_index)
+    t_retrieve.done("(" + ", ".join(f"{k}={v}" for k, v in stats.items()) + ")")
     context = get_document_prompt(retrieved)
+    if overview:
+        context = f"{overview}\n{context}"
+    return ask_messages(context, question)
 
+
+def lexical_fast_path(persist_dir, question):
+    """
+    Chat messages built from keyword hits alone, or None when the question needs vector
+    search. Taken when the question has at least LEXICAL_FAST_MIN_TERMS terms and only a
+    handful of chunks contain all of them, so the question embedding call is skipped.
+    """
+    if ASK_RETRIEVAL != "hybrid" or BROAD_QUESTION_RE.search(question):
+        return None
+    terms = query_terms(question)
+    index = LexicalIndex(persist_dir)
+    if len(terms) < LEXICAL_FAST_MIN_TERMS or not index.exists():
+        return None
+    t_lexical = Timer("lexical fast path")
+    hits = index.search(terms, LEXICAL_FAST_MAX_HITS + 1, require_all=True)
+    if not hits or len(hits) > LEXICAL_FAST_MAX_HITS:
+        t_lexical.done(f"(skipped, hits={len(hits)})")
+        return None
+    chunks = [{"text": text, "metadata": meta, "tokens": count_tokens(text)} for _, text, meta, _ in hits]
+    packed, used = pack_context(chunks, ASK_CONTEXT_TOKENS)
+    t_lexical.done(f"(hits={len(hits)}, selected={len(packed)}, tokens={used})")
+    docs = [Document(page_content=c["text"], metadata=c["metadata"]) for c in packed]
+    return ask_messages(get_document_prompt(docs), question)
+
+
+def ask_messages(context, question):
     system_message = (
         f"You are a professor teaching a course. Use the following notebook content "
         f"to answer student questions accurately and concisely:\n\n{context}\n\n"
@@ -527,19 +4102,205 @@ def ask():
         "Only state what is in the notebook content"
         "Do not state what is not in the given notebook and be very precise and straight forward "
     )
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": question},
+    ]
+
+
+def build_quiz_message(persist_dir, num):
+    """Sample chunks from the notebook and build the quiz-generation system prompt."""
+    # ----------------------------
+    t_vectordb = Timer("load vector DB")
+    with VECTORSTORES.open(persist_dir) as vectordb:
+        t_vectordb.done(str(VECTORSTORES.stats()))
+
+        # ----------------------------
+        t_sample = Timer("sample documents")
+        # Use at least 20 documents selection when available
+        sample = sample_chunks(persist_dir, vectordb, 20)
+    context = get_document_prompt(sample) if sample else "No content available."
+    t_sample.done(f"(sampled={len(sample)}, chars={len(context)})")
+
+    # ----------------------------
+    t_prompt = Timer("build prompt")
+    system_message = quiz_prompt(num, context)
+    t_prompt.done()
+    return system_message
+
+
+def quiz_prompt(num, context):
+    return (
+        f"Generate {num} multiple-choice quiz questions from the following notebook content: "
+        f"\n\n###\n{context}\n###\n\n"
+        f"Each question should have 4 answer choices (A,B,C,D) and indicate the correct answer at the end:"
+        f"""the format of the reply should be
+        Question 1: <question>
+        A)  <answer choice A>
+        B)  <answer choice B>
+        C)  <answer choice C>
+        D)  <answer choice D>
+        Correct Answer: C
+
+        Question 2: <question>
+         ..."""
+         )
+
+
+def parse_quiz_block(block):
+    """Parse one "Question N / A-D / Correct Answer" block, or return None."""
+    lines = [l for l in block.strip().splitlines() if l.strip()]
+    if len(lines) >= 6 and lines[0].strip().lower().startswith("question"):
+        q = lines[0].strip()
+        choices = [l.strip() for l in lines[1:5]]
+        correct = lines[5].split(":")[-1].strip()
+        return {"question": q, "choices": choices, "correct": correct}
+    return None
+
+
+def parse_quiz(text):
+    # Parse very simply
+    blocks = [b for b in text.strip().split("\n\n") if b.strip()]
+    return [q for q in (parse_quiz_block(b) for b in blocks) if q]
+
+
+class QuizStreamParser:
+    """Turn streamed LLM text into quiz questions as soon as each block is complete."""
+
+    def __init__(self):
+        self.buf = ""
+
+    def feed(self, text):
+        self.buf += text
+        out = []
+        while True:
+            head, sep, rest = self.buf.partition("\n\n")
+            if sep:
+                q = parse_quiz_block(head)
+            else:
+                # No blank line yet: the block is done once its answer line has ended
+                lines = head.strip().splitlines()
+                done = len(lines) >= 6 and lines[5].lower().startswith("correct") and head.endswith("\n")
+                q = parse_quiz_block(head) if done else None
+                if not done:
+                    return out
+            self.buf = rest if sep else ""
+            if q:
+                out.append(q)
+
+    def close(self):
+        q = parse_quiz_block(self.buf)
+        self.buf = ""
+        return [q] if q else []
+
+
+def ndjson_response(events):
+    """Stream an iterable of dicts as newline-delimited JSON."""
+    resp = Response((json.dumps(e) + "\n" for e in events), mimetype="application/x-ndjson")
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def stream_chat(messages, temperature):
+    """Yield content deltas from a streamed chat completion."""
+    t0 = time.perf_counter()
+    stream = get_openai_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    first = True
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first:
+                METRICS.observe("LLM first token", time.perf_counter() - t0)
+                first = False
+            yield chunk.choices[0].delta.content
+    METRICS.observe("LLM stream", time.perf_counter() - t0)
+
+
+@app.route("/ask", methods=["POST"])
+def ask():
+    data = request.get_json(silent=True) or {}
+    question = data.get("question", "").strip()
+    filename = data.get("filename")
+    if not question:
+        return jsonify({"ok": False, "error": "Question is required."}), 400
+    
+    # Look up persist_dir by filename
+    persist_dir = _doc_persist_dir(filename)
+    if not persist_dir:
+        return jsonify({"ok": False, "error": "Please select a Notebook before asking a Question."}), 400
 
+    client = get_openai_client()
+    t0 = time.perf_counter()
+    version = DOCUMENTS.version(persist_dir)
+    question_vector = None
+    messages = lexical_fast_path(persist_dir, question)
+    if messages is None:
+        question_vector = get_embeddings().embed_query(question)
+        cached = ANSWER_CACHE.lookup(persist_dir, version, question_vector)
+        if cached is not None:
+            return jsonify({"ok": True, "answer": cached, "cached": True})
+        messages = build_ask_messages(persist_dir, question, question_vector)
+
+    t_llm = Timer("LLM answer")
     resp = client.chat.completions.create(
         model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": question},
-        ],
+        messages=messages,
         temperature=0.1,
     )
+    t_llm.done()
+    record_llm_usage(resp, "ask")
     answer = resp.choices[0].message.content
+    if question_vector is not None:
+        ANSWER_CACHE.store(persist_dir, version, question, question_vector, answer, time.perf_counter() - t0)
     return jsonify({"ok": True, "answer": answer})
 
 
+@app.post("/ask/stream")
+def ask_stream():
+    """Same as /ask, but forwards answer tokens as NDJSON events while they are generated."""
+    data = request.get_json(silent=True) or {}
+    question = data.get("question", "").strip()
+    filename = data.get("filename")
+    if not question:
+        return jsonify({"ok": False, "error": "Question is required."}), 400
+
+    persist_dir = _doc_persist_dir(filename)
+    if not persist_dir:
+        return jsonify({"ok": False, "error": "Please select a Notebook before asking a Question."}), 400
+
+    t0 = time.perf_counter()
+    version = DOCUMENTS.version(persist_dir)
+    question_vector = None
+    messages = lexical_fast_path(persist_dir, question)
+    if messages is None:
+        question_vector = get_embeddings().embed_query(question)
+        cached = ANSWER_CACHE.lookup(persist_dir, version, question_vector)
+        if cached is not None:
+            return ndjson_response([{"type": "token", "text": cached}, {"type": "done", "cached": True}])
+        messages = build_ask_messages(persist_dir, question, question_vector)
+
+    def events():
+        parts = []
+        try:
+            for text in stream_chat(messages, temperature=0.1):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+            if question_vector is not None:
+                ANSWER_CACHE.store(persist_dir, version, question, question_vector, "".join(parts),
+                                   time.perf_counter() - t0)
+            yield {"type": "done"}
+        except Exception as e:
+            logging.exception("ask stream failed")
+            yield {"type": "error", "error": str(e)}
+
+    return ndjson_response(events())
+
+
 #Generate multiple-choice questions from the vector DB.
 @app.route("/generate_quiz", methods=["POST"])
 def generate_quiz():
@@ -555,53 +4316,22 @@ def generate_quiz():
     # ----------------------------
     t_session = Timer("session lookup")
     # Look up persist_dir by filename
-    docs = session.get("docs", {})
-    info = docs.get(filename or "", {})
-    persist_dir = info.get("persist_dir") if info else None
+    persist_dir = _doc_persist_dir(filename)
     t_session.done()
 
-    if not persist_dir or not os.path.isdir(persist_dir):
+    if not persist_dir:
         return jsonify({"ok": False, "error": "Please select a Notebook before generating Quiz."}), 400
 
     # ----------------------------
-    t_vectordb = Timer("load vector DB")
-    client = get_openai_client()
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=client.api_key)
-    vectordb = Chroma(embedding_function=embeddings, persist_directory=persist_dir)
-    t_vectordb.done()
-    
-    # ----------------------------
-    t_fetch = Timer("fetch documents")
-    raw = vectordb.get(include=["documents"])
-    # Use at least 20 documents selection when available
-    all_docs = raw.get("documents", [])
-    t_fetch.done(f"(docs={len(all_docs)})")
-
-    # ----------------------------
-    t_sample = Timer("sample documents")
-    num_samples = min(20, len(all_docs)) if all_docs else 0
-    sample = random.sample(all_docs, num_samples) if num_samples > 0 else []
-    context = get_document_prompt(sample) if sample else "No content available."
-    t_sample.done(f"(sampled={num_samples}, chars={len(context)})")
-
-    # ----------------------------
-    t_prompt = Timer("build prompt")
-    system_message = (
-        f"Generate {num} multiple-choice quiz questions from the following notebook content: "
-        f"\n\n###\n{context}\n###\n\n"
-        f"Each question should have 4 answer choices (A,B,C,D) and indicate the correct answer at the end:"
-        f"""the format of the reply should be
-        Question 1: <question>
-        A)  <answer choice A>
-        B)  <answer choice B>
-        C)  <answer choice C>
-        D)  <answer choice D>
-        Correct Answer: C
+    t_pool = Timer("quiz pool")
+    pooled = QUIZ_POOL.take(persist_dir, num, DOCUMENTS.version(persist_dir))
+    t_pool.done(f"(hit={pooled is not None})")
+    if pooled is not None:
+        t_total.done()
+        return jsonify({"ok": True, "quiz": pooled})
 
-        Question 2: <question>
-         ..."""
-         )
-    t_prompt.done()
+    client = get_openai_client()
+    system_message = build_quiz_message(persist_dir, num)
 
     # ----------------------------
     t_llm = Timer("LLM generation")
@@ -611,26 +4341,56 @@ def generate_quiz():
         temperature=0.2,
     )
     t_llm.done()
+    record_llm_usage(resp, "quiz")
 
     # ----------------------------
     t_parse = Timer("parse LLM output")
     text = resp.choices[0].message.content.strip()
-    # Parse very simply
-    blocks = [b for b in text.split("\n\n") if b.strip()]
-    quiz = []
-    for b in blocks:
-        lines = b.splitlines()
-        if len(lines) >= 6 and lines[0].lower().startswith("question"):
-            q = lines[0].strip()
-            choices = lines[1:5]
-            correct = lines[5].split(":")[-1].strip()
-            quiz.append({"question": q, "choices": choices, "correct": correct})
+    quiz = parse_quiz(text)
     t_parse.done(f"(parsed={len(quiz)})")
 
     # ----------------------------
     t_total.done()
     return jsonify({"ok": True, "quiz": quiz})
 
+
+@app.post("/generate_quiz/stream")
+def generate_quiz_stream():
+    """Same as /generate_quiz, but emits each question as soon as its block has been parsed."""
+    data = request.get_json(silent=True) or {}
+    num = int(data.get("num_questions", 5))
+    persist_dir = _doc_persist_dir(data.get("filename"))
+    if not persist_dir:
+        return jsonify({"ok": False, "error": "Please select a Notebook before generating Quiz."}), 400
+
+    pooled = QUIZ_POOL.take(persist_dir, num, DOCUMENTS.version(persist_dir))
+    if pooled is not None:
+        events = [{"type": "question", "index": i, "question": q} for i, q in enumerate(pooled)]
+        return ndjson_response(events + [{"type": "done", "count": len(pooled)}])
+
+    system_message = build_quiz_message(persist_dir, num)
+
+    def events():
+        t_llm = Timer("LLM quiz stream")
+        parser = QuizStreamParser()
+        sent = 0
+        try:
+            for text in stream_chat([{"role": "system", "content": system_message}], temperature=0.2):
+                for q in parser.feed(text):
+                    if sent == 0:
+                        t_llm.done("(first question)")
+                    sent += 1
+                    yield {"type": "question", "index": sent - 1, "question": q}
+            for q in parser.close():
+                sent += 1
+                yield {"type": "question", "index": sent - 1, "question": q}
+            yield {"type": "done", "count": sent}
+        except Exception as e:
+            logging.exception("quiz stream failed")
+            yield {"type": "error", "error": str(e)}
+
+    return ndjson_response(events())
+
 #for saving results
 @app.post("/save_result")
 def save_result():
@@ -643,15 +4403,13 @@ def save_result():
     if not filename or correct is None or total is None:
         return jsonify(ok=False, error="Missing result data"), 400
 
-    results = session.get("results", [])
-    results.insert(0, {
+    DOCUMENTS.add_result(current_user_id(), {
         "filename": filename,
         "correct": int(correct),
         "total": int(total),
         "percent": int(percent) if percent is not None else round((int(correct)/int(total))*100),
         "test_datetime": datetime.now().strftime("%Y-%m-%d %I:%M %p")
     })
-    session["results"] = results
     return jsonify(ok=True)
 
 
@@ -660,7 +4418,7 @@ def save_result():
 def results():
     return render_template(
         "results.html",
-        results=session.get("results", [])
+        results=DOCUMENTS.results(current_user_id())
     )
 
 @app.route("/send-feedback", methods=["POST"])
@@ -702,12 +4460,8 @@ def send_feedback():
 
 
 
-
-
 if __name__ == "__main__":
     import os
     port = int(os.environ.get("PORT", 5000))
+    JOBS.start()
     app.run(host="0.0.0.0", port=port, threaded=True)
-
-
-
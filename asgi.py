@@ -0,0 +1,498 @@
+# asgi.py
+"""
+ASGI entry point. The LLM-bound endpoints (/ask, /generate_quiz and their /stream
+variants) run as coroutines on async OpenAI clients, so one process can hold hundreds
+of in-flight questions. Chroma and SQLite work is offloaded to threads. The SSE progress
+stream is served here too, without holding a thread per connection. Every other route,
+/send-feedback included, is the unchanged Flask app run on a worker thread.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+    flask --app app jobs-worker    # ingestion and quiz-pool jobs, in a second process
+
+This is what the Dockerfile and Procfile run. The sync deployment (gunicorn app:app)
+still works, but each SSE stream holds one of its threads, so past
+PROGRESS_STREAM_MAX_OPEN streams per process the page falls back to polling.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+from tempfile import SpooledTemporaryFile
+
+import anyio
+import httpx
+from itsdangerous import BadSignature
+from openai import AsyncOpenAI
+from werkzeug.http import parse_cookie
+
+import app as core
+
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "256"))
+ASYNC_THREADS = int(os.getenv("ASYNC_THREADS", "64"))  # worker threads for Flask routes and Chroma calls
+PROGRESS_POLL_INTERVAL = 0.5  # seconds between progress reads while some watched job is changing
+PROGRESS_IDLE_INTERVAL = 5.0  # backed off to this while none is
+
+log = logging.getLogger(__name__)
+
+_ASYNC_CLIENT = None
+_ASYNC_CLIENT_LOCK = threading.Lock()
+
+
+def get_async_openai_client():
+    """One AsyncOpenAI client on a pooled async HTTP client for the whole event loop."""
+    global _ASYNC_CLIENT
+    with _ASYNC_CLIENT_LOCK:
+        if _ASYNC_CLIENT is None:
+            _ASYNC_CLIENT = AsyncOpenAI(
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=ASYNC_MAX_CONNECTIONS,
+                        max_keepalive_connections=ASYNC_MAX_CONNECTIONS // 4,
+                    ),
+                    timeout=httpx.Timeout(600.0, connect=10.0),
+                )
+            )
+        return _ASYNC_CLIENT
+
+
+def to_thread(fn, *args):
+    return anyio.to_thread.run_sync(lambda: fn(*args))
+
+
+# ---------- Request helpers ----------
+def session_user_id(scope):
+    """
+    uid from the signed Flask session cookie, or None. Sessions that still carry pre-registry
+    keys also return None, so Flask handles (and migrates) them.
+    """
+    headers = dict(scope.get("headers") or [])
+    cookie = parse_cookie(headers.get(b"cookie", b"").decode("latin-1"))
+    raw = cookie.get(core.app.config["SESSION_COOKIE_NAME"])
+    if not raw:
+        return None
+    serializer = core.app.session_interface.get_signing_serializer(core.app)
+    try:
+        data = serializer.loads(raw, max_age=int(core.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    if any(k in data for k in core._LEGACY_SESSION_KEYS):
+        return None
+    return data.get("uid")
+
+
+def doc_persist_dir(user_id, filename):
+    info = core.DOCUMENTS.get(user_id, filename)
+    persist_dir = info.get("persist_dir") if info else None
+    if not persist_dir or not os.path.isdir(persist_dir):
+        return None
+    return persist_dir
+
+
+async def read_body(receive):
+    """Spool the request body (to disk past 1 MB, like a WSGI server would)."""
+    body = SpooledTemporaryFile(max_size=1024 * 1024)
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.write(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body.seek(0)
+    return body
+
+
+async def send_json(send, payload, status=200):
+    data = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def send_ndjson(send, events):
+    """Stream an async iterable of dicts as newline-delimited JSON."""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"application/x-ndjson"),
+            (b"cache-control", b"no-store"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    async for e in events:
+        await send({"type": "http.response.body", "body": (json.dumps(e) + "\n").encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+# ---------- Async endpoints ----------
+async def embed_query(text):
+    """Question embedding through the shared embedding cache, on the async client."""
+    cached = (await to_thread(core.EMBEDDING_CACHE.get_many, core.EMBEDDING_MODEL, [text]))[0]
+    if cached is not None:
+        return cached
+    core.METRICS.inc("embed_tokens", core.estimate_tokens(text))
+    with core.Timer("embed query", quiet=True):
+        resp = await get_async_openai_client().embeddings.create(model=core.EMBEDDING_MODEL, input=[text])
+    vector = resp.data[0].embedding
+    await to_thread(core.EMBEDDING_CACHE.put_many, core.EMBEDDING_MODEL, [text], [vector])
+    return vector
+
+
+async def stream_chat(messages, temperature):
+    t0 = anyio.current_time()
+    stream = await get_async_openai_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    first = True
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first:
+                core.METRICS.observe("LLM first token", anyio.current_time() - t0)
+                first = False
+            yield chunk.choices[0].delta.content
+    core.METRICS.observe("LLM stream", anyio.current_time() - t0)
+
+
+async def ask(data, user_id, send, stream=False):
+    question = (data.get("question") or "").strip()
+    if not question:
+        return await send_json(send, {"ok": False, "error": "Question is required."}, 400)
+    persist_dir = await to_thread(doc_persist_dir, user_id, data.get("filename"))
+    if not persist_dir:
+        return await send_json(send, {"ok": False, "error": "Please select a Notebook before asking a Question."}, 400)
+
+    t0 = anyio.current_time()
+    version = await to_thread(core.DOCUMENTS.version, persist_dir)
+    question_vector = None
+    messages = await to_thread(core.lexical_fast_path, persist_dir, question)
+    if messages is None:
+        question_vector = await embed_query(question)
+        cached = await to_thread(core.ANSWER_CACHE.lookup, persist_dir, version, question_vector)
+        if cached is not None:
+            if stream:
+                return await send_ndjson(send, _events([{"type": "token", "text": cached}, {"type": "done", "cached": True}]))
+            return await send_json(send, {"ok": True, "answer": cached, "cached": True})
+        messages = await to_thread(core.build_ask_messages, persist_dir, question, question_vector)
+
+    async def remember(answer):
+        if question_vector is not None:
+            await to_thread(core.ANSWER_CACHE.store, persist_dir, version, question, question_vector, answer,
+                            anyio.current_time() - t0)
+
+    if not stream:
+        with core.Timer("LLM answer"):
+            resp = await get_async_openai_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.1,
+            )
+        core.record_llm_usage(resp, "ask")
+        answer = resp.choices[0].message.content
+        await remember(answer)
+        return await send_json(send, {"ok": True, "answer": answer})
+
+    async def events():
+        parts = []
+        try:
+            async for text in stream_chat(messages, temperature=0.1):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+            await remember("".join(parts))
+            yield {"type": "done"}
+        except Exception as e:
+            log.exception("ask stream failed")
+            yield {"type": "error", "error": str(e)}
+
+    await send_ndjson(send, events())
+
+
+async def generate_quiz(data, user_id, send, stream=False):
+    num = int(data.get("num_questions", 5))
+    persist_dir = await to_thread(doc_persist_dir, user_id, data.get("filename"))
+    if not persist_dir:
+        return await send_json(send, {"ok": False, "error": "Please select a Notebook before generating Quiz."}, 400)
+
+    version = await to_thread(core.DOCUMENTS.version, persist_dir)
+    pooled = await to_thread(core.QUIZ_POOL.take, persist_dir, num, version)
+    if pooled is not None:
+        if stream:
+            events = [{"type": "question", "index": i, "question": q} for i, q in enumerate(pooled)]
+            return await send_ndjson(send, _events(events + [{"type": "done", "count": len(pooled)}]))
+        return await send_json(send, {"ok": True, "quiz": pooled})
+
+    system_message = await to_thread(core.build_quiz_message, persist_dir, num)
+    messages = [{"role": "system", "content": system_message}]
+
+    if not stream:
+        with core.Timer("LLM generation"):
+            resp = await get_async_openai_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.2,
+            )
+        core.record_llm_usage(resp, "quiz")
+        quiz = core.parse_quiz(resp.choices[0].message.content.strip())
+        return await send_json(send, {"ok": True, "quiz": quiz})
+
+    async def events():
+        parser = core.QuizStreamParser()
+        sent = 0
+        try:
+            async for text in stream_chat(messages, temperature=0.2):
+                for q in parser.feed(text):
+                    sent += 1
+                    yield {"type": "question", "index": sent - 1, "question": q}
+            for q in parser.close():
+                sent += 1
+                yield {"type": "question", "index": sent - 1, "question": q}
+            yield {"type": "done", "count": sent}
+        except Exception as e:
+            log.exception("quiz stream failed")
+            yield {"type": "error", "error": str(e)}
+
+    await send_ndjson(send, events())
+
+
+class ProgressWatcher:
+    """
+    Progress of every job with an open SSE stream in this process, re-read by one loop: a
+    single thread hop per tick for all streams, and only the streams whose job changed are
+    woken. The tick backs off to PROGRESS_IDLE_INTERVAL while nothing changes.
+    """
+
+    def __init__(self):
+        self._jobs = {}  # job_id -> {"state", "changed": anyio.Event, "streams": int}
+        self._added = None
+        self.running = False
+
+    def watch(self, job_id, state):
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = self._jobs[job_id] = {"state": state, "changed": anyio.Event(), "streams": 0}
+        job["streams"] += 1
+        if self._added is not None:
+            self._added.set()
+
+    def unwatch(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job["streams"] -= 1
+            if job["streams"] <= 0:
+                del self._jobs[job_id]
+
+    async def next_state(self, job_id, last):
+        """The job's state once it differs from last (cancel with a timeout scope)."""
+        job = self._jobs[job_id]
+        while job["state"] == last:
+            if self.running:
+                await job["changed"].wait()
+            else:  # no lifespan, so no loop: read for this stream alone
+                await anyio.sleep(PROGRESS_IDLE_INTERVAL)
+                job["state"] = await to_thread(core.job_state, job_id)
+        return job["state"]
+
+    async def run(self):
+        self.running = True
+        interval = PROGRESS_POLL_INTERVAL
+        try:
+            while True:
+                self._added = anyio.Event()
+                ids = list(self._jobs)
+                if ids:
+                    states = await to_thread(lambda: [core.job_state(j) for j in ids])
+                    changed = False
+                    for job_id, state in zip(ids, states):
+                        job = self._jobs.get(job_id)
+                        if job is not None and state != job["state"]:
+                            job["state"] = state
+                            job["changed"].set()
+                            job["changed"] = anyio.Event()
+                            changed = True
+                    interval = PROGRESS_POLL_INTERVAL if changed else min(interval * 2, PROGRESS_IDLE_INTERVAL)
+                with anyio.move_on_after(interval):
+                    await self._added.wait()
+                if self._added.is_set():
+                    interval = PROGRESS_POLL_INTERVAL  # a new stream: follow it closely at first
+        finally:
+            self.running = False
+
+
+PROGRESS_WATCHER = ProgressWatcher()
+
+
+async def progress_stream(job_id, send):
+    """
+    /progress/<job_id>/stream without holding a thread for the connection: PROGRESS_WATCHER
+    re-reads the job state and each change is sent as an SSE message.
+    """
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-store"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b"retry: 1000\n\n", "more_body": True})
+    unchanged = object()
+    deadline = anyio.current_time() + core.PROGRESS_STREAM_MAX
+    st = await to_thread(core.job_state, job_id)
+    PROGRESS_WATCHER.watch(job_id, st)
+    try:
+        while True:
+            await send({"type": "http.response.body", "body": core.progress_event(st).encode("utf-8"), "more_body": True})
+            if core.progress_done(st):
+                break
+            last, st = st, unchanged
+            while st is unchanged and anyio.current_time() < deadline:
+                with anyio.move_on_after(min(15.0, deadline - anyio.current_time())):
+                    st = await PROGRESS_WATCHER.next_state(job_id, last)
+                if st is unchanged:
+                    await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+            if st is unchanged:
+                break
+    finally:
+        PROGRESS_WATCHER.unwatch(job_id)
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _events(items):
+    for e in items:
+        yield e
+
+
+ROUTES = {
+    "/ask": lambda data, uid, send: ask(data, uid, send),
+    "/ask/stream": lambda data, uid, send: ask(data, uid, send, stream=True),
+    "/generate_quiz": lambda data, uid, send: generate_quiz(data, uid, send),
+    "/generate_quiz/stream": lambda data, uid, send: generate_quiz(data, uid, send, stream=True),
+}
+
+
+# ---------- Flask on a worker thread ----------
+def wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers") or []:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+            continue
+        key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope, body, send):
+    """Run the Flask app for this request, pulling each response chunk on a worker thread."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None  # the legacy write() callable is unused by Flask
+
+    environ = wsgi_environ(scope, body)
+    result = await to_thread(core.app, environ, start_response)
+    chunks = iter(result)
+    done = object()
+    try:
+        first = await to_thread(next, chunks, done)
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        chunk = first
+        while chunk is not done:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await to_thread(next, chunks, done)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        close = getattr(result, "close", None)
+        if close is not None:
+            await to_thread(close)
+
+
+# ---------- ASGI application ----------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        async with anyio.create_task_group() as tg:
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    anyio.to_thread.current_default_thread_limiter().total_tokens = ASYNC_THREADS
+                    tg.start_soon(PROGRESS_WATCHER.run)
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    tg.cancel_scope.cancel()
+                    if _ASYNC_CLIENT is not None:
+                        await _ASYNC_CLIENT.close()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if scope["method"] == "GET" and path.startswith("/progress/") and path.endswith("/stream"):
+        job_id = path[len("/progress/"):-len("/stream")]
+        if job_id and "/" not in job_id:
+            with core.Timer("asgi /progress/stream", quiet=True):
+                await progress_stream(job_id, send)
+            core.METRICS.inc("http_requests", endpoint="/progress/<job_id>/stream", status=200)
+            return
+
+    body = await read_body(receive)
+    try:
+        handler = ROUTES.get(scope["path"]) if scope["method"] == "POST" else None
+        user_id = session_user_id(scope) if handler else None
+        if handler and user_id:
+            try:
+                data = json.loads(body.read() or b"{}")
+            except ValueError:
+                data = {}
+            span = core.Timer(f"asgi {scope['path']}", quiet=True)
+            status = {"code": 500}
+
+            async def counted_send(message):
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+                await send(message)
+
+            try:
+                await handler(data if isinstance(data, dict) else {}, user_id, counted_send)
+            except Exception as e:
+                log.exception("%s failed", scope["path"])
+                await send_json(send, {"ok": False, "error": str(e)}, 500)
+            finally:
+                span.done()
+                core.METRICS.inc("http_requests", endpoint=scope["path"], status=status["code"])
+            return
+        body.seek(0)
+        await call_flask(scope, body, send)
+    finally:
+        body.close()
@@ -0,0 +1,130 @@
+# bench/corpus.py
+"""
+Synthetic PDF, DOCX, PPTX and TXT documents of a given length, for the extraction and
+load benchmarks. Text is generated from a fixed vocabulary with a seed, so a corpus is
+reproducible and every page is distinct (no accidental chunk dedup).
+
+    python bench/corpus.py --out bench/corpus --kinds pdf docx pptx txt --pages 1 10 100 1000
+
+A "page" is one PDF page, one PPTX slide, one DOCX section of 50 paragraphs (the unit the
+app extracts by) or about 3000 characters of TXT.
+"""
+import argparse
+import os
+import random
+
+import docx
+from pptx import Presentation
+from pptx.util import Inches
+
+KINDS = ("pdf", "docx", "pptx", "txt")
+WORDS = (
+    "cell membrane osmosis pressure energy protein enzyme gradient transport diffusion "
+    "mitochondria nucleus receptor signal pathway molecule solution concentration channel "
+    "potential equilibrium reaction substrate catalyst inhibitor binding structure function "
+    "theory model experiment result analysis variable measurement sample control hypothesis"
+).split()
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+DOCX_PARAGRAPHS_PER_PAGE = 50
+
+
+def page_lines(rng, page):
+    lines = [f"Section {page}: {' '.join(rng.choice(WORDS) for _ in range(3))}"]
+    for i in range(LINES_PER_PAGE - 1):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE)) + f" p{page}l{i}.")
+    return lines
+
+
+def write_txt(path, pages, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        for p in range(1, pages + 1):
+            f.write("\n".join(page_lines(rng, p)) + "\n\n")
+
+
+def write_docx(path, pages, rng):
+    d = docx.Document()
+    for p in range(1, pages + 1):
+        lines = page_lines(rng, p)
+        d.add_heading(lines[0], level=2)
+        for i in range(DOCX_PARAGRAPHS_PER_PAGE - 1):
+            d.add_paragraph(lines[1 + i % (len(lines) - 1)])
+    d.save(path)
+
+
+def write_pptx(path, pages, rng):
+    prs = Presentation()
+    layout = prs.slide_layouts[1]  # title and content
+    for p in range(1, pages + 1):
+        lines = page_lines(rng, p)
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = lines[0]
+        slide.placeholders[1].text = "\n".join(lines[1:12])
+        notes = slide.shapes.add_textbox(Inches(0.5), Inches(6.5), Inches(9), Inches(1))
+        notes.text = " ".join(lines[12:20])
+    prs.save(path)
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages, rng):
+    """Minimal text-only PDF (Helvetica, one content stream per page) with a valid xref table."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(1, pages + 1):
+        body = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        body += [f"({_pdf_escape(line)}) '" for line in page_lines(rng, p)]
+        body.append("ET")
+        stream = "\n".join(body).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode("ascii"), len(kids))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for n, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (n, obj))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for off in offsets:
+            f.write(b"%010d 00000 n \n" % off)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+WRITERS = {"pdf": write_pdf, "docx": write_docx, "pptx": write_pptx, "txt": write_txt}
+
+
+def make_document(out_dir, kind, pages, seed=0):
+    """Write (or reuse) a synthetic document and return its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"synthetic_{pages}p_s{seed}.{kind}")
+    if not os.path.exists(path):
+        WRITERS[kind](path, pages, random.Random(f"{kind}:{pages}:{seed}"))
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus"))
+    ap.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    ap.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    for kind in args.kinds:
+        for pages in args.pages:
+            path = make_document(args.out, kind, pages, args.seed)
+            print(f"{path}  {os.path.getsize(path) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# bench/fake_openai.py
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints, so the app can be
+benchmarked offline and without API cost. Vectors are deterministic per input text (so the
+embedding cache and dedup behave as they would for real), chat replies are fixed summaries
+or quizzes in the format the app parses. Latency and rate limits are configurable.
+
+    python bench/fake_openai.py --port 8765 --embed-latency 0.2 --chat-latency 1.5 --rpm 3000
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-fake gunicorn app:app ...
+
+GET /stats returns request counts; POST /stats/reset clears them.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+CONFIG = {
+    "embed_latency": 0.0,
+    "chat_latency": 0.0,
+    "token_latency": 0.0,
+    "rpm": 0,
+    "fail_rate": 0.0,
+    "dim": 256,
+}
+STATS = {}
+_lock = threading.Lock()
+_recent = deque()  # request times inside the last minute, for the rpm limit
+
+SUMMARY = "**Title: Synthetic Notebook**\n\nA generated notebook used for benchmarking. It covers the corpus topics."
+QUIZ_QUESTION = (
+    "Question {n}: Which topic does section {n} of the notebook discuss?\n"
+    "A) osmosis\nB) photosynthesis\nC) enzyme kinetics\nD) membrane transport\n"
+    "Correct Answer: D"
+)
+
+
+def count(key, n=1):
+    with _lock:
+        STATS[key] = STATS.get(key, 0) + n
+
+
+def vector(text):
+    seed = int(hashlib.sha256(json.dumps(text).encode("utf-8")).hexdigest()[:8], 16)
+    v = np.random.default_rng(seed).standard_normal(CONFIG["dim"])
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def tokens(text):
+    return max(1, len(text) // 4)
+
+
+def throttled():
+    """Error response when over the rpm limit or picked for an injected failure, else None."""
+    now = time.monotonic()
+    if CONFIG["rpm"]:
+        with _lock:
+            while _recent and now - _recent[0] > 60:
+                _recent.popleft()
+            limited = len(_recent) >= CONFIG["rpm"]
+            if limited:
+                retry = max(0.05, 60 - (now - _recent[0]))
+            else:
+                _recent.append(now)
+        if limited:
+            count("429")
+            body = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            return jsonify(body), 429, {"retry-after": f"{min(retry, 2.0):.2f}"}
+    if CONFIG["fail_rate"] and random.random() < CONFIG["fail_rate"]:
+        count("500")
+        return jsonify({"error": {"message": "Injected failure", "type": "server_error"}}), 500
+    return None
+
+
+@app.post("/v1/embeddings")
+def embeddings():
+    count("embedding_requests")
+    error = throttled()
+    if error:
+        return error
+    data = request.get_json()
+    inputs = data["input"]
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    count("embedding_inputs", len(inputs))
+    time.sleep(CONFIG["embed_latency"])
+    used = sum(tokens(json.dumps(x)) for x in inputs)
+    return jsonify({
+        "object": "list",
+        "model": data["model"],
+        "data": [{"object": "embedding", "index": i, "embedding": vector(x)} for i, x in enumerate(inputs)],
+        "usage": {"prompt_tokens": used, "total_tokens": used},
+    })
+
+
+@app.post("/v1/chat/completions")
+def chat_completions():
+    count("chat_requests")
+    error = throttled()
+    if error:
+        return error
+    data = request.get_json()
+    prompt = "".join(m.get("content") or "" for m in data["messages"])
+    text = SUMMARY
+    if "quiz" in prompt.lower():
+        text = "\n\n".join(QUIZ_QUESTION.format(n=n) for n in range(1, 9))
+    usage = {"prompt_tokens": tokens(prompt), "completion_tokens": tokens(text)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+    if not data.get("stream"):
+        time.sleep(CONFIG["chat_latency"])
+        return jsonify({
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": data["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def events():
+        time.sleep(CONFIG["chat_latency"])
+        for i in range(0, len(text), 8):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": data["model"],
+                "choices": [{"index": 0, "delta": {"content": text[i:i + 8]}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            time.sleep(CONFIG["token_latency"])
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
+
+
+@app.get("/stats")
+def stats():
+    with _lock:
+        return jsonify(STATS)
+
+
+@app.post("/stats/reset")
+def reset_stats():
+    with _lock:
+        STATS.clear()
+    return jsonify(ok=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embeddings request")
+    ap.add_argument("--chat-latency", type=float, default=0.0, help="seconds before a chat reply (or its first token)")
+    ap.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed chunks")
+    ap.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0 = unlimited)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    ap.add_argument("--dim", type=int, default=256, help="embedding dimensions")
+    args = ap.parse_args()
+    CONFIG.update(
+        embed_latency=args.embed_latency,
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        rpm=args.rpm,
+        fail_rate=args.fail_rate,
+        dim=args.dim,
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
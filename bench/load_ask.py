@@ -0,0 +1,98 @@
+# bench/load_ask.py
+"""
+Concurrent /ask load test against a running server, to compare the sync (gunicorn) and
+async (uvicorn asgi:app) serving modes. It uploads a synthetic notebook, waits for it to be
+indexed, then fires batches of distinct questions at each concurrency level.
+
+    gunicorn app:app -b 127.0.0.1:8000 --workers 1 --threads 4     # sync
+    uvicorn asgi:app --host 127.0.0.1 --port 8000                   # async
+    python bench/load_ask.py --url http://127.0.0.1:8000 --concurrency 5 20 100
+
+Point OPENAI_BASE_URL of the server at bench/fake_openai.py to run it offline.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def synthetic_notebook(paragraphs=400):
+    words = "cell membrane osmosis pressure energy protein enzyme gradient transport diffusion".split()
+    return "\n\n".join(
+        " ".join(words[(i * 7 + j) % len(words)] for j in range(80)) + f" section{i}."
+        for i in range(paragraphs)
+    ).encode("utf-8")
+
+
+async def prepare(client):
+    job_id = (await client.post("/init_upload")).json()["job_id"]
+    name = f"load_{uuid.uuid4().hex[:6]}.txt"
+    r = await client.post(
+        "/upload",
+        files={"file": (name, synthetic_notebook(), "text/plain")},
+        headers={"X-Job-Id": job_id, "X-Requested-With": "XMLHttpRequest"},
+    )
+    r.raise_for_status()
+    while True:
+        st = (await client.get(f"/progress/{job_id}")).json()
+        if st.get("phase") in ("completed", "error"):
+            break
+        await asyncio.sleep(0.2)
+    if st.get("phase") == "error":
+        raise SystemExit(f"indexing failed: {st.get('error')}")
+    await client.get("/upload_notebook")
+    return name
+
+
+async def run_level(client, filename, concurrency, total):
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], {}
+
+    async def one(i):
+        async with sem:
+            t = time.perf_counter()
+            try:
+                r = await client.post("/ask", json={"question": f"{uuid.uuid4().hex} how is energy used?", "filename": filename})
+                error = None if r.status_code == 200 and r.json().get("ok") else f"HTTP {r.status_code}"
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            latencies.append(time.perf_counter() - t)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "rps": total / wall,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[5, 20, 100])
+    ap.add_argument("--requests", type=int, default=0, help="per level (default: 2 x concurrency)")
+    args = ap.parse_args()
+
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 10)
+    async with httpx.AsyncClient(base_url=args.url, timeout=600, limits=limits) as client:
+        filename = await prepare(client)
+        print(f"{'conc':>6} {'reqs':>6} {'err':>5} {'req/s':>8} {'p50 s':>8} {'p95 s':>8}")
+        for c in args.concurrency:
+            r = await run_level(client, filename, c, args.requests or 2 * c)
+            print(f"{r['concurrency']:>6} {r['requests']:>6} {r['errors']:>5} {r['rps']:>8.1f} {r['p50']:>8.2f} {r['p95']:>8.2f}  {r['error_kinds'] or ''}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
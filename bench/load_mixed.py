@@ -0,0 +1,178 @@
+# bench/load_mixed.py
+"""
+End-to-end load generator for a running server: virtual users concurrently upload synthetic
+documents (polling /progress until they are indexed), ask questions and generate quizzes,
+in a weighted mix. Reports throughput and latency percentiles per operation and can save
+or compare a baseline.
+
+    python bench/fake_openai.py --embed-latency 0.2 --chat-latency 1.0 &
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-fake \\
+        gunicorn app:app -b 127.0.0.1:8000 --workers 1 --threads 8 &
+    python bench/load_mixed.py --url http://127.0.0.1:8000 --users 20 --duration 60 \\
+        --mix ask=6 quiz=2 upload=1 --save-baseline bench/results/mixed.json
+
+"ingest" is the time from upload to the completed state; "progress" is each poll.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+import corpus
+import report
+
+MIME = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "txt": "text/plain",
+}
+QUESTIONS = [
+    "How does osmosis relate to membrane pressure?",
+    "What role do enzymes play in the reactions described?",
+    "Summarize the main points of section {n}.",
+    "Which experiment measures concentration gradients?",
+    "Explain the transport channel model in section {n}.",
+]
+
+
+class Load:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.latencies = {}  # op -> [seconds]
+        self.errors = {}  # op -> {kind: count}
+        self.notebooks = []
+        self.seeds = itertools.count(random.randrange(10 ** 6))
+        self.corpus_dir = tempfile.mkdtemp(prefix="bench_load_")
+
+    def record(self, op, seconds, error=None):
+        self.latencies.setdefault(op, []).append(seconds)
+        if error:
+            kinds = self.errors.setdefault(op, {})
+            kinds[error] = kinds.get(error, 0) + 1
+
+    async def call(self, op, method, url, **kw):
+        t = time.perf_counter()
+        error, r = None, None
+        try:
+            r = await self.client.request(method, url, **kw)
+            if r.status_code != 200:
+                error = f"HTTP {r.status_code}"
+            elif r.headers.get("content-type", "").startswith("application/json") and r.json().get("ok") is False:
+                error = "ok=false"
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        self.record(op, time.perf_counter() - t, error)
+        return None if error else r
+
+    async def upload(self):
+        kind = random.choice(self.args.kinds)
+        path = await asyncio.to_thread(corpus.make_document, self.corpus_dir, kind, self.args.pages, next(self.seeds))
+        init = await self.call("init_upload", "POST", "/init_upload")
+        if init is None:
+            return
+        job_id = init.json()["job_id"]
+        name = f"load_{uuid.uuid4().hex[:8]}.{kind}"
+        t0 = time.perf_counter()
+        with open(path, "rb") as f:
+            r = await self.call("upload", "POST", "/upload",
+                                files={"file": (name, f.read(), MIME[kind])},
+                                headers={"X-Job-Id": job_id, "X-Requested-With": "XMLHttpRequest"})
+        if r is None:
+            return
+        filename = r.json().get("filename", name)
+        while True:
+            r = await self.call("progress", "GET", f"/progress/{job_id}")
+            phase = r.json().get("phase") if r is not None else None
+            if phase in ("completed", "error"):
+                break
+            if time.perf_counter() - t0 > self.args.ingest_timeout:
+                phase = "timeout"
+                break
+            await asyncio.sleep(self.args.poll_interval)
+        self.record("ingest", time.perf_counter() - t0, None if phase == "completed" else phase)
+        if phase == "completed":
+            await self.client.get("/upload_notebook")  # stores the summary, as the page would
+            self.notebooks.append(filename)
+
+    async def ask(self):
+        question = random.choice(QUESTIONS).format(n=random.randint(1, self.args.pages))
+        if self.args.unique_questions:
+            question = f"{question} ({uuid.uuid4().hex[:6]})"
+        path = "/ask/stream" if self.args.stream else "/ask"
+        await self.call("ask", "POST", path, json={"question": question, "filename": random.choice(self.notebooks)})
+
+    async def quiz(self):
+        path = "/generate_quiz/stream" if self.args.stream else "/generate_quiz"
+        await self.call("quiz", "POST", path, json={"num_questions": 5, "filename": random.choice(self.notebooks)})
+
+    async def user(self, ops, weights, deadline, budget):
+        while time.perf_counter() < deadline and next(budget, None) is not None:
+            op = random.choices(ops, weights)[0]
+            await getattr(self, op)()
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        op, _, weight = item.partition("=")
+        if op not in ("ask", "quiz", "upload"):
+            raise SystemExit(f"unknown operation in --mix: {op}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=60, help="seconds to run")
+    ap.add_argument("--operations", type=int, default=0, help="stop after this many operations (0 = no limit)")
+    ap.add_argument("--mix", nargs="+", default=["ask=6", "quiz=2", "upload=1"], help="op=weight for ask, quiz, upload")
+    ap.add_argument("--kinds", nargs="+", choices=corpus.KINDS, default=list(corpus.KINDS))
+    ap.add_argument("--pages", type=int, default=5, help="pages per uploaded document")
+    ap.add_argument("--stream", action="store_true", help="use the NDJSON /stream endpoints")
+    ap.add_argument("--unique-questions", action="store_true", help="defeat the semantic answer cache")
+    ap.add_argument("--poll-interval", type=float, default=0.5)
+    ap.add_argument("--ingest-timeout", type=float, default=600)
+    report.add_baseline_args(ap)
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    limits = httpx.Limits(max_connections=args.users * 2 + 10)
+    async with httpx.AsyncClient(base_url=args.url, timeout=600, limits=limits) as client:
+        load = Load(client, args)
+        await load.upload()  # one notebook to ask about before the clock starts
+        if not load.notebooks:
+            raise SystemExit(f"could not index the first notebook: {load.errors}")
+        load.latencies.clear()
+        load.errors.clear()
+
+        budget = iter(range(args.operations)) if args.operations else itertools.count()
+        t0 = time.perf_counter()
+        deadline = t0 + args.duration
+        await asyncio.gather(*(load.user(list(mix), list(mix.values()), deadline, budget) for _ in range(args.users)))
+        wall = time.perf_counter() - t0
+
+    results = {}
+    print(f"\n{'op':<12} {'count':>6} {'err':>5} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+    for op, latencies in sorted(load.latencies.items()):
+        stats = report.latency_stats(latencies)
+        errors = load.errors.get(op, {})
+        results[op] = {"rps": len(latencies) / wall, "p50": stats["p50"], "p95": stats["p95"], "p99": stats["p99"],
+                       "error_rate": sum(errors.values()) / len(latencies)}
+        print(f"{op:<12} {len(latencies):>6} {sum(errors.values()):>5} {results[op]['rps']:>8.2f} "
+              f"{stats['p50']:>8.3f} {stats['p95']:>8.3f} {stats['p99']:>8.3f}  {errors or ''}")
+    print(f"wall {wall:.1f}s, {args.users} users, notebooks indexed: {len(load.notebooks)}")
+    return report.finish(args, results)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,69 @@
+# bench/micro_extract.py
+"""
+Microbenchmarks for the ingest front end: extraction (iter_file_records) and structural
+chunking (iter_structured_chunks), per file type and document length, on synthetic
+documents from bench/corpus.py. No API calls are made.
+
+    python bench/micro_extract.py --pages 1 10 100 --save-baseline bench/results/extract.json
+    python bench/micro_extract.py --pages 1 10 100 --baseline bench/results/extract.json
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import sandbox
+
+WORK = sandbox.setup("bench_extract_")
+
+import app  # noqa: E402
+import corpus  # noqa: E402
+import report  # noqa: E402
+
+
+def run_case(path, repeat):
+    """Median seconds for extraction alone and for extraction + chunking, plus the output sizes."""
+    extract, total = [], []
+    list(app.iter_structured_chunks(app.iter_file_records(path)))  # warm-up: imports, worker pool, tokenizer
+    for _ in range(repeat):
+        t = time.perf_counter()
+        records = list(app.iter_file_records(path))
+        extract.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        chunks = list(app.iter_structured_chunks(iter(records)))
+        total.append(extract[-1] + time.perf_counter() - t)
+    return statistics.median(extract), statistics.median(total), len(records), len(chunks)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--kinds", nargs="+", choices=corpus.KINDS, default=list(corpus.KINDS))
+    ap.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--corpus", default=os.path.join(WORK, "corpus"), help="where synthetic documents are kept")
+    report.add_baseline_args(ap)
+    args = ap.parse_args()
+
+    results = {}
+    print(f"{'case':<14} {'MiB':>7} {'records':>8} {'chunks':>7} {'extract s':>10} {'split s':>9} {'pages/s':>9}")
+    for kind in args.kinds:
+        for pages in args.pages:
+            path = corpus.make_document(args.corpus, kind, pages)
+            extract, total, n_records, n_chunks = run_case(path, args.repeat)
+            split = max(0.0, total - extract)
+            case = f"{kind}_{pages}p"
+            results[case] = {
+                "extract_s": extract,
+                "split_s": split,
+                "pages_per_s": pages / total if total else 0.0,
+            }
+            mib = os.path.getsize(path) / 2 ** 20
+            print(f"{case:<14} {mib:>7.2f} {n_records:>8} {n_chunks:>7} {extract:>10.3f} {split:>9.3f} "
+                  f"{results[case]['pages_per_s']:>9.1f}")
+    return report.finish(args, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# bench/report.py
+"""
+Shared helpers for the benchmark scripts: latency percentiles, and saving results as a
+JSON baseline to compare later runs against.
+
+Results are {case: {metric: number}}. Metrics named in HIGHER_IS_BETTER (throughput) regress
+when they drop; every other metric (latencies, seconds) regresses when it grows.
+"""
+import json
+import os
+import statistics
+
+HIGHER_IS_BETTER = {"rps", "pages_per_s", "chunks_per_s", "mb_per_s"}
+DEFAULT_TOLERANCE = 0.15  # relative change treated as noise
+MIN_SECONDS = 0.005  # latency changes smaller than this are timer noise, whatever the ratio
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (q in 0..100); 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def latency_stats(latencies):
+    return {
+        "n": len(latencies),
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"baseline saved to {path}")
+
+
+def compare(results, path, tolerance=DEFAULT_TOLERANCE):
+    """Print every metric next to the baseline in path; returns how many regressed beyond tolerance."""
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\n{'case':<28} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for case, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get(case, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or metric == "n":
+                continue
+            change = (value - old) / old if old else 0.0
+            if metric in HIGHER_IS_BETTER:
+                worse = -change
+            else:
+                worse = change if value - old >= MIN_SECONDS else 0.0
+            flag = "  REGRESSION" if worse > tolerance else ""
+            regressions += bool(flag)
+            print(f"{case:<28} {metric:<12} {old:>10.3f} {value:>10.3f} {change:>+7.0%}{flag}")
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        print(f"not run this time: {', '.join(missing)}")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def add_baseline_args(ap):
+    ap.add_argument("--save-baseline", metavar="PATH", help="write the results as a baseline JSON file")
+    ap.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline; exit 1 on regressions")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+
+def finish(args, results):
+    """Save and/or compare per the --save-baseline/--baseline args; returns the process exit code."""
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.tolerance) else 0
+    return 0
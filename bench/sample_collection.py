@@ -0,0 +1,78 @@
+# bench/sample_collection.py
+"""
+Compare a full collection read (the old generate_quiz path) with sample_chunks()
+as the collection grows. Runs fully offline with random vectors.
+
+    python bench/sample_collection.py --sizes 500 2000 8000
+"""
+import argparse
+import os
+import statistics
+import time
+
+import sandbox
+
+WORK = sandbox.setup("bench_sample_")
+
+import numpy as np  # noqa: E402
+from langchain_chroma import Chroma  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+import app  # noqa: E402
+
+
+class RandomEmbeddings(Embeddings):
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return np.random.rand(len(texts), self.dim).astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def build(persist_dir, size, dim, chunk_chars):
+    store = Chroma(embedding_function=RandomEmbeddings(dim), persist_directory=persist_dir)
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit ".split()
+    for start in range(0, size, 500):
+        n = min(500, size - start)
+        docs = [" ".join(words[(start + i + j) % len(words)] for j in range(chunk_chars // 6)) for i in range(n)]
+        store._collection.add(
+            ids=[f"c{start + i}" for i in range(n)],
+            documents=docs,
+            embeddings=np.random.rand(n, dim).astype(np.float32),
+        )
+    return store
+
+
+def timed(fn, repeat):
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return statistics.median(out) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 8000])
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--chunk-chars", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{'chunks':>8} {'full get (ms)':>14} {'sample 20 (ms)':>15} {'limit 15 (ms)':>14}")
+    for size in args.sizes:
+        persist_dir = os.path.join(WORK, f"chroma_{size}")
+        store = build(persist_dir, size, args.dim, args.chunk_chars)
+        full = timed(lambda: store.get(include=["documents"]), args.repeat)
+        app.sample_chunks(persist_dir, store, 20)  # warm the ID index once, as a long-lived worker would
+        sample = timed(lambda: app.sample_chunks(persist_dir, store, 20), args.repeat)
+        first = timed(lambda: store.get(limit=15, include=["documents"]), args.repeat)
+        print(f"{size:>8} {full:>14.1f} {sample:>15.1f} {first:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# bench/sandbox.py
+"""
+Point every path app.py writes to at a throwaway directory. Call setup() before `import app`,
+so a benchmark never reads or changes the repo's data (or a deployment's, if the shell has
+DATA_DIR and friends set).
+
+    import sandbox
+    WORK = sandbox.setup("bench_extract_")
+    import app
+"""
+import os
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every data location app.py takes from the environment, and its name inside the sandbox
+DATA_PATHS = [
+    ("DATA_DIR", "data"),
+    ("CHROMA_DATA_DIR", "chroma_data"),
+    ("ARTIFACT_DIR", "artifacts"),
+    ("UPLOAD_FOLDER", "uploads"),
+    ("EMBED_CACHE_DIR", "embedding_cache"),
+    ("JOB_QUEUE_PATH", "jobs.sqlite3"),
+    ("PROGRESS_DB_PATH", "progress.sqlite3"),
+    ("CONTENT_INDEX_PATH", "content_index.sqlite3"),
+    ("SUMMARY_CACHE_PATH", "summaries.sqlite3"),
+    ("QUIZ_POOL_PATH", "quiz_pool.sqlite3"),
+    ("DOC_REGISTRY_PATH", "documents.sqlite3"),
+    ("UPLOAD_SESSIONS_PATH", "upload_sessions.sqlite3"),
+]
+
+
+def setup(prefix):
+    """Create the sandbox, redirect the app into it with no job workers, and return its path."""
+    work = tempfile.mkdtemp(prefix=prefix)
+    for var, name in DATA_PATHS:
+        os.environ[var] = os.path.join(work, name)
+    os.environ["JOB_WORKERS"] = "0"
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    return work
@@ -0,0 +1,14 @@
+# gunicorn.conf.py
+# Read by gunicorn from the working directory when the sync deployment (gunicorn app:app) is
+# used instead of uvicorn asgi:app. Queue workers run in their own process ("flask --app app
+# jobs-worker", the worker service in docker-compose.yml and the Procfile), so ingestion does
+# not compete with /ask in the web workers. JOBS_IN_WEB=1 runs them inside each web worker
+# instead, for a single-process setup.
+import os
+
+
+def post_worker_init(worker):
+    if os.getenv("JOBS_IN_WEB", "").lower() in ("1", "true", "yes"):
+        from app import JOBS
+
+        JOBS.start()
@@ -0,0 +1,14 @@
+# pdf_worker.py
+"""
+Process-pool worker for PDF text extraction.
+Kept out of app.py so spawned workers only import pypdf, not Flask/Chroma/LangChain.
+"""
+from pypdf import PdfReader
+
+
+def extract_pages(path: str, start: int, stop: int):
+    """Return [(page_number, text), ...] for pages [start, stop) (0-based indices)."""
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        stop = min(stop, len(reader.pages))
+        return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, stop)]
@@ -49,6 +49,50 @@ document.addEventListener("DOMContentLoaded", () => {
     return data;
   }
 
+  // POST JSON and read the NDJSON event stream, calling onEvent for each event as it arrives.
+  async function postStream(url, bodyObj, onEvent) {
+    const resp = await fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(bodyObj || {}),
+    });
+    if (!resp.ok) {
+      const data = await resp.json().catch(() => ({}));
+      throw new Error(data.error || `Request failed: ${resp.status}`);
+    }
+
+    let buf = "";
+    const drain = () => {
+      let nl;
+      while ((nl = buf.indexOf("\n")) >= 0) {
+        const line = buf.slice(0, nl).trim();
+        buf = buf.slice(nl + 1);
+        if (!line) continue;
+        const evt = JSON.parse(line);
+        if (evt.type === "error") throw new Error(evt.error || "Request failed");
+        onEvent(evt);
+      }
+    };
+
+    // Browsers without readable streams still get every event, just all at once
+    if (!resp.body || !window.TextDecoder) {
+      buf = (await resp.text()) + "\n";
+      drain();
+      return;
+    }
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      drain();
+    }
+    buf += "\n";
+    drain();
+  }
+
   function setStatus(text) {
     if (statusEl) statusEl.textContent = text;
   }
@@ -163,10 +207,12 @@ document.addEventListener("DOMContentLoaded", () => {
   // === File input change handler ===
   fileInput?.addEventListener("change", (e) => {
     const file = e.target.files?.[0] || null;
+    const count = e.target.files?.length || 0;
 
     // Update selected file name
     if (selectedFileName) {
-      selectedFileName.textContent = file ? `Selected file: ${file.name}` : "";
+      selectedFileName.textContent = count > 1 ? `Selected ${count} files (one notebook)`
+        : file ? `Selected file: ${file.name}` : "";
     }
 
     // Optional: update status
@@ -200,14 +246,11 @@ document.addEventListener("DOMContentLoaded", () => {
       const files = e.dataTransfer?.files;
       if (!files || !files.length) return;
 
-      // Set dropped file to input
+      // Set dropped files to input (several become one notebook)
       const dt = new DataTransfer();
-      dt.items.add(files[0]);
+      Array.from(files).forEach((f) => dt.items.add(f));
       fileInput.files = dt.files;
 
-      // Update UI
-      if (selectedFileName) selectedFileName.textContent = `Selected file: ${files[0].name}`;
-
       // Trigger change event for the same handling as browse button
       fileInput.dispatchEvent(new Event("change", { bubbles: true }));
     });
@@ -245,10 +288,16 @@ document.addEventListener("DOMContentLoaded", () => {
     if (askBtn) askBtn.disabled = true;
     setStatus("Answering...");
     try {
-      const data = await postJSON("/ask", { question: q, filename });
       ensureAnswerBox();
       const answerText = $("answerText");
-      if (answerText) answerText.textContent = data.answer || "(no answer)";
+      if (answerText) answerText.textContent = "";
+      let answer = "";
+      await postStream("/ask/stream", { question: q, filename }, (evt) => {
+        if (evt.type !== "token") return;
+        answer += evt.text;
+        if (answerText) answerText.textContent = answer;
+      });
+      if (answerText) answerText.textContent = answer || "(no answer)";
       setStatus("✅ Answer ready.");
     } catch (err) {
       setStatus(`⚠️ ${err.message}`);
@@ -396,6 +445,81 @@ document.addEventListener("DOMContentLoaded", () => {
 
 
 
+  // ------------------------------------
+  // Resumable upload in fixed-size parts (/upload/parts)
+  // ------------------------------------
+  const PART_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+  const PART_MAX_ATTEMPTS = 6;
+
+  async function partSha256(blob) {
+    if (!window.crypto?.subtle) return null;  // insecure origin: the server skips the check
+    const digest = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+  }
+
+  async function openPartUpload(file, jobId, appendTo) {
+    // Same file picked again after a failure or reload: resume its session if the server still has it
+    const key = `partUpload:${appendTo || ""}:${file.name}:${file.size}:${file.lastModified}`;
+    const saved = localStorage.getItem(key);
+    if (saved) {
+      const r = await fetch(`/upload/parts/${saved}`);
+      if (r.ok) return { key, info: await r.json() };
+      localStorage.removeItem(key);
+    }
+    const r = await fetch("/upload/parts", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ filename: file.name, size: file.size, append_to: appendTo, job_id: jobId }),
+    });
+    const info = await r.json();
+    if (!r.ok || !info.ok) throw new Error(info.error || "Could not start upload");
+    localStorage.setItem(key, info.upload_id);
+    return { key, info };
+  }
+
+  async function uploadInParts(file, jobId, appendTo, onProgress) {
+    const { key, info } = await openPartUpload(file, jobId, appendTo);
+    let received = info.received;
+    let failures = 0;
+    onProgress(received / file.size);
+
+    while (received < file.size) {
+      const part = file.slice(received, Math.min(file.size, received + info.part_size));
+      const headers = { "Content-Type": "application/octet-stream" };
+      const checksum = await partSha256(part);
+      if (checksum) headers["X-Part-Sha256"] = checksum;
+      try {
+        const r = await fetch(`/upload/parts/${info.upload_id}?offset=${received}`, { method: "PUT", headers, body: part });
+        const data = await r.json();
+        if (r.ok) {
+          received = data.received;
+          failures = 0;
+          onProgress(received / file.size);
+          continue;
+        }
+        if (r.status === 409) { received = data.received; continue; }  // server has a different offset
+        const err = new Error(data.error || `HTTP ${r.status}`);
+        if (r.status === 404) {
+          localStorage.removeItem(key);
+          err.fatal = true;
+        }
+        throw err;
+      } catch (err) {
+        if (err.fatal || ++failures >= PART_MAX_ATTEMPTS) throw err;
+        await new Promise((res) => setTimeout(res, 500 * 2 ** failures));
+        // Ask where to continue; the failed part may or may not have landed
+        const st = await fetch(`/upload/parts/${info.upload_id}`).then((r) => r.json()).catch(() => null);
+        if (st?.ok) received = st.received;
+      }
+    }
+
+    const r = await fetch(`/upload/parts/${info.upload_id}/finish`, { method: "POST" });
+    const done = await r.json();
+    localStorage.removeItem(key);
+    if (!r.ok || !done.ok) throw new Error(done.error || "Upload failed");
+    return done;
+  }
+
   // ------------------------------------
   // Handle upload with real progress (0–40%)
   // ------------------------------------
@@ -410,20 +534,33 @@ document.addEventListener("DOMContentLoaded", () => {
       window.__currentUploadXhr?.abort();
       window.__currentUploadXhr = null;
 
-      // Stop any previous poller before starting a new upload
-      if (window.__progressPoller) {
-        clearInterval(window.__progressPoller);
-        window.__progressPoller = null;
-      }
+      // Stop any previous progress stream/poller before starting a new upload
+      window.__stopProgress?.();
 
       const fileInput = document.getElementById("fileInput");
-      const file = fileInput?.files?.[0];
+      const files = Array.from(fileInput?.files || []);
+      const file = files[0];
+      const batch = files.length > 1;
       //if (!file) { alert("Please choose a file first!"); return; }
 
       if (!file) {
         showModal("Please choose a file first!");
         return;
       }
+      // Optionally add the file to an existing notebook instead of creating a new one
+      let appendTo = null;
+      if (document.getElementById("appendToggle")?.checked) {
+        const selected = document.querySelector(".doc-select:checked");
+        if (!selected) {
+          showModal("Please select a notebook from 'Uploaded files' to add to.");
+          return;
+        }
+        appendTo = selected.value;
+        if (batch) {
+          showModal("Please add files to an existing notebook one at a time.");
+          return;
+        }
+      }
       //Disable submit button during upload
       uploadForm
         .querySelector("button[type=submit]")
@@ -451,9 +588,40 @@ document.addEventListener("DOMContentLoaded", () => {
       // ✅ 3) Start polling RIGHT NOW (server-side upload progress)
       startProgressPoller(jobId);
 
+      // Large files go up in resumable parts; a dropped connection continues where it stopped
+      if (!batch && file.size > PART_UPLOAD_THRESHOLD) {
+        __clientUploadPct = 0;
+        __clientUploading = true;
+        try {
+          const done = await uploadInParts(file, jobId, appendTo, (frac) => {
+            const pct = Math.max(1, Math.floor(frac * 40));  // 1..40
+            __clientUploadPct = pct;
+            if (bar) bar.style.width = pct + "%";
+            if (label) label.textContent = `Uploading… ${pct}%`;
+          });
+          // A resumed upload keeps the job id it was started with
+          if (done.job_id !== jobId) {
+            window.__stopProgress?.();
+            startProgressPoller(done.job_id);
+          }
+        } catch (err) {
+          if (label) label.textContent = `Upload error! ${err.message || ""}`;
+          if (bar) bar.classList.add("bg-danger");
+          uploadForm?.querySelector("button[type=submit]")?.removeAttribute("disabled");
+        } finally {
+          __clientUploading = false;
+        }
+        return;
+      }
+
       // 4) Upload via XHR (WITH client-side progress)
       const formData = new FormData();
-      formData.append("file", file);
+      if (batch) {
+        files.forEach((f) => formData.append("files", f));
+      } else {
+        formData.append("file", file);
+        if (appendTo) formData.append("append_to", appendTo);
+      }
 
       __clientUploadPct = 0;
       __clientUploading = true;
@@ -494,7 +662,7 @@ document.addEventListener("DOMContentLoaded", () => {
         if (bar) bar.classList.add("bg-danger");
       });
 
-      xhr.open("POST", uploadForm.action, true);
+      xhr.open("POST", batch ? "/upload/batch" : uploadForm.action, true);
       xhr.setRequestHeader("X-Job-Id", jobId);
       xhr.setRequestHeader("X-Requested-With", "XMLHttpRequest");
       xhr.send(formData);
@@ -503,103 +671,144 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   // ==============================
-  // Poller handles progress updates
+  // Progress updates: SSE stream, polling as fallback
   // ==============================
+  const progressActive = () => !!(window.__progressPoller || window.__progressSource);
+
   function startProgressPoller(jobId) {
     let lastPct = 0;
     let lastPhase = "";
     const buildProgress = document.getElementById("buildProgress");
     const buildBar = document.getElementById("buildBar");
     const buildLabel = document.getElementById("buildLabel");
-    if (!jobId || !buildProgress || !buildBar || !buildLabel || window.__progressPoller) return;
+    if (!jobId || !buildProgress || !buildBar || !buildLabel || progressActive()) return;
 
     buildProgress.style.display = "block";
     buildBar.classList.remove("bg-danger");
 
     const stop = () => {
+      window.__progressSource?.close();
+      window.__progressSource = null;
       clearInterval(window.__progressPoller);
       window.__progressPoller = null;
     };
+    window.__stopProgress = stop;
+
+    const fail = (message) => {
+      stop();
+      buildLabel.textContent = message;
+      buildBar.classList.add("bg-danger");
+      // 🔓 Re-enable submit button
+      uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
+    };
 
-    window.__progressPoller = setInterval(async () => {
-      try {
-        const resp = await fetch(`/progress/${jobId}`, { cache: "no-store" });
-        if (!resp.ok) {
-          stop();
-          buildLabel.textContent = "Progress unavailable.";
-          buildBar.classList.add("bg-danger");
-          // 🔓 Re-enable submit button
-          uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
-          return;
-        }
-
-        const data = await resp.json();
-        const phaseRaw = data.phase || "queued";
-        const phase = phaseRaw.toLowerCase();
-        let pct = Math.max(0, Math.min(100, Number(data.pct || 0)));
+    function applyUpdate(data) {
+      const phaseRaw = data.phase || "queued";
+      const phase = phaseRaw.toLowerCase();
+      let pct = Math.max(0, Math.min(100, Number(data.pct || 0)));
 
-        // Ignore fake "queued 0%" after progress already started
-        if (lastPct > 0 && phase === "queued" && pct === 0) {
-          return;
-        }
-
-        // Never allow progress to move backwards
-        if (pct < lastPct && phase !== "error") {
-          pct = lastPct;
-        }
+      // Ignore fake "queued 0%" after progress already started
+      if (lastPct > 0 && phase === "queued" && pct === 0) {
+        return;
+      }
 
-        // Accept this update
-        lastPct = pct;
-        lastPhase = phase;
+      // Never allow progress to move backwards
+      if (pct < lastPct && phase !== "error") {
+        pct = lastPct;
+      }
 
-        // While client upload is active, ignore server upload < 40
-        if (__clientUploading && phase === "uploading" && pct < 40) {
-          return;
-        }
+      // Accept this update
+      lastPct = pct;
+      lastPhase = phase;
 
-        buildBar.style.width = pct + "%";
-        buildLabel.textContent = `${data.phase || "Working"}… ${pct}%`;
+      // While client upload is active, ignore server upload < 40
+      if (__clientUploading && phase === "uploading" && pct < 40) {
+        return;
+      }
 
-        if (phase === "processing" || phase === "summarizing" || phase === "queued") {
-          buildBar.classList.add("processing");
-        } else {
-          buildBar.classList.remove("processing");
-        }
+      buildBar.style.width = pct + "%";
+      buildLabel.textContent = `${data.phase || "Working"}… ${pct}%`;
+      if (data.files?.length) {
+        const indexed = data.files.filter((f) => f.phase === "indexed").length;
+        const failed = data.files.filter((f) => f.phase === "error").length;
+        buildLabel.textContent += ` (${indexed}/${data.files.length} files indexed${failed ? `, ${failed} failed` : ""})`;
+      }
 
-        if (phase === "completed") {
-          stop();
-          buildBar.classList.remove("processing");
-          buildLabel.textContent = "Completed 100%";
+      if (phase === "processing" || phase === "summarizing" || phase === "queued") {
+        buildBar.classList.add("processing");
+      } else {
+        buildBar.classList.remove("processing");
+      }
 
-          // ✅ Show uploaded files container
-          const uploadedContainer = document.getElementById("uploadedFilesContainer");
-          if (uploadedContainer) uploadedContainer.style.display = "block";
+      if (phase === "completed") {
+        stop();
+        buildBar.classList.remove("processing");
+        buildLabel.textContent = "Completed 100%";
 
-          // Re-enable submit button
-          uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
+        // ✅ Show uploaded files container
+        const uploadedContainer = document.getElementById("uploadedFilesContainer");
+        if (uploadedContainer) uploadedContainer.style.display = "block";
 
-          setTimeout(() => location.reload(), 400);
-          return;
-        }
+        // Re-enable submit button
+        uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
 
-        if (phase === "error") {
-          stop();
-          buildBar.classList.remove("processing");
-          buildLabel.textContent = `Error: ${data.error || "Unknown error"}`;
-          buildBar.classList.add("bg-danger");
+        setTimeout(() => location.reload(), 400);
+        return;
+      }
 
-          // 🔓 Re-enable submit button
-          uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
-          return;
-        }
-      } catch (e) {
+      if (phase === "error") {
         stop();
-        buildLabel.textContent = "Could not fetch progress.";
+        buildBar.classList.remove("processing");
+        buildLabel.textContent = `Error: ${data.error || "Unknown error"}`;
         buildBar.classList.add("bg-danger");
+
         // 🔓 Re-enable submit button
         uploadForm?.querySelector('button[type="submit"]')?.removeAttribute("disabled");
+        return;
       }
-    }, 500);
+    }
+
+    function startPolling() {
+      window.__progressPoller = setInterval(async () => {
+        try {
+          const resp = await fetch(`/progress/${jobId}`, { cache: "no-store" });
+          if (!resp.ok) {
+            fail("Progress unavailable.");
+            return;
+          }
+          applyUpdate(await resp.json());
+        } catch (e) {
+          fail("Could not fetch progress.");
+        }
+      }, 500);
+    }
+
+    if (window.EventSource) {
+      const source = new EventSource(`/progress/${jobId}/stream`);
+      let gotMessage = false;
+      window.__progressSource = source;
+
+      source.onmessage = (e) => {
+        gotMessage = true;
+        try {
+          applyUpdate(JSON.parse(e.data));
+        } catch (err) {
+          console.warn("Bad progress event", err);
+        }
+      };
+      source.addEventListener("missing", () => fail("Progress unavailable."));
+      source.onerror = () => {
+        // The server ends each stream after ~1 minute and EventSource reconnects by itself.
+        // If streaming never worked (proxy, old server) or the browser gave up, poll instead.
+        if (!gotMessage || source.readyState === EventSource.CLOSED) {
+          source.close();
+          window.__progressSource = null;
+          if (!window.__progressPoller) startPolling();
+        }
+      };
+    } else {
+      startPolling();
+    }
 
     window.addEventListener("beforeunload", stop, { once: true });
   }
@@ -608,7 +817,7 @@ document.addEventListener("DOMContentLoaded", () => {
   // Auto-start when page already has a job id (e.g., /generate)
   const initialJobId = document.body?.dataset?.jobId || "";
   const wrap = document.getElementById("buildProgress");
-  if (initialJobId && wrap && getComputedStyle(wrap).display !== "none" && !window.__progressPoller) {
+  if (initialJobId && wrap && getComputedStyle(wrap).display !== "none" && !progressActive()) {
     startProgressPoller(initialJobId);
   }
 
@@ -623,42 +832,45 @@ document.addEventListener("DOMContentLoaded", () => {
   function renderQuiz(quiz) {
     if (!quizList) return;
     quizList.innerHTML = '';
-    quiz.forEach((q, idx) => {
-      const correct = (q.correct || '').trim().replace(/[^A-D]/ig, '').toUpperCase(); // "A"–"D"
-      const item = document.createElement('div');
-      item.className = 'list-group-item';
-      item.dataset.correct = correct;
-
-      const choicesHtml = ['A', 'B', 'C', 'D'].map((L, i) => {
-        const raw = (q.choices?.[i] || '').trim();
-        const labelText = raw.replace(/^[A-D]\)\s*/i, '');
-        const id = `q${idx}-${L}`;
-        return `
-          <div class="form-check ms-2">
-            <input class="form-check-input" type="radio" name="q${idx}" id="${id}" value="${L}">
-            <label class="form-check-label" for="${id}">
-              <span class="badge bg-light text-dark me-2">${L}.</span> ${labelText || raw}
-            </label>
-          </div>
-        `;
-      }).join('');
-
-      item.innerHTML = `
-          <div class="fw-semibold mb-1">${q.question || ('Question ' + (idx + 1))}</div>
-          ${choicesHtml}
-          <div class="mt-2" id="feedback-${idx}"></div> <!-- feedback placeholder -->
-          ${q.explanation ? `<button class="btn btn-link btn-sm mt-1" type="button" onclick="showExplanation(${idx})">Explanation</button>
-          <div class="alert alert-secondary mt-1" id="explanation-${idx}" style="display:none;">${q.explanation}</div>` : ''}
-        `;
-
-      quizList.appendChild(item);
-    });
+    quiz.forEach((q, idx) => appendQuizItem(q, idx));
 
     if (quizResults) quizResults.innerHTML = '';   // clear prior summary
     if (quizStatus) quizStatus.textContent = '';  // clear status line
     if (quizBox) quizBox.style.display = 'block';
   }
 
+  function appendQuizItem(q, idx) {
+    if (!quizList) return;
+    const correct = (q.correct || '').trim().replace(/[^A-D]/ig, '').toUpperCase(); // "A"–"D"
+    const item = document.createElement('div');
+    item.className = 'list-group-item';
+    item.dataset.correct = correct;
+
+    const choicesHtml = ['A', 'B', 'C', 'D'].map((L, i) => {
+      const raw = (q.choices?.[i] || '').trim();
+      const labelText = raw.replace(/^[A-D]\)\s*/i, '');
+      const id = `q${idx}-${L}`;
+      return `
+        <div class="form-check ms-2">
+          <input class="form-check-input" type="radio" name="q${idx}" id="${id}" value="${L}">
+          <label class="form-check-label" for="${id}">
+            <span class="badge bg-light text-dark me-2">${L}.</span> ${labelText || raw}
+          </label>
+        </div>
+      `;
+    }).join('');
+
+    item.innerHTML = `
+        <div class="fw-semibold mb-1">${q.question || ('Question ' + (idx + 1))}</div>
+        ${choicesHtml}
+        <div class="mt-2" id="feedback-${idx}"></div> <!-- feedback placeholder -->
+        ${q.explanation ? `<button class="btn btn-link btn-sm mt-1" type="button" onclick="showExplanation(${idx})">Explanation</button>
+        <div class="alert alert-secondary mt-1" id="explanation-${idx}" style="display:none;">${q.explanation}</div>` : ''}
+      `;
+
+    quizList.appendChild(item);
+  }
+
   function gradeQuiz() {
     if (!quizList) return;
     const items = [...quizList.querySelectorAll('.list-group-item')];
@@ -980,9 +1192,16 @@ document.addEventListener("DOMContentLoaded", () => {
       generateBtn.disabled = true;
       if (quizStatus) quizStatus.textContent = `Generating ${num} questions...`;
       try {
-        const data = await postJSON("/generate_quiz", { num_questions: num, filename, });
-        lastQuiz = data.quiz || [];
-        renderQuiz(lastQuiz);
+        // Show each question as soon as the server has parsed it
+        lastQuiz = [];
+        await postStream("/generate_quiz/stream", { num_questions: num, filename, }, (evt) => {
+          if (evt.type !== "question") return;
+          lastQuiz.push(evt.question);
+          appendQuizItem(evt.question, lastQuiz.length - 1);
+          if (quizBox) quizBox.style.display = 'block';
+          if (quizStatus) quizStatus.textContent = `Generated ${lastQuiz.length} of ${num} questions...`;
+        });
+        if (quizResults) quizResults.innerHTML = '';
         attachExportButtons();
         if (quizStatus) quizStatus.textContent = '✅ Quiz ready.';
       } catch (err) {
@@ -0,0 +1,29 @@
+# tests/conftest.py
+"""
+Import app with every data path in a throwaway directory and no job workers, so the tests
+touch nothing in the repo and need no API key or network.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+WORK = tempfile.mkdtemp(prefix="app_tests_")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+os.environ.setdefault("DATA_DIR", os.path.join(WORK, "data"))
+for var, name in [("CHROMA_DATA_DIR", "chroma_data"), ("ARTIFACT_DIR", "artifacts"), ("UPLOAD_FOLDER", "uploads"),
+                  ("EMBED_CACHE_DIR", "ec"), ("CONTENT_INDEX_PATH", "ci.sqlite3"), ("QUIZ_POOL_PATH", "qp.sqlite3"),
+                  ("SUMMARY_CACHE_PATH", "sum.sqlite3"), ("DOC_REGISTRY_PATH", "docs.sqlite3"),
+                  ("UPLOAD_SESSIONS_PATH", "uploads.sqlite3")]:
+    os.environ.setdefault(var, os.path.join(WORK, name))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Count tokens with the ~4 characters per token estimate, so results do not depend on tiktoken."""
+    monkeypatch.setattr(app, "_TOKENIZER", False)
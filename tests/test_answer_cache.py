@@ -0,0 +1,37 @@
+# tests/test_answer_cache.py
+from app import AnswerCache
+
+
+def test_similar_question_on_the_same_version_hits():
+    cache = AnswerCache(threshold=0.95)
+    cache.store("nb", 1, "What is osmosis?", [1.0, 0.0], "Water moving across a membrane.", seconds=2.0)
+    assert cache.lookup("nb", 1, [0.99, 0.05]) == "Water moving across a membrane."
+    assert cache.lookup("nb", 1, [0.0, 1.0]) is None
+    assert cache.lookup("other", 1, [1.0, 0.0]) is None
+    assert cache.stats()["seconds_saved"] == 2.0
+
+
+def test_a_newer_version_retires_older_answers():
+    cache = AnswerCache()
+    cache.store("nb", 1, "q", [1.0, 0.0], "old answer", seconds=1.0)
+    assert cache.lookup("nb", 2, [1.0, 0.0]) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_answer_from_content_that_changed_meanwhile_is_not_kept():
+    cache = AnswerCache()
+    cache.store("nb", 2, "q1", [1.0, 0.0], "fresh", seconds=1.0)
+    cache.store("nb", 1, "q2", [0.0, 1.0], "stale", seconds=1.0)  # read version 1 before the bump
+    assert cache.lookup("nb", 2, [0.0, 1.0]) is None
+    assert cache.lookup("nb", 2, [1.0, 0.0]) == "fresh"
+
+
+def test_expired_and_least_recent_entries_are_dropped():
+    cache = AnswerCache(ttl=-1)
+    cache.store("nb", 0, "q", [1.0, 0.0], "a", seconds=1.0)
+    assert cache.lookup("nb", 0, [1.0, 0.0]) is None
+    cache = AnswerCache(max_per_doc=2)
+    for i, vec in enumerate(([1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0])):
+        cache.store("nb", 0, f"q{i}", vec, f"a{i}", seconds=1.0)
+    assert cache.lookup("nb", 0, [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("nb", 0, [0.0, 0.0, 1.0]) == "a2"
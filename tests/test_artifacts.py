@@ -0,0 +1,27 @@
+# tests/test_artifacts.py
+from app import ARTIFACTS, file_chunks, file_sha256
+
+
+def test_artifacts_are_keyed_by_the_bytes_parsed(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Osmosis moves water across a membrane.")
+    stale = file_sha256(str(path))
+    path.write_text("Enzymes speed up reactions.")  # replaced after the upload was hashed
+
+    file_hash, chunks = file_chunks(str(path), stale)
+    assert file_hash == file_sha256(str(path))
+    assert "Enzymes" in list(chunks)[0][0]
+    assert ARTIFACTS.has_records(file_hash)
+    assert not ARTIFACTS.has_records(stale)
+
+
+def test_saved_artifacts_are_used_once_the_upload_is_gone(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Mitochondria make ATP.")
+    file_hash, chunks = file_chunks(str(path))
+    first = list(chunks)
+    path.unlink()
+
+    again_hash, chunks = file_chunks(str(path), file_hash)
+    assert again_hash == file_hash
+    assert list(chunks) == first
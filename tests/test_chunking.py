@@ -0,0 +1,41 @@
+# tests/test_chunking.py
+from app import count_tokens, iter_structured_chunks
+
+
+def page(number, text, total=3):
+    return {"kind": "page", "number": number, "total": total, "text": text}
+
+
+def block(number, text):
+    return {"kind": "block", "number": number, "total": 2, "text": text}
+
+
+def test_small_pages_share_a_chunk():
+    chunks = list(iter_structured_chunks([page(1, "first page text"), page(2, "second page text")], max_tokens=100))
+    assert len(chunks) == 1
+    text, meta = chunks[0]
+    assert text == "first page text\nsecond page text"
+    assert meta == {"kind": "page", "start": 1, "end": 2}
+
+
+def test_page_that_does_not_fit_starts_a_new_chunk():
+    one, two = "a" * 200, "b" * 200  # 50 tokens each
+    chunks = list(iter_structured_chunks([page(1, one), page(2, two)], max_tokens=80, overlap_tokens=20))
+    assert [c[0] for c in chunks] == [one, two]
+    assert [(m["start"], m["end"]) for _, m in chunks] == [(1, 1), (2, 2)]
+
+
+def test_oversized_page_is_split_within_the_budget():
+    text = "\n".join(f"line {i} " + "word " * 20 for i in range(40))
+    chunks = list(iter_structured_chunks([page(1, text, total=1)], max_tokens=100, overlap_tokens=0))
+    assert len(chunks) > 1
+    assert all(count_tokens(t) <= 100 for t, _ in chunks)
+    assert " ".join(t for t, _ in chunks).split() == text.split()
+
+
+def test_stream_records_never_cut_a_word():
+    chunks = list(iter_structured_chunks([block(1, "osmosis and diffu"), block(2, "sion rates")], max_tokens=100))
+    assert len(chunks) == 1
+    assert "diffusion" in chunks[0][0]
+    assert chunks[0][1]["start"] == 1 and chunks[0][1]["end"] == 2
+
@@ -0,0 +1,77 @@
+# tests/test_content_index.py
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from app import ContentIndex
+
+
+def make_dirs(tmp_path, *names):
+    paths = []
+    for name in names:
+        (tmp_path / name).mkdir()
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def test_identical_upload_finishing_second_keeps_its_own_count(tmp_path):
+    index = ContentIndex(str(tmp_path / "ci.sqlite3"))
+    d1, d2 = make_dirs(tmp_path, "d1", "d2")
+    index.add_file("h", d1, "summary")
+    assert index.acquire_file("h")["persist_dir"] == d1
+    index.add_file("h", d2, "summary")  # the other job of the same bytes
+
+    assert index.refs(d1) == 2 and index.refs(d2) == 1
+    assert index.acquire_file("h")["persist_dir"] == d1  # the first upload stays the target
+    assert index.release_dir(d2) == 0
+    assert index.release_dir(d1) == 2
+
+
+def test_retried_job_does_not_take_a_second_reference(tmp_path):
+    index = ContentIndex(str(tmp_path / "ci.sqlite3"))
+    (d1,) = make_dirs(tmp_path, "d1")
+    index.add_file("h", d1, "summary")
+    index.add_file("h", d1, "summary")
+    assert index.release_dir(d1) == 0
+    assert index.acquire_file("h") is None
+
+
+def test_concurrent_acquire_and_release_keep_an_exact_count(tmp_path):
+    index = ContentIndex(str(tmp_path / "ci.sqlite3"))
+    d1, d2 = make_dirs(tmp_path, "d1", "d2")
+    index.add_file("h", d1, "summary")
+
+    def student(i):
+        if i % 10 == 0:
+            index.add_file("h", d2, "summary")
+        assert index.acquire_file("h")["persist_dir"] == d1
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(student, range(40)))
+    assert index.refs(d1) == 41
+    with ThreadPoolExecutor(8) as pool:
+        remaining = list(pool.map(lambda _: index.release_dir(d1), range(41)))
+    assert sorted(remaining) == list(range(41))  # every release saw a distinct count
+    assert index.acquire_file("h") is None
+    assert index.refs(d2) == 1
+
+
+def test_missing_folder_is_not_reused(tmp_path):
+    index = ContentIndex(str(tmp_path / "ci.sqlite3"))
+    index.add_file("h", str(tmp_path / "gone"), "summary")
+    assert index.acquire_file("h") is None
+    assert index.refs(str(tmp_path / "gone")) == 0
+
+
+def test_counts_from_before_per_folder_refs_are_kept(tmp_path):
+    path = str(tmp_path / "ci.sqlite3")
+    (d1,) = make_dirs(tmp_path, "d1")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE files (file_hash TEXT PRIMARY KEY, persist_dir TEXT NOT NULL, summary TEXT, "
+               "refs INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL)")
+    db.execute("INSERT INTO files VALUES ('h', ?, 'summary', 3, 0)", (d1,))
+    db.commit()
+    db.close()
+    index = ContentIndex(path)
+    assert index.refs(d1) == 3
+    index.add_file("h2", d1, "summary")  # new rows fill the old column from its default
+    assert index.refs(d1) == 3
@@ -0,0 +1,53 @@
+# tests/test_document_registry.py
+import pytest
+
+from app import DocumentRegistry
+
+
+@pytest.fixture
+def docs(tmp_path):
+    return DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+
+
+def test_documents_are_per_user_and_in_upload_order(docs):
+    docs.put("u1", "b.pdf", "/d/b")
+    docs.put("u1", "a.pdf", "/d/a", summary="About A")
+    docs.put("u2", "c.pdf", "/d/c")
+    assert list(docs.docs("u1")) == ["b.pdf", "a.pdf"]
+    assert docs.get("u1", "a.pdf") == {"persist_dir": "/d/a", "summary": "About A"}
+    assert docs.get("u2", "a.pdf") is None
+
+
+def test_reupload_keeps_the_list_position(docs):
+    docs.put("u1", "a.pdf", "/d/a1")
+    docs.put("u1", "b.pdf", "/d/b")
+    docs.put("u1", "a.pdf", "/d/a2", summary="new")
+    assert list(docs.docs("u1")) == ["a.pdf", "b.pdf"]
+    assert docs.get("u1", "a.pdf")["persist_dir"] == "/d/a2"
+
+
+def test_current_document_follows_set_summary_and_remove(docs):
+    docs.put("u1", "a.pdf", "/d/a")
+    docs.set_current("u1", "a.pdf")
+    docs.set_summary("u1", "a.pdf", "About A")
+    assert docs.current("u1") == ("a.pdf", "About A")
+    docs.remove("u1", "a.pdf")
+    assert docs.current("u1") == (None, None)
+    assert docs.docs("u1") == {}
+
+
+def test_results_newest_first(docs):
+    for i in range(3):
+        docs.add_result("u1", {"filename": "a.pdf", "correct": i, "total": 5,
+                               "percent": i * 20, "test_datetime": f"2026-01-0{i + 1}"})
+    assert [r["correct"] for r in docs.results("u1")] == [2, 1, 0]
+    assert docs.results("u1", limit=1)[0]["test_datetime"] == "2026-01-03"
+
+
+def test_notebook_version_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "documents.sqlite3")
+    web, worker = DocumentRegistry(path), DocumentRegistry(path)
+    assert web.version("/d/a") == 0
+    worker.bump_version("/d/a")
+    worker.bump_version("/d/a")
+    assert web.version("/d/a") == 2
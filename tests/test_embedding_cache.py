@@ -0,0 +1,58 @@
+# tests/test_embedding_cache.py
+import zlib
+from threading import Thread
+
+from app import EmbeddingCache
+
+
+def vector(text, dim=8):
+    return [float(zlib.crc32(text.encode()) % 1000)] * dim
+
+
+def test_round_trip_and_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=10)
+    assert cache.get_many("m", ["a"]) == [None]
+    cache.put_many("m", ["a", "b"], [vector("a"), vector("b")])
+    assert cache.get_many("m", ["b", "c", "a"]) == [vector("b"), None, vector("a")]
+
+
+def test_least_recently_used_slot_is_reused(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=2)
+    cache.put_many("m", ["a", "b"], [vector("a"), vector("b")])
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["c"], [vector("c")])
+    assert cache.get_many("m", ["a", "b", "c"]) == [vector("a"), None, vector("c")]
+
+
+def test_vectors_of_another_size_start_the_cache_over(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=4)
+    cache.put_many("m", ["a"], [vector("a", 8)])
+    cache.put_many("m", ["b"], [vector("b", 4)])
+    assert cache.get_many("m", ["a", "b"]) == [None, vector("b", 4)]
+    other = EmbeddingCache(str(tmp_path), max_entries=4)  # another process, opened after the change
+    assert other.get_many("m", ["b"]) == [vector("b", 4)]
+
+
+def test_other_process_evicting_never_returns_another_texts_vector(tmp_path):
+    writer, reader = EmbeddingCache(str(tmp_path), max_entries=4), EmbeddingCache(str(tmp_path), max_entries=4)
+    texts = [f"text {i}" for i in range(12)]
+    writer.put_many("m", texts[:4], [vector(t) for t in texts[:4]])
+    wrong = []
+
+    def write():
+        for n in range(200):
+            batch = texts[n % 12:n % 12 + 3]
+            writer.put_many("m", batch, [vector(t) for t in batch])
+
+    def read():
+        for _ in range(200):
+            for t, v in zip(texts, reader.get_many("m", texts)):
+                if v is not None and v != vector(t):
+                    wrong.append(t)
+
+    threads = [Thread(target=write), Thread(target=read)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert wrong == []
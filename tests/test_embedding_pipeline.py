@@ -0,0 +1,48 @@
+# tests/test_embedding_pipeline.py
+import httpx
+import openai
+
+import app
+from app import _retry_delay, embed_with_retry, token_batches
+
+
+def items(*sizes):
+    return [(str(i), "x" * (4 * n), {}) for i, n in enumerate(sizes)]  # n tokens each
+
+
+def test_token_batches_respects_item_and_token_limits():
+    batches = list(token_batches(items(10, 10, 10, 10, 10), max_tokens=25, max_items=10))
+    assert [[i for i, _, _ in b] for b in batches] == [["0", "1"], ["2", "3"], ["4"]]
+    batches = list(token_batches(items(1, 1, 1, 1, 1), max_tokens=1000, max_items=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+
+def test_token_batches_puts_an_oversized_item_on_its_own():
+    batches = list(token_batches(items(5, 100, 5), max_tokens=20, max_items=10))
+    assert [[i for i, _, _ in b] for b in batches] == [["0"], ["1"], ["2"]]
+
+
+def rate_limited(retry_after):
+    request = httpx.Request("POST", "http://localhost/v1/embeddings")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_retry_delay_follows_retry_after():
+    assert _retry_delay(rate_limited("3"), attempt=0) == 3.0
+    assert 0.25 <= _retry_delay(rate_limited("soon"), attempt=0) <= 0.75
+
+
+def test_rate_limited_batch_is_retried(monkeypatch):
+    calls = []
+
+    class Embeddings:
+        def embed_documents(self, texts):
+            calls.append(texts)
+            if len(calls) < 3:
+                raise rate_limited("0")
+            return [[1.0] for _ in texts]
+
+    monkeypatch.setattr(app, "get_embeddings", lambda: Embeddings())
+    assert embed_with_retry(["a", "b"]) == [[1.0], [1.0]]
+    assert len(calls) == 3
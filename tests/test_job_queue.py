@@ -0,0 +1,56 @@
+# tests/test_job_queue.py
+import time
+
+from app import PROGRESS, JobQueue
+
+
+def make_queue(tmp_path, **kw):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **{"workers": 0, "stale_after": 60, **kw})
+
+
+def age_heartbeat(queue, job_id, seconds=3600):
+    with queue._db() as db:
+        db.execute("UPDATE jobs SET heartbeat = heartbeat - ? WHERE job_id = ?", (seconds, job_id))
+
+
+def test_higher_priority_is_claimed_first(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("big", "ingest", {}, priority=0)
+    queue.enqueue("small", "ingest", {}, priority=1)
+    assert queue._claim()[0] == "small"
+    assert queue._claim()[0] == "big"
+    assert queue._claim() is None
+    assert queue.is_active("big")
+
+
+def test_worker_runs_the_job_and_stores_its_result(tmp_path):
+    queue = make_queue(tmp_path, workers=1)
+    queue.register("echo", lambda job_id, value: {"phase": "completed", "pct": 100, "value": value})
+    queue.enqueue("j1", "echo", {"value": 7})
+    queue.start()
+    deadline = time.time() + 10
+    while queue.is_active("j1") and time.time() < deadline:
+        time.sleep(0.05)
+    assert queue.status("j1") == {"phase": "completed", "pct": 100, "value": 7}
+
+
+def test_job_of_a_dead_worker_is_queued_again(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=3)
+    queue.enqueue("j1", "ingest", {"start_pct": 40})
+    queue._claim()
+    age_heartbeat(queue, "j1")
+    queue.requeue_stale()
+    assert queue.status("j1")["phase"] == "queued"
+    assert queue._claim()[0] == "j1"
+
+
+def test_job_that_keeps_killing_its_worker_is_given_up(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue("poison", "ingest", {"start_pct": 40})
+    for _ in range(2):
+        assert queue._claim()[0] == "poison"
+        age_heartbeat(queue, "poison")
+        queue.requeue_stale()
+    assert not queue.is_active("poison")
+    assert queue.status("poison")["phase"] == "error"
+    assert PROGRESS.get("poison")["phase"] == "error"
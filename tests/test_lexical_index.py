@@ -0,0 +1,43 @@
+# tests/test_lexical_index.py
+from app import LexicalIndex, lexical_overlap, query_terms
+
+CHUNKS = [
+    ("c1", "Osmosis moves water across a semipermeable membrane.", {"kind": "page", "start": 1}),
+    ("c2", "Enzymes lower the activation energy of reactions.", {"kind": "page", "start": 2}),
+    ("c3", "Water potential drives osmosis in plant cells.", None),
+]
+
+
+def test_best_matches_come_first_with_their_metadata(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    index.add(CHUNKS)
+    hits = index.search({"osmosis", "membrane"}, k=5)
+    assert [h[0] for h in hits] == ["c1", "c3"]
+    assert hits[0][2] == {"kind": "page", "start": 1}
+    assert hits[1][2] == {}
+    assert all(score > 0 for *_, score in hits)
+
+
+def test_stemming_and_require_all(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    index.add(CHUNKS)
+    assert [h[0] for h in index.search({"enzyme"}, k=5)] == ["c2"]
+    assert [h[0] for h in index.search({"osmosis", "plant"}, k=5, require_all=True)] == ["c3"]
+
+
+def test_ids_already_indexed_are_skipped(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    index.add(CHUNKS)
+    index.add([("c1", "Osmosis again", {})])
+    assert len(index.search({"osmosis"}, k=10)) == 2
+
+
+def test_missing_index_finds_nothing(tmp_path):
+    assert LexicalIndex(str(tmp_path)).search({"osmosis"}, k=5) == []
+
+
+def test_query_terms_drop_stopwords_and_short_words():
+    terms = query_terms("What is the role of osmosis in a cell?")
+    assert "osmosis" in terms and "role" in terms and "cell" in terms
+    assert not terms & {"what", "the", "is", "of", "in", "a"}
+    assert lexical_overlap({"osmosis", "enzyme"}, "Osmosis explained") == 0.5
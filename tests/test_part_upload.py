@@ -0,0 +1,125 @@
+# tests/test_part_upload.py
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+from app import UploadSessions
+
+DATA = bytes(range(256)) * 40  # 10240 bytes: parts of 4096, 4096, 2048
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def open_upload(tmp_path, size=len(DATA)):
+    uploads = UploadSessions(str(tmp_path / "uploads.sqlite3"), str(tmp_path / "partial"), part_size=4096)
+    return uploads, uploads.start("u1", "job1", "notes.txt", size)
+
+
+def put(uploads, info, offset, data=None, checksum=True):
+    data = DATA[offset:offset + info["part_size"]] if data is None else data
+    return uploads.write_part(info, offset, io.BytesIO(data), len(data), sha(data) if checksum else None)
+
+
+def test_upload_resumes_from_the_confirmed_offset(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    assert put(uploads, info, 0) is None
+
+    resumed = uploads.get(info["upload_id"], "u1")  # e.g. after a reload
+    assert resumed["received"] == 4096
+    assert put(uploads, resumed, 4096) is None
+    assert put(uploads, resumed, 8192) is None
+
+    dest = tmp_path / "notes.txt"
+    assert uploads.finish(resumed, str(dest)) is None
+    assert dest.read_bytes() == DATA
+    assert uploads.get(info["upload_id"], "u1") is None
+
+
+def test_bad_part_checksum_leaves_confirmed_bytes_alone(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    assert put(uploads, info, 0) is None
+    corrupt = b"x" * 4096
+    assert uploads.write_part(info, 4096, io.BytesIO(corrupt), 4096, sha(DATA[4096:8192])) == "part checksum mismatch"
+    assert put(uploads, info, 4096, data=b"short") == "part must be 4096 bytes"
+    assert uploads.get(info["upload_id"], "u1")["received"] == 4096
+
+    assert put(uploads, info, 4096) is None
+    assert put(uploads, info, 8192) is None
+    dest = tmp_path / "notes.txt"
+    assert uploads.finish(info, str(dest)) is None
+    assert dest.read_bytes() == DATA
+
+
+def test_duplicate_and_stale_parts_are_rejected(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    stale = dict(info)
+    assert put(uploads, info, 0) is None
+
+    # A retry of part 0 from a copy that has not seen the first one land
+    assert put(uploads, stale, 0, data=b"y" * 4096, checksum=False) == "part already received"
+    assert stale["received"] == 4096
+    assert put(uploads, info, 0) == "expected offset 4096"
+    assert put(uploads, info, 8192) == "expected offset 4096"
+    assert (tmp_path / "partial" / f"{info['upload_id']}.part").read_bytes() == DATA[:4096]
+
+
+def test_concurrent_copies_of_a_part_land_once(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    copies = [dict(info) for _ in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        errors = list(pool.map(lambda i: put(uploads, i, 0), copies))
+    assert errors.count(None) == 1
+    assert set(errors) == {None, "part already received"}
+    assert uploads.get(info["upload_id"], "u1")["received"] == 4096
+    assert not list((tmp_path / "partial").glob("*.spool"))
+
+
+def test_finish_rejects_a_file_that_changed_after_its_parts_were_confirmed(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    for offset in (0, 4096, 8192):
+        assert put(uploads, info, offset) is None
+    part = tmp_path / "partial" / f"{info['upload_id']}.part"
+    part.write_bytes(DATA[:5000] + b"z" + DATA[5001:])
+
+    assert uploads.finish(info, str(tmp_path / "notes.txt")) == "upload checksum mismatch"
+    assert not part.exists() and not (tmp_path / "notes.txt").exists()
+    assert uploads.finish(info, str(tmp_path / "notes.txt")) == "upload already finished"
+
+
+def test_finish_before_the_last_part_is_refused(tmp_path):
+    uploads, info = open_upload(tmp_path)
+    assert put(uploads, info, 0) is None
+    assert uploads.finish(info, str(tmp_path / "notes.txt")) == "upload incomplete"
+    assert put(uploads, info, 4096) is None
+
+
+def test_concurrent_finish_starts_one_ingest(tmp_path, monkeypatch):
+    uploads, _ = open_upload(tmp_path)
+    monkeypatch.setattr(app, "UPLOADS", uploads)
+    monkeypatch.setattr(app, "upload_path", lambda name: str(tmp_path / name))
+    started = []
+    monkeypatch.setattr(app, "start_ingest", lambda job_id, user_id, path, name, append_to: started.append(path) or name)
+
+    monkeypatch.setattr(app, "current_user_id", lambda: "u1")
+    client = app.app.test_client()
+    info = uploads.start("u1", "job1", "notes.txt", len(DATA))
+    for offset in (0, 4096, 8192):
+        resp = client.put(f"/upload/parts/{info['upload_id']}?offset={offset}",
+                          data=DATA[offset:offset + 4096], headers={"X-Part-Sha256": sha(DATA[offset:offset + 4096])})
+        assert resp.status_code == 200
+
+    barrier = threading.Barrier(4)
+
+    def finish(_):
+        barrier.wait()
+        return app.app.test_client().post(f"/upload/parts/{info['upload_id']}/finish").status_code
+
+    with ThreadPoolExecutor(4) as pool:
+        statuses = sorted(pool.map(finish, range(4)))
+    assert statuses[0] == 200 and all(s in (404, 409) for s in statuses[1:])
+    assert len(started) == 1
+    assert (tmp_path / "notes.txt").read_bytes() == DATA
@@ -0,0 +1,51 @@
+# tests/test_progress.py
+import pytest
+
+from app import MemoryProgressStore, SQLiteProgressStore, merge_progress
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryProgressStore()
+    return SQLiteProgressStore(str(tmp_path / "progress.sqlite3"))
+
+
+def test_pct_never_moves_backwards(store):
+    store.set("j", {"phase": "queued", "pct": 40})
+    store.update("j", phase="Processing", pct=70)
+    assert store.update("j", phase="Processing", pct=50)["pct"] == 70
+    assert store.get("j") == {"phase": "Processing", "pct": 70}
+
+
+def test_an_error_reports_its_own_pct():
+    done = {"phase": "completed", "pct": 100}
+    assert merge_progress(done, {"phase": "error", "pct": 60})["pct"] == 60
+    assert merge_progress(done, {"phase": "error"})["pct"] == 100
+
+
+def test_subscribers_see_updates_made_in_this_process(store):
+    q = store.subscribe("j")
+    store.update("j", phase="Processing", pct=10)
+    assert q.get_nowait()["pct"] == 10
+    store.unsubscribe("j", q)
+    store.update("j", pct=20)
+    assert q.empty()
+
+
+def test_expired_and_popped_states_are_gone(store):
+    store.ttl = -1
+    store.set("old", {"phase": "completed", "pct": 100})
+    if store.shared:
+        assert store.get("old") is None
+    store.ttl = 3600
+    store.set("j", {"phase": "completed", "pct": 100})
+    assert store.pop("j")["phase"] == "completed"
+    assert store.get("j") is None
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "progress.sqlite3")
+    worker, web = SQLiteProgressStore(path), SQLiteProgressStore(path)
+    worker.update("j", phase="Processing", pct=55)
+    assert web.get("j") == {"phase": "Processing", "pct": 55}
@@ -0,0 +1,71 @@
+# tests/test_progress_stream.py
+import json
+import threading
+import time
+
+import anyio
+
+import app
+import asgi
+from app import PROGRESS
+
+THREADED = {"wsgi.multithread": True}
+
+
+def events(body):
+    return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+
+
+def test_sync_worker_is_sent_back_to_polling():
+    resp = app.app.test_client().get("/progress/any/stream")
+    assert resp.status_code == 503
+
+
+def test_stream_ends_with_the_job_and_frees_its_slot():
+    PROGRESS.set("done-job", {"phase": "completed", "pct": 100})
+    free = app._progress_streams._value
+    resp = app.app.test_client().get("/progress/done-job/stream", environ_overrides=THREADED)
+    assert resp.status_code == 200
+    assert events(resp.get_data(as_text=True)) == [{"ok": True, "phase": "completed", "pct": 100}]
+    resp.close()
+    assert app._progress_streams._value == free
+
+
+def test_streams_past_the_cap_are_refused():
+    taken = 0
+    while app._progress_streams.acquire(blocking=False):
+        taken += 1
+    try:
+        resp = app.app.test_client().get("/progress/any/stream", environ_overrides=THREADED)
+        assert resp.status_code == 503
+    finally:
+        for _ in range(taken):
+            app._progress_streams.release()
+
+
+def test_asgi_stream_sends_each_change_once(monkeypatch):
+    monkeypatch.setattr(asgi, "PROGRESS_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(asgi, "PROGRESS_IDLE_INTERVAL", 0.1)
+    PROGRESS.set("live-job", {"phase": "queued", "pct": 40})
+    sent = []
+
+    async def send(message):
+        sent.append(message.get("body", b"").decode())
+
+    def job():  # another process writing the shared store
+        for pct in (60, 80):
+            time.sleep(0.3)
+            PROGRESS.update("live-job", phase="Processing", pct=pct)
+        time.sleep(0.3)
+        PROGRESS.update("live-job", phase="completed", pct=100)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(asgi.PROGRESS_WATCHER.run)
+            threading.Thread(target=job).start()
+            await asgi.progress_stream("live-job", send)
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert [e["pct"] for e in events("".join(sent))] == [40, 60, 80, 100]
+    assert asgi.PROGRESS_WATCHER._jobs == {}
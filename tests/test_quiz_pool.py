@@ -0,0 +1,121 @@
+# tests/test_quiz_pool.py
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from app import JobQueue, QuizPool
+
+
+def questions(n, tag):
+    return [{"question": f"{tag} {i}?", "choices": ["A) a", "B) b", "C) c", "D) d"], "correct": "A"} for i in range(n)]
+
+
+def test_only_questions_of_the_current_version_are_served(tmp_path):
+    pool = QuizPool(str(tmp_path / "pool.sqlite3"))
+    pool.add("nb", 0, questions(3, "old"))
+    pool.add("nb", 1, questions(2, "new"))
+    assert pool.available("nb", 1) == 2
+    assert pool.take("nb", 3, 1) is None  # stale questions do not make up the shortfall
+    quiz = pool.take("nb", 2, 1)
+    assert sorted(q["question"].split(": ", 1)[1] for q in quiz) == ["new 0?", "new 1?"]
+    assert pool.available("nb", 0) == 0  # dropped once a newer version was asked for
+
+
+def test_pool_written_before_versioning_is_upgraded(tmp_path):
+    path = str(tmp_path / "pool.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE quiz_questions (id INTEGER PRIMARY KEY AUTOINCREMENT, persist_dir TEXT NOT NULL, "
+                "question TEXT NOT NULL, created_at REAL NOT NULL)")
+    db.execute("INSERT INTO quiz_questions (persist_dir, question, created_at) VALUES ('nb', '{}', 0)")
+    db.commit()
+    db.close()
+    assert QuizPool(path).available("nb", 0) == 1
+
+
+QUIZ_TEXT = "\n\n".join(
+    f"Question {i}: q{i}?\nA) a\nB) b\nC) c\nD) d\nCorrect Answer: A" for i in range(1, 4)
+)
+
+
+class FakeStore:
+    """Stands in for the notebook's Chroma collection."""
+
+    def __init__(self, error=None, delete_on_get=False):
+        self.error = error
+        self.delete_on_get = delete_on_get
+        self.persist_dir = None
+        self._collection = self
+
+    def count(self):
+        return 40
+
+    def get(self, **kw):
+        if self.delete_on_get:
+            delete_notebook(self.persist_dir)
+        if self.error:
+            raise self.error
+        return {"documents": ["Osmosis moves water across a membrane."]}
+
+
+def run_refill(monkeypatch, tmp_path, store, during_call=None):
+    from contextlib import contextmanager
+    from types import SimpleNamespace
+
+    import app
+
+    persist_dir = store.persist_dir = str(tmp_path / "notebook")
+    os.makedirs(persist_dir)
+    pool = QuizPool(str(tmp_path / "pool.sqlite3"))
+
+    def create(**kw):
+        if during_call:
+            during_call(persist_dir)
+        message = SimpleNamespace(content=QUIZ_TEXT)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(app, "QUIZ_POOL", pool)
+    monkeypatch.setattr(app, "get_openai_client", lambda: client)
+    monkeypatch.setattr(app.VECTORSTORES, "open", contextmanager(lambda d: (yield store)))
+    return pool, persist_dir, app._run_quiz_pool_job("quizpool-test", persist_dir)
+
+
+def delete_notebook(persist_dir):
+    import app
+
+    app.DOCUMENTS.bump_version(persist_dir)
+    shutil.rmtree(persist_dir)
+
+
+def test_refill_fills_the_pool(monkeypatch, tmp_path):
+    pool, persist_dir, state = run_refill(monkeypatch, tmp_path, FakeStore())
+    assert state["phase"] == "completed" and state["generated"] > 0
+    assert pool.available(persist_dir, 0) == state["generated"]
+
+
+def test_notebook_deleted_during_refill_leaves_no_questions(monkeypatch, tmp_path):
+    pool, persist_dir, state = run_refill(monkeypatch, tmp_path, FakeStore(), during_call=delete_notebook)
+    assert state["stopped"] and state["generated"] == 0
+    with pool._db() as db:
+        assert db.execute("SELECT COUNT(*) FROM quiz_questions").fetchone()[0] == 0
+
+
+def test_collection_dropped_with_the_notebook_ends_the_refill_cleanly(monkeypatch, tmp_path):
+    store = FakeStore(error=RuntimeError("Collection does not exist"), delete_on_get=True)
+    _, _, state = run_refill(monkeypatch, tmp_path, store)
+    assert state["stopped"]
+
+
+def test_collection_error_on_a_live_notebook_still_fails_the_job(monkeypatch, tmp_path):
+    with pytest.raises(RuntimeError):
+        run_refill(monkeypatch, tmp_path, FakeStore(error=RuntimeError("boom")))
+
+
+def test_cancelled_refill_is_never_claimed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    queue.enqueue("quizpool-x", "quiz_pool", {"persist_dir": "x"}, priority=-1)
+    queue.cancel("quizpool-x")
+    assert not queue.is_active("quizpool-x")
+    assert queue._claim() is None
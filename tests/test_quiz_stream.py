@@ -0,0 +1,37 @@
+# tests/test_quiz_stream.py
+from app import QuizStreamParser, parse_quiz
+
+QUIZ = (
+    "Question 1: What moves water across a membrane?\n"
+    "A) Osmosis\nB) Friction\nC) Gravity\nD) Magnetism\n"
+    "Correct Answer: A\n\n"
+    "Question 2: What speeds up a reaction?\n"
+    "A) Substrate\nB) Enzyme\nC) Product\nD) Solvent\n"
+    "Correct Answer: B"
+)
+
+
+def test_pieces_give_the_same_questions_as_the_whole_text():
+    parser = QuizStreamParser()
+    got = []
+    for i in range(0, len(QUIZ), 7):
+        got.extend(parser.feed(QUIZ[i:i + 7]))
+    got.extend(parser.close())
+    assert got == parse_quiz(QUIZ)
+    assert [q["correct"] for q in got] == ["A", "B"]
+
+
+def test_question_is_emitted_once_its_answer_line_ends():
+    parser = QuizStreamParser()
+    first = QUIZ.split("\n\n")[0]
+    assert parser.feed(first) == []  # answer line may still be growing
+    out = parser.feed("\n")
+    assert len(out) == 1 and out[0]["question"].startswith("Question 1")
+    assert out[0]["choices"][0] == "A) Osmosis"
+
+
+def test_malformed_blocks_are_dropped():
+    parser = QuizStreamParser()
+    out = parser.feed("Here is your quiz:\n\n" + QUIZ + "\n\n")
+    assert [q["question"][:10] for q in out] == ["Question 1", "Question 2"]
+    assert parser.close() == []
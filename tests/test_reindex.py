@@ -0,0 +1,67 @@
+# tests/test_reindex.py
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import LexicalIndex
+
+
+class FakeStore:
+    """Stands in for the notebook's Chroma collection."""
+
+    def __init__(self):
+        self.ids = {"old-chunk"}
+        self._collection = self
+
+    def reset_collection(self):
+        self.ids = set()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.ids.update(ids)
+
+
+def setup_notebook(monkeypatch, tmp_path, bad_files=(), embed_error=None):
+    (tmp_path / "notebook").mkdir()
+    persist_dir = str(tmp_path / "notebook")
+    LexicalIndex(persist_dir).add([("old-chunk", "old text", None)])
+    entries = [{"path": f"/gone/{name}", "source": name, "file_hash": name} for name in ("a.pdf", "b.pdf")]
+
+    def chunks(files, on_file):
+        for i, (_, name, _) in enumerate(files):
+            if name in bad_files:
+                on_file(i, 0, "cannot parse", None)
+                continue
+            on_file(i, 2, None, name)
+            yield from [(f"{name} part {n}", {"source": name}) for n in range(2)]
+
+    def embed(texts):
+        if embed_error:
+            raise embed_error
+        return [[0.0] * 3 for _ in texts]
+
+    store = FakeStore()
+    monkeypatch.setattr(app, "ARTIFACTS", SimpleNamespace(files=lambda d: entries, has_records=lambda h: True))
+    monkeypatch.setattr(app, "iter_batch_chunks", chunks)
+    monkeypatch.setattr(app, "embed_with_retry", embed)
+    monkeypatch.setattr(app.VECTORSTORES, "open", contextmanager(lambda d: (yield store)))
+    return persist_dir, store
+
+
+def test_rebuild_replaces_the_old_chunks(monkeypatch, tmp_path):
+    persist_dir, store = setup_notebook(monkeypatch, tmp_path)
+    assert app.reindex_notebook(persist_dir) == {"files": 2, "chunks": 4}
+    assert len(store.ids) == 4 and "old-chunk" not in store.ids
+    assert LexicalIndex(persist_dir).search(["part"], 10)
+
+
+@pytest.mark.parametrize("failure", [{"bad_files": ("b.pdf",)}, {"embed_error": RuntimeError("quota")}])
+def test_failed_rebuild_keeps_the_old_index(monkeypatch, tmp_path, failure):
+    persist_dir, store = setup_notebook(monkeypatch, tmp_path, **failure)
+    version = app.DOCUMENTS.version(persist_dir)
+    with pytest.raises((ValueError, RuntimeError)):
+        app.reindex_notebook(persist_dir)
+    assert store.ids == {"old-chunk"}
+    assert [hit[0] for hit in LexicalIndex(persist_dir).search(["old"], 10)] == ["old-chunk"]
+    assert app.DOCUMENTS.version(persist_dir) == version
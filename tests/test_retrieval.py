@@ -0,0 +1,32 @@
+# tests/test_retrieval.py
+from app import pack_context, rerank_mmr
+
+
+def test_rerank_mmr_relevance_only_keeps_rank_order():
+    vectors = [[1, 0], [0, 1], [1, 1]]
+    assert rerank_mmr([1, 0], vectors, [0.2, 0.9, 0.5], k=3, lam=1.0) == [1, 2, 0]
+
+
+def test_rerank_mmr_skips_near_duplicates():
+    vectors = [[1, 0], [1, 0], [0, 1]]
+    relevance = [1.0, 0.99, 0.5]
+    assert rerank_mmr([1, 0], vectors, relevance, k=2, lam=0.5) == [0, 2]
+
+
+def test_rerank_mmr_k_bounds():
+    assert rerank_mmr([1, 0], [], [], k=3) == []
+    assert sorted(rerank_mmr([1, 0], [[1, 0], [0, 1]], [0.5, 0.4], k=5)) == [0, 1]
+
+
+def test_pack_context_fills_budget_past_a_chunk_that_does_not_fit():
+    chunks = [{"id": "a", "tokens": 60}, {"id": "b", "tokens": 50}, {"id": "c", "tokens": 30}]
+    packed, used = pack_context(chunks, budget=100)
+    assert [c["id"] for c in packed] == ["a", "c"]
+    assert used == 90
+
+
+def test_pack_context_stops_at_max_chunks():
+    chunks = [{"id": str(i), "tokens": 1} for i in range(10)]
+    packed, used = pack_context(chunks, budget=100, max_chunks=3)
+    assert [c["id"] for c in packed] == ["0", "1", "2"]
+    assert used == 3